@@ -0,0 +1,99 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+"""
+Benchmark of the DFP steps on the replay backend.
+
+The report, the download and the upload of the creatives are run on the fixtures of :mod:`adscan.replay` with the
+latency and the faults of DFP imitated, for each number of clients. Synthetic fixtures are generated unless a fixture
+directory recorded by the `record` backend is given.
+
+Usage:
+
+  PYTHONPATH=src python bench/bench_dfp.py --creatives 20000 --latency 0.5 --fault-rate 0.02 --clients 1 4 8
+"""
+
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import adscan.dfp
+import adscan.replay
+import adscan.transform
+
+
+def measure(client_count, upload_count, batch_size):
+  """
+  Run the DFP steps on the replay backend and print their timings.
+
+  :param client_count: the number of clients used concurrently.
+  :param upload_count: the number of creatives uploaded.
+  :param batch_size: the number of creatives uploaded at once.
+  """
+  start = time.time()
+  records = list(adscan.dfp.run_report_service_job(adscan.dfp.create_report_service_job()))
+  report_seconds = time.time() - start
+
+  start = time.time()
+  statements = adscan.dfp.create_creative_service_statement(
+    [creative_id for creative_id, impressions in records], only_new=False)
+  dfp_creatives = adscan.dfp.run_creative_service_statements(statements, client_count=client_count)
+  download_seconds = time.time() - start
+
+  start = time.time()
+  creatives = [adscan.transform.from_dfp(dfp) for dfp in dfp_creatives]
+  transform_seconds = time.time() - start
+
+  start = time.time()
+  updated = adscan.dfp.upload_creatives(dfp_creatives[:upload_count], batch_size=batch_size, client_count=client_count)
+  upload_seconds = time.time() - start
+
+  print '%8d %8d %10.2f %10.2f %10.2f %10.2f %8d' % (
+    client_count, len(creatives), report_seconds, download_seconds, transform_seconds, upload_seconds, len(updated))
+
+
+def main():
+  """
+  Run the benchmark.
+  """
+  parser = argparse.ArgumentParser(description='Benchmark the DFP steps on the replay backend.')
+  parser.add_argument('--creatives', type=int, default=20000, help='the number of synthetic creatives')
+  parser.add_argument('--fixture-dir', help='the directory of recorded fixtures used instead of synthetic ones')
+  parser.add_argument('--latency', type=float, default=0.5, help='the average number of seconds of a call')
+  parser.add_argument('--fault-rate', type=float, default=0.0, help='the probability that a call fails')
+  parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 8], help='the numbers of clients')
+  parser.add_argument('--upload', type=int, default=1000, help='the number of creatives uploaded')
+  parser.add_argument('--batch-size', type=int, default=100, help='the number of creatives uploaded at once')
+  args = parser.parse_args()
+
+  work_dir = None
+  fixture_dir = args.fixture_dir
+  if not fixture_dir:
+    work_dir = fixture_dir = tempfile.mkdtemp()
+    adscan.replay.generate_fixtures(fixture_dir, args.creatives)
+  try:
+    print '%8s %8s %10s %10s %10s %10s %8s' % (
+      'clients', 'creatives', 'report', 'download', 'transform', 'upload', 'updated')
+    for client_count in args.clients:
+      # Each run has a new client, so the uploads of the previous run do not change the fixtures.
+      adscan.dfp.set_backend('replay', fixture_dir, latency=args.latency, fault_rate=args.fault_rate)
+      measure(client_count, args.upload, args.batch_size)
+  finally:
+    if work_dir:
+      shutil.rmtree(work_dir)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,202 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+"""
+Benchmark of the queries run on the creative and scanlog tables.
+
+A SQLite database is filled with creatives, their caches and scan logs of several days, and the query plans and
+timings of the queries in the browse and compliance check steps, and the cache lookup in the download step, are printed
+without and with the indexes declared in :mod:`adscan.model`. The compliance is also aggregated with
+:class:`adscan.compliance.ComplianceAggregator` as the scan logs arrive while browsing, which needs no query.
+
+Usage:
+
+  PYTHONPATH=src python bench/bench_queries.py --creatives 20000 --urls 10 --days 7
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import datetime
+import tempfile
+
+from sqlalchemy import text
+
+import adscan.db
+from adscan.issue import IssueType
+from adscan.model import Creative, CreativeCache, ScanLog
+from adscan.compliance import COMPLIANT_ISSUES, ComplianceAggregator
+
+
+def create_queries(today, ids):
+  """
+  Create the queries to be measured.
+
+  :param today: the date of the scan.
+  :param ids: a list of creative ids looked up in the cache.
+  :return: a list of tuples of a name and a SQL statement.
+  """
+  params = {
+    'creative_cache': CreativeCache.__tablename__,
+    'scanlog': ScanLog.__tablename__,
+    'today': today.isoformat(),
+    'ids': ','.join([str(i) for i in ids]),
+    'compliant': ','.join([str(i) for i in COMPLIANT_ISSUES])
+  }
+  queries = [
+    ('browse: count the scan logs to delete',
+     "select count(*) from %(scanlog)s where created_at = '%(today)s' and protocol = 'https'"),
+    # The scan logs are only aggregated by the query when the protocol was browsed by another scanner.
+    ('compliance: aggregate the scan logs of a protocol',
+     "select creative_id, count(coalesce(url_id, url)), "
+     "sum(case when issue_id not in (%(compliant)s) then 1 else 0 end) from %(scanlog)s "
+     "where created_at = '%(today)s' and protocol = 'https' group by creative_id"),
+    ('download: cache lookup',
+     "select creative_id, snippet_ref, expanded_snippet_ref from %(creative_cache)s where creative_id in (%(ids)s)")
+  ]
+  return [(name, sql % params) for name, sql in queries]
+
+
+def populate(engine, creative_count, url_count, days):
+  """
+  Fill the tables with the creatives and scan logs of the days.
+
+  :param engine: the engine of the database.
+  :param creative_count: the number of creatives scanned a day.
+  :param url_count: the number of urls requested by each creative.
+  :param days: the number of days.
+  """
+  today = datetime.date.today()
+  issues = [IssueType.NO_ISSUE] * 8 + [IssueType.HTTPS_AVAIL, IssueType.INVALID_CERT]
+  for day in xrange(0, days):
+    created_at = today - datetime.timedelta(days=day)
+    creatives = [{
+      'created_at': created_at,
+      'creative_id': creative_id,
+      'snippet': '<img src="https://example.com/%d.png">' % creative_id
+    } for creative_id in xrange(1, creative_count + 1)]
+    engine.execute(Creative.__table__.insert(), creatives)
+    if day == 0:
+      engine.execute(CreativeCache.__table__.insert(), [{
+        'created_at': created_at,
+        'creative_id': creative_id,
+        'snippet_ref': '%040x' % creative_id
+      } for creative_id in xrange(1, creative_count + 1)])
+
+    for protocol in ['https', 'http']:
+      logs = []
+      for creative_id in xrange(1, creative_count + 1):
+        for i in xrange(0, url_count):
+          logs.append({
+            'created_at': created_at,
+            'creative_id': creative_id,
+            'issue_id': random.choice(issues),
+            'url_id': (creative_id * url_count + i) * 2 + (protocol == 'http'),
+            'protocol': protocol
+          })
+      engine.execute(ScanLog.__table__.insert(), logs)
+    print 'Populated %s.' % created_at
+
+
+def measure(engine, queries, repeat):
+  """
+  Print the query plan and the best time of each query.
+
+  :param engine: the engine of the database.
+  :param queries: a list of tuples of a name and a SQL statement.
+  :param repeat: the number of times each query is run.
+  """
+  for name, sql in queries:
+    plan = engine.execute(text('explain query plan %s' % sql)).fetchall()
+    best = None
+    for _ in xrange(0, repeat):
+      start = time.time()
+      rows = engine.execute(text(sql)).fetchall()
+      elapsed = time.time() - start
+      best = elapsed if best is None else min(best, elapsed)
+    print '%s: %.4fs (%d rows)' % (name, best, len(rows))
+    for row in plan:
+      print '  %s' % (row[-1],)
+
+
+def measure_aggregator(engine, repeat):
+  """
+  Print the best time to aggregate today's scan logs with :class:`ComplianceAggregator`, which is done as they arrive
+  while browsing. The scan logs are read before the timing.
+
+  :param engine: the engine of the database.
+  :param repeat: the number of times the scan logs are aggregated.
+  """
+  logs = engine.execute(text(
+    "select creative_id, issue_id, protocol, url_id from %s where created_at = '%s'" % (
+      ScanLog.__tablename__, datetime.date.today().isoformat()))).fetchall()
+  best = None
+  for _ in xrange(0, repeat):
+    start = time.time()
+    aggregator = ComplianceAggregator()
+    for creative_id, issue_id, protocol, url_id in logs:
+      aggregator.add(creative_id, issue_id, protocol, url=url_id)
+    results = aggregator.results()
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  print 'compliance: aggregate while browsing: %.4fs (%d scan logs, %d creatives)' % (
+    best, len(logs), len(results[0]) + len(results[1]))
+
+
+def main():
+  """
+  Run the benchmark.
+  """
+  parser = argparse.ArgumentParser(description='Benchmark the queries on the creative and scanlog tables.')
+  parser.add_argument('--creatives', type=int, default=20000, help='the number of creatives scanned a day')
+  parser.add_argument('--urls', type=int, default=10, help='the number of urls requested by each creative')
+  parser.add_argument('--days', type=int, default=7, help='the number of days kept in the database')
+  parser.add_argument('--repeat', type=int, default=3, help='the number of times each query is run')
+  args = parser.parse_args()
+
+  work_dir = tempfile.mkdtemp()
+  try:
+    engine = adscan.db.new_engine('sqlite:///%s' % os.path.join(work_dir, 'bench.db'))
+    for table in [Creative, CreativeCache, ScanLog]:
+      table.__table__.create(engine)
+    for table in [Creative, ScanLog]:
+      for index in table.__table__.indexes:
+        index.drop(engine)
+
+    random.seed(0)
+    populate(engine, args.creatives, args.urls, args.days)
+    queries = create_queries(datetime.date.today(), random.sample(xrange(1, args.creatives + 1), min(args.creatives, 1000)))
+
+    print '\n== Without indexes =='
+    measure(engine, queries, args.repeat)
+
+    start = time.time()
+    for table in [Creative, ScanLog]:
+      adscan.db.migrate_table(engine, table)
+    engine.execute('analyze')
+    print '\nThe indexes were created in %.2fs.' % (time.time() - start)
+
+    print '\n== With indexes =='
+    measure(engine, queries, args.repeat)
+
+    print '\n== Without queries =='
+    measure_aggregator(engine, args.repeat)
+  finally:
+    shutil.rmtree(work_dir)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,87 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+"""
+Benchmark of the startup time of the scanner.
+
+Each command is run in a new Python process several times, and the best and median wall-clock times are printed with
+the heavy libraries the process imported. The DFP library is only imported when the scanner calls DFP.
+
+Usage:
+
+  python bench/bench_startup.py --repeat 10
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+
+# The libraries whose import is deferred to the code paths that need them.
+HEAVY_MODULES = ['googleads', 'requests', 'lxml.cssselect']
+
+
+def create_commands(src_dir):
+  """
+  Create the commands to be measured.
+
+  :param src_dir: the source directory.
+  :return: a list of tuples of a name and a list of the command and its arguments.
+  """
+  report = 'import sys; print ",".join(m for m in %r if m in sys.modules) or "-"' % HEAVY_MODULES
+  return [
+    ('python', [sys.executable, '-c', 'pass']),
+    ('import adscan.scanner', [sys.executable, '-c', 'import adscan.scanner; %s' % report]),
+    ('run.py --help', [sys.executable, os.path.join(src_dir, 'adscan', 'run.py'), '--help'])
+  ]
+
+
+def measure(command, repeat, env):
+  """
+  Run the command and return its times and the output of the last run.
+
+  :param command: a list of the command and its arguments.
+  :param repeat: the number of times the command is run.
+  :param env: the environment variables.
+  :return: a tuple of a sorted list of the times and the output.
+  """
+  times = []
+  output = ''
+  for _ in xrange(0, repeat):
+    start = time.time()
+    output = subprocess.check_output(command, env=env)
+    times.append(time.time() - start)
+  return (sorted(times), output)
+
+
+def main():
+  """
+  Run the benchmark.
+  """
+  parser = argparse.ArgumentParser(description='Benchmark the startup time of the scanner.')
+  parser.add_argument('--repeat', type=int, default=10, help='the number of times each command is run')
+  args = parser.parse_args()
+
+  src_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+  env = dict(os.environ, PYTHONPATH=src_dir)
+  for name, command in create_commands(src_dir):
+    times, output = measure(command, args.repeat, env)
+    print '%s: best %.3fs, median %.3fs' % (name, times[0], times[len(times) / 2])
+    if name.startswith('import'):
+      print '  heavy modules imported: %s' % output.strip()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
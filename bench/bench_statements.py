@@ -0,0 +1,76 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+"""
+Benchmark of the size of the CreativeService statements.
+
+The total size of the queries built by :func:`adscan.dfp.create_creative_service_statement`, which has a chunk of ids
+in each statement, is compared with the previous statements, which had all the ids in every statement and were paged
+with OFFSET.
+
+Usage:
+
+  PYTHONPATH=src python bench/bench_statements.py --ids 1000 10000 100000
+"""
+
+import sys
+import random
+import argparse
+
+import adscan.dfp
+
+
+def create_offset_statements(creative_ids, page_size):
+  """
+  Create the statements that have all the ids and are paged with OFFSET.
+
+  :param creative_ids: a list of creative ids.
+  :param page_size: the number of creatives in a page.
+  :return: a list of statements.
+  """
+  id_str = ','.join(str(i) for i in creative_ids)
+  return [{
+    'query': 'WHERE lastModifiedDateTime > :date AND id IN (%s) LIMIT %d OFFSET %d' % (id_str, page_size, offset),
+    'values': []
+  } for offset in xrange(0, len(creative_ids), page_size)]
+
+
+def total_bytes(statements):
+  """
+  Return the total size of the queries of the statements.
+  """
+  return sum(len(stmt['query']) for stmt in statements)
+
+
+def main():
+  """
+  Run the benchmark.
+  """
+  parser = argparse.ArgumentParser(description='Compare the size of the CreativeService statements.')
+  parser.add_argument('--ids', type=int, nargs='+', default=[1000, 10000, 100000], help='the numbers of creative ids')
+  args = parser.parse_args()
+
+  page_size = adscan.dfp.PAGE_LIMIT
+  random.seed(0)
+  print '%10s %12s %16s %16s %8s' % ('ids', 'statements', 'offset bytes', 'chunked bytes', 'ratio')
+  for count in args.ids:
+    creative_ids = random.sample(xrange(10000000000, 100000000000), count)
+    offset_bytes = total_bytes(create_offset_statements(creative_ids, page_size))
+    chunked = adscan.dfp.create_creative_service_statement(creative_ids, days_ago=2, page_size=page_size)
+    chunked_bytes = total_bytes(chunked)
+    print '%10d %12d %16d %16d %8.1f' % (count, len(chunked), offset_bytes, chunked_bytes,
+                                         float(offset_bytes) / chunked_bytes)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,367 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+"""
+Classes that analyze creatives without browsers.
+
+Some types of creatives are nothing more than a URL of an image or a VAST document. Browsing them with PhantomJS only
+produces a request to the URL itself, so we can get the same scan log by sending requests to the URLs directly.
+
+In the same way, HTML snippets that contain no scripts, frames or plugin objects are static. The requests they make
+can be found by parsing the snippets, so they are also scanned without browsers.
+"""
+
+import re
+import time
+import Queue
+import urlparse
+import threading
+import lxml.etree
+
+import adscan.net
+import adscan.transform
+from adscan.issue import IssueType
+from adscan.browser import BrowserHost
+from adscan.deadline import ThroughputEstimator
+
+
+# The creative types whose snippet is a URL of an image.
+IMAGE_CREATIVE_TYPES = ['ImageCreative', 'ImageRedirectCreative', 'ImageRedirectOverlayCreative', 'AspectRatioImageCreative']
+
+# The creative types whose snippet is a URL of a VAST document.
+VAST_CREATIVE_TYPES = ['VastRedirectCreative']
+
+# The creative types whose snippet is an HTML tag that can be static.
+HTML_CREATIVE_TYPES = ['CustomCreative', 'ThirdPartyCreative']
+
+# The VAST elements whose text is a URL requested by video players.
+VAST_URL_ELEMENTS = [
+  'MediaFile', 'Impression', 'Tracking', 'ClickTracking', 'CompanionClickTracking', 'NonLinearClickTracking',
+  'StaticResource', 'IFrameResource'
+]
+
+# The VAST element whose text is a URL of the next VAST document in a wrapper chain.
+VAST_WRAPPER_ELEMENT = 'VASTAdTagURI'
+
+# The status codes of the responses that redirect to their location.
+REDIRECT_CODES = [301, 302, 303, 307, 308]
+
+
+def find_vast_urls(xml):
+  """
+  Find the URLs in a VAST document.
+
+  :param xml: a string that contains a VAST document.
+  :return: a tuple of a list of URLs requested by video players and a list of URLs of wrapped VAST documents.
+  """
+  urls = []
+  wrapper_urls = []
+  try:
+    doc = lxml.etree.fromstring(xml)
+  except (lxml.etree.XMLSyntaxError, ValueError):
+    return (urls, wrapper_urls)
+
+  for node in doc.iter():
+    if not isinstance(node.tag, basestring):
+      continue
+    tag = re.sub(r'^\{.*\}', '', node.tag)
+    text = (node.text or '').strip()
+    if not re.match(r'^https?\:', text, re.IGNORECASE):
+      continue
+    if tag == VAST_WRAPPER_ELEMENT:
+      wrapper_urls.append(text)
+    elif tag in VAST_URL_ELEMENTS:
+      urls.append(text)
+  return (urls, wrapper_urls)
+
+
+class AnalyzerHost(threading.Thread):
+  """
+  Class that sends requests to the urls of creatives one by one, and reports the urls and issue ids in the same way as
+  :class:`adscan.browser.BrowserHost` does.
+
+  The redirects are followed one hop at a time, and every hop is reported as the browsers do. No request is sent to a
+  private network; such urls are reported with :attr:`IssueType.PRIVATE_NETWORK` as browser.js does.
+  """
+
+  def __init__(self, creative_urls, protocol, callback=None, max_wrapper_depth=5, verify=True, debug=False,
+               max_redirects=20, timeout=None):
+    """
+    Initialize the instance.
+
+    :param creative_urls: an iterable of tuples of a creative key and a tuple of its creative type and urls to be
+      scanned. The creatives are taken one by one, so the iterable can hand out the creatives shared with other
+      analyzers.
+    :param protocol: the protocol used for the scan, 'https' or 'http'.
+    :param callback: the function called for passing the urls and issue ids found during this scanning process.
+    :param max_wrapper_depth: the maximum number of VAST wrappers to follow.
+    :param verify: a boolean value that indicates whether the urls are checked. If False, the urls are passed to the
+      callback without issue ids.
+    :param debug: Turn on the debug mode, which allows access to private network that host test creatives.
+    :param max_redirects: the maximum number of redirects followed from a url.
+    :param timeout: the number of seconds to wait for each server, or None to wait forever.
+    """
+    threading.Thread.__init__(self)
+    self.creative_urls = creative_urls
+    self.protocol = protocol
+    self.callback = callback
+    self.max_wrapper_depth = max_wrapper_depth
+    self.verify = verify
+    self.debug = debug
+    self.max_redirects = max_redirects
+    self.timeout = timeout
+    self.session = None
+    self.abort = False
+
+  def _request(self, url):
+    """
+    Send a GET request to the url without following redirects. The certificate is not verified, as browsers accept any
+    certificate while browsing.
+
+    :param url: a url.
+    :return: the response, or None if no response was received.
+    """
+    try:
+      return self.session.get(url, verify=False, allow_redirects=False, timeout=self.timeout)
+    except Exception:
+      return None
+
+  def _scan_url(self, url, issues):
+    """
+    Send a request to the url and follow its redirects, and store the issue id of each hop. Each hop is checked with
+    :meth:`adscan.browser.BrowserHost.verify_http_url`, so its issue id is the same as the one the browsers report.
+
+    :param url: the url to be scanned.
+    :param issues: a dictionary of urls and issue ids, into which the result is stored.
+    :return: the last response, or None if there is none or the last hop was scanned before.
+    """
+    for _ in xrange(0, self.max_redirects + 1):
+      if url in issues:
+        return None
+      if not self.debug and adscan.net.is_private_network(url):
+        issues[url] = IssueType.PRIVATE_NETWORK
+        return None
+      res = self._request(url)
+      issues[url] = BrowserHost.verify_http_url(self.session, url, timeout=self.timeout) if self.verify else None
+      if res is None or res.status_code not in REDIRECT_CODES or 'location' not in res.headers:
+        return res
+      url = urlparse.urljoin(url, res.headers['location'])
+    return None
+
+  def _collect_vast_urls(self, url, issues, depth=0):
+    """
+    Send a request to the VAST document and collect the urls found in the document and its wrapped documents.
+
+    :param url: the url of a VAST document.
+    :param issues: a dictionary of urls and issue ids, into which the result is stored.
+    :param depth: the depth of the wrapper chain.
+    """
+    if url in issues:
+      return
+    res = self._scan_url(url, issues)
+    if res is not None and res.status_code < 400 and res.content:
+      urls, wrapper_urls = find_vast_urls(res.content)
+      for media_url in urls:
+        self._scan_url(media_url, issues)
+      if depth < self.max_wrapper_depth:
+        for wrapper_url in wrapper_urls:
+          self._collect_vast_urls(wrapper_url, issues, depth=depth + 1)
+
+  def _verify_each_url(self, creative_id, creative_type, urls):
+    """
+    Send requests to the urls of the creative and the urls they lead to, and report their issue ids.
+
+    :param creative_id: a creative id.
+    :param creative_type: the creative type.
+    :param urls: a list of the urls to be scanned.
+    """
+    issues = {}
+    for url in urls:
+      if creative_type in VAST_CREATIVE_TYPES:
+        self._collect_vast_urls(url, issues)
+      else:
+        self._scan_url(url, issues)
+
+    if self.callback:
+      for found_url, issue_id in issues.iteritems():
+        self.callback(creative_id, issue_id, self.protocol, url=found_url)
+      if not issues:
+        self.callback(creative_id, IssueType.NO_EXTERNAL, self.protocol)
+
+  def run(self):
+    """
+    Start analyzing the urls one by one.
+    """
+    import requests
+    self.session = requests.Session()
+    self.session.max_redirects = 100
+    for creative_id, (creative_type, urls) in self.creative_urls:
+      if self.abort:
+        break
+      self._verify_each_url(creative_id, creative_type, urls)
+
+  def shutdown(self):
+    """
+    Prevent the next analysis to shutdown this analyzer.
+    """
+    self.abort = True
+
+
+class AnalyzerController(object):
+  """
+  Class that picks up the creatives that can be scanned without browsers and allots them to AnalyzerHost instances.
+  """
+
+  @classmethod
+  def find_snippet_urls(cls, creative, snippet, protocol):
+    """
+    Find the urls to be scanned if the snippet of the creative can be scanned without browsers.
+
+    :param creative: an instance of :class:`~model.Creative`.
+    :param snippet: the snippet to be scanned.
+    :param protocol: a protocol, `https` or `http`.
+    :return: a list of urls, or None if the snippet should be scanned with browsers.
+    """
+    if not snippet:
+      return None
+    if creative.creative_type in IMAGE_CREATIVE_TYPES + VAST_CREATIVE_TYPES:
+      if re.match(r'^https?\:', snippet, re.IGNORECASE):
+        return [snippet.strip()]
+    elif creative.creative_type in HTML_CREATIVE_TYPES:
+      return adscan.transform.find_static_urls(snippet, protocol, allow_http=protocol == 'http')
+    return None
+
+  @classmethod
+  def find_urls(cls, creative, protocol):
+    """
+    Find the urls to be scanned if the creative can be scanned without browsers. A creative is scanned without browsers
+    only if both of its scan snippets can be, so that the requests over http and https are found in the same way and
+    their numbers can be compared.
+
+    :param creative: an instance of :class:`~model.Creative`. Its scan snippets should be created before.
+    :param protocol: a protocol, `https` or `http`.
+    :return: a list of urls, or None if the creative should be scanned with browsers.
+    """
+    urls = {}
+    for scan_protocol, snippet in [('https', creative.modified_scan_snippet), ('http', creative.scan_snippet)]:
+      urls[scan_protocol] = cls.find_snippet_urls(creative, snippet, scan_protocol)
+      if urls[scan_protocol] is None:
+        return None
+    return urls[protocol]
+
+  def __init__(self, protocol, analyzer_count, log_func, verify=True, debug=False, timeout=None, deadline=None):
+    """
+    Initiate an instance.
+
+    :param protocol: a protocol, `https` or `http`.
+    :param analyzer_count: a number of analyzer threads to be launched.
+    :param log_func: the function called for passing the urls and issue ids found during this scanning process.
+    :param verify: a boolean value that indicates whether the urls are checked.
+    :param debug: Turn on the debug mode, which allows access to private network that host test creatives.
+    :param timeout: the number of seconds the analyzers wait for each server, or None to wait forever.
+    :param deadline: an instance of :class:`adscan.deadline.Deadline`. If set, the analyzers stop taking creatives
+      when the next one is not expected to finish before the deadline.
+    """
+    self.protocol = protocol
+    self.analyzer_count = analyzer_count
+    self.log_func = log_func
+    self.verify = verify
+    self.debug = debug
+    self.timeout = timeout
+    self.creative_urls = {}
+    self.static_count = 0
+    self.threads = []
+    # The queue of tuples of the negated priority, the order in the list and a creative.
+    self.jobs = Queue.PriorityQueue()
+    self.deadline = deadline
+    self.estimator = ThroughputEstimator()
+
+  def assign(self, creatives):
+    """
+    Take the creatives that can be scanned without browsers. The scan snippets of the creatives should be created before.
+
+    :param creatives: a list of creatives.
+    :return: a list of creatives that should be scanned with browsers.
+    """
+    remaining = []
+    for creative in creatives:
+      urls = self.find_urls(creative, self.protocol)
+      if urls is None:
+        remaining.append(creative)
+      else:
+        self.creative_urls[str(creative.creative_id)] = (creative.creative_type, urls)
+        self.jobs.put((-(creative.priority or 0), len(self.creative_urls), creative))
+        if creative.creative_type in HTML_CREATIVE_TYPES:
+          self.static_count += 1
+    return remaining
+
+  def _take_creative_urls(self):
+    """
+    Take the creatives from the shared queue in the order of their priority.
+
+    :return: a generator of tuples of a creative key and a tuple of its creative type and urls to be scanned.
+    """
+    started = None
+    while True:
+      # The analyzer asks for the next creative when it finished the previous one.
+      if started is not None:
+        self.estimator.add(time.time() - started)
+      if self.deadline and not self.deadline.allows(self.estimator.estimate()):
+        return
+      try:
+        _, _, creative = self.jobs.get_nowait()
+      except Queue.Empty:
+        return
+      started = time.time()
+      key = str(creative.creative_id)
+      yield (key, self.creative_urls[key])
+
+  def deferred_creatives(self):
+    """
+    Return the creatives left in the queue after the analyzers stopped for the deadline.
+
+    :return: a list of creatives.
+    """
+    creatives = []
+    while True:
+      try:
+        creatives.append(self.jobs.get_nowait()[2])
+      except Queue.Empty:
+        return creatives
+
+  def start(self):
+    """
+    Start analyzers. The analyzers share a queue of the creatives, and each analyzer takes the creative with the
+    highest priority when it finishes the previous one.
+    """
+    for i in xrange(0, min(self.analyzer_count, len(self.creative_urls))):
+      thread = AnalyzerHost(
+        self._take_creative_urls(), self.protocol, self.log_func, verify=self.verify, debug=self.debug,
+        timeout=self.timeout)
+      thread.start()
+      self.threads.append(thread)
+
+  def wait(self):
+    """
+    Wait until all the threads done.
+    """
+    for thread in self.threads:
+      if thread and thread.isAlive():
+        thread.join()
+
+  def shutdown(self):
+    """
+    Close all the analyzer threads.
+    """
+    for thread in self.threads:
+      if thread and thread.isAlive():
+        thread.shutdown()
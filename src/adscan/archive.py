@@ -0,0 +1,145 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+"""
+Functions that archive old rows of the database into files and read them back.
+
+The rows of a table created on the same date are saved in a single gzip-compressed JSON file,
+`{archive_dir}/{table}/{YYYY-MM-DD}.json.gz`. The file is columnar: it has a list of values for each column, which
+compresses much better than a list of rows because the values in a column are alike.
+"""
+
+import os
+import os.path
+import gzip
+import json
+import datetime
+
+import adscan.fs
+
+
+ARCHIVE_SUFFIX = '.json.gz'
+
+
+def archive_file(archive_dir, table_name, date):
+  """
+  Return the path to the archive file of the table on the date.
+
+  :param archive_dir: the directory in which archive files are saved.
+  :param table_name: the name of the table.
+  :param date: the date when the rows were created.
+  :return: the path to the archive file.
+  """
+  return os.path.join(archive_dir, table_name, '%s%s' % (date.isoformat(), ARCHIVE_SUFFIX))
+
+
+def _to_json(value):
+  """
+  Convert a value of a column to a value that can be serialized into JSON.
+  """
+  if isinstance(value, (datetime.date, datetime.datetime)):
+    return value.isoformat()
+  return value
+
+
+def write_archive(archive_dir, table_name, date, columns, rows):
+  """
+  Save all the rows of the table created on the date into the archive file of the date. The file is replaced if it
+  exists, so writing the rows of a date again, e.g. after the rows failed to be deleted, does not duplicate them. The
+  source rows should be deleted only after this function returns.
+
+  :param archive_dir: the directory in which archive files are saved.
+  :param table_name: the name of the table.
+  :param date: the date when the rows were created.
+  :param columns: a list of the column names.
+  :param rows: an iterable of tuples of the values in the order of `columns`. The rows are read one by one.
+  :return: the path to the archive file.
+  :raise Exception: if the existing file of the date has other columns. The file is left as it is.
+  """
+  path = archive_file(archive_dir, table_name, date)
+  if os.path.exists(path) and sorted(_read_file(path)['columns'].keys()) != sorted(columns):
+    raise Exception('The archive file %s has other columns than %s.' % (path, ', '.join(columns)))
+
+  data = {'table': table_name, 'date': date.isoformat(), 'columns': dict((column, []) for column in columns)}
+  for row in rows:
+    for column, value in zip(columns, row):
+      data['columns'][column].append(_to_json(value))
+
+  # Write into a temporary file first, so that a broken file is never left.
+  adscan.fs.makedirs(os.path.dirname(path))
+  tmp_path = '%s.tmp' % path
+  try:
+    fp = gzip.open(tmp_path, 'wb')
+    try:
+      json.dump(data, fp, separators=(',', ':'))
+    finally:
+      fp.close()
+    os.rename(tmp_path, path)
+  except Exception:
+    if os.path.exists(tmp_path):
+      os.remove(tmp_path)
+    raise
+  return path
+
+
+def _read_file(path):
+  """
+  Read an archive file.
+
+  :param path: the path to the archive file.
+  :return: a dictionary of the table name, the date and the columns.
+  """
+  fp = gzip.open(path, 'rb')
+  try:
+    return json.load(fp)
+  finally:
+    fp.close()
+
+
+def archived_dates(archive_dir, table_name):
+  """
+  Return the dates of which rows of the table are archived.
+
+  :param archive_dir: the directory in which archive files are saved.
+  :param table_name: the name of the table.
+  :return: a sorted list of dates.
+  """
+  table_dir = os.path.join(archive_dir, table_name)
+  if not os.path.exists(table_dir):
+    return []
+  dates = []
+  for filename in os.listdir(table_dir):
+    if filename.endswith(ARCHIVE_SUFFIX):
+      dates.append(datetime.datetime.strptime(filename[:-len(ARCHIVE_SUFFIX)], '%Y-%m-%d').date())
+  return sorted(dates)
+
+
+def read_archive(archive_dir, table_name, start_date, end_date=None, columns=None):
+  """
+  Read the archived rows of the table created between the dates.
+
+  :param archive_dir: the directory in which archive files are saved.
+  :param table_name: the name of the table.
+  :param start_date: the first date of the rows.
+  :param end_date: the last date of the rows. Only the rows of `start_date` are read if None.
+  :param columns: a list of the column names to be read. All the columns are read if None.
+  :return: a generator of dictionaries of column names and values. Dates are ISO 8601 strings.
+  """
+  end_date = end_date or start_date
+  for date in archived_dates(archive_dir, table_name):
+    if date < start_date or date > end_date:
+      continue
+    data = _read_file(archive_file(archive_dir, table_name, date))['columns']
+    names = columns or data.keys()
+    count = len(data[names[0]]) if names else 0
+    for i in xrange(0, count):
+      yield dict((name, data[name][i]) for name in names)
@@ -19,12 +19,13 @@ import os.path
 import re
 import json
 import time
+import Queue
 import socket
-import requests
 import threading
 import subprocess
 
 from adscan.issue import IssueType
+from adscan.deadline import ThroughputEstimator
 
 
 class BrowserHost(threading.Thread):
@@ -36,18 +37,20 @@ class BrowserHost(threading.Thread):
   """
 
   @classmethod
-  def verify_http_url(cls, session, url):
+  def verify_http_url(cls, session, url, timeout=None):
     """
     Check if the url is avaiable over https or not.
 
     :param session: the session of requests library.
     :param url: the URL found on the log file. Its protocol should be either of http or https.
+    :param timeout: the number of seconds to wait for the server, or None to wait forever.
     :return: an issue id defined in :class:`adscan.issue.IssueType`.
     """
+    import requests
     issue_id = IssueType.NO_ISSUE if re.match(r'^https', url) else IssueType.HTTPS_AVAIL
     try:
       req_url = re.sub(r'^http\:', 'https:', url)
-      res = session.get(req_url, verify=True, allow_redirects=True)
+      res = session.get(req_url, verify=True, allow_redirects=True, timeout=timeout)
       if res.status_code == 403:
         issue_id = IssueType.INVALID_CERT
       if res.status_code >= 500:
@@ -60,11 +63,13 @@ class BrowserHost(threading.Thread):
       issue_id = IssueType.NO_SSL_SERVER
     return issue_id
 
-  def __init__(self, creative_urls, protocol, phantomjs, browserjs, display_id, log_dir, cookie_dir, callback=None, debug=False):
+  def __init__(self, creative_urls, protocol, phantomjs, browserjs, display_id, log_dir, cookie_dir, callback=None, debug=False,
+               verify=True):
     """
     Initialize the instance.
 
-    :param creative_urls: a dictionary of a creative key and its url to be scanned.
+    :param creative_urls: an iterable of tuples of a creative key and its url to be scanned. The urls are taken one by
+      one while browsing, so the iterable can hand out the creatives shared with other browsers.
     :param protocol: the server protocol, 'https' or 'http'.
     :param phantomjs: the path to the phantomjs command.
     :param browserjs: the path to the browser.js file.
@@ -73,6 +78,8 @@ class BrowserHost(threading.Thread):
     :param cookie_dir: the directory that contains cookies used by browsers while scanning.
     :param callback: the function called for passing the urls and issue ids found during this scanning process.
     :param debug: Turn on the debug mode, which temporarily to allow access to private network that host test creatives.
+    :param verify: a boolean value that indicates whether the requested urls are checked. If False, the urls are passed
+      to the callback without issue ids, which is enough for counting the requests.
     """
     threading.Thread.__init__(self)
     self.creative_urls = creative_urls
@@ -84,6 +91,7 @@ class BrowserHost(threading.Thread):
     self.cookie_dir = cookie_dir
     self.callback = callback
     self.debug = debug
+    self.verify = verify
     self.abort = False
 
   def _run_command(self, command):
@@ -116,6 +124,7 @@ class BrowserHost(threading.Thread):
 
     found = False
 
+    import requests
     session = requests.Session()
     session.max_redirects = 100
     if data:
@@ -134,7 +143,7 @@ class BrowserHost(threading.Thread):
             continue
           elif re.match(r'^http', url):
             found = True
-            issue_id = self.verify_http_url(session, url)
+            issue_id = self.verify_http_url(session, url) if self.verify else None
         if self.callback:
           self.callback(creative_id, issue_id, self.protocol, url=url)
 
@@ -174,7 +183,7 @@ class BrowserHost(threading.Thread):
     Start browsing the urls one by one.
     """
     try:
-      for creative_id, url_obj in self.creative_urls.iteritems():
+      for creative_id, url_obj in self.creative_urls:
         if self.abort:
           break
         elif url_obj:
@@ -210,7 +219,8 @@ class BrowserController(object):
     with open(dest_file, 'w') as fp:
       fp.write(html.encode('utf-8'))
 
-  def __init__(self, creatives, protocol, ports, browser_count, phantomjs, browserjs, cookie_dir, workspace, log_func, modify_func, debug=False, xserver_offset=1):
+  def __init__(self, creatives, protocol, ports, browser_count, phantomjs, browserjs, cookie_dir, workspace, log_func, modify_func, debug=False, xserver_offset=1,
+               verify=True, deadline=None):
     """
     Initiate an instance.
 
@@ -223,9 +233,12 @@ class BrowserController(object):
     :param cookie_dir: the directory that contains cookies, which will be used by browsers during scanning.
     :param workspace: the directory where the html files and scan logs are saved.
     :param log_func: the function called for passing the urls and issue ids found during this scanning process.
-    :param modify_func: the function called for modifying the creatives.
+    :param modify_func: the function called for modifying the creatives. None if the scan snippets are already created.
     :param debug: Turn on the debug mode, which temporarily to allow access to private network that host test creatives.
     :param xserver_offset: an offset number, from which we will reserve IDs of X servers.
+    :param verify: a boolean value that indicates whether the requested urls are checked.
+    :param deadline: an instance of :class:`adscan.deadline.Deadline`. If set, the browsers stop taking creatives when
+      the next one is not expected to finish before the deadline.
     """
     self.creatives = creatives
     self.protocol = protocol
@@ -241,62 +254,98 @@ class BrowserController(object):
     self.hostname = socket.gethostname()
     self.debug = debug
     self.xserver_offset = xserver_offset
+    self.verify = verify
+    # The queue of tuples of the negated priority, the order in the list and a creative.
+    self.jobs = Queue.PriorityQueue()
+    self.deadline = deadline
+    self.estimator = ThroughputEstimator()
 
-  def _create_urls_to_scan(self, creatives, port):
+  def _create_url_to_scan(self, creative, port):
     """
-    Create urls to scan these creatives.
+    Create the url to scan the creative.
 
-    :param creatives: a list of creatives.
-    :param port: the port number used to scan these creatives.
-    :return: a dictionary of a creative id and its url to be scanned.
+    :param creative: a creative.
+    :param port: the port number used to scan the creative.
+    :return: a dictionary of the url, or None if the creative has no snippet to be scanned.
     """
-    url_dict = {}
-    for creative in creatives:
+    if self.modify_func:
       self.modify_func(creative)
-      snippet = creative.modified_scan_snippet if self.protocol == 'https' else creative.scan_snippet
-
-      if snippet:
-        url_obj = None
-        if re.match(r'^http', snippet, re.IGNORECASE):
-          url_obj = {
-            'url': snippet,
-            'hosted_locally': 'false'
-          }
-        else:
-          save_file = '%s/%s.html' % (self.workspace, creative.creative_id)
-          self.create_html(snippet, save_file)
-          url_obj = {
-            'url': '%s://%s:%d/%s' % (self.protocol, self.hostname, port, save_file),
-            'hosted_locally': 'true'
-          }
-        url_obj['iplookup_url'] = '%s://%s:%d/iplookup' % (self.protocol, self.hostname, port)
-        url_dict[str(creative.creative_id)] = url_obj
-    return url_dict
+    snippet = creative.modified_scan_snippet if self.protocol == 'https' else creative.scan_snippet
+    if not snippet:
+      return None
+
+    if re.match(r'^http', snippet, re.IGNORECASE):
+      url_obj = {
+        'url': snippet,
+        'hosted_locally': 'false'
+      }
+    else:
+      save_file = '%s/%s.html' % (self.workspace, creative.creative_id)
+      self.create_html(snippet, save_file)
+      url_obj = {
+        'url': '%s://%s:%d/%s' % (self.protocol, self.hostname, port, save_file),
+        'hosted_locally': 'true'
+      }
+    url_obj['iplookup_url'] = '%s://%s:%d/iplookup' % (self.protocol, self.hostname, port)
+    return url_obj
+
+  def _take_urls_to_scan(self, port):
+    """
+    Take the creatives from the shared queue in the order of their priority, and create their urls to scan.
+
+    :param port: the port number used to scan the creatives.
+    :return: a generator of tuples of a creative id and its url to be scanned.
+    """
+    started = None
+    while True:
+      # The browser asks for the next creative when it finished the previous one.
+      if started is not None:
+        self.estimator.add(time.time() - started)
+      if self.deadline and not self.deadline.allows(self.estimator.estimate()):
+        return
+      try:
+        _, _, creative = self.jobs.get_nowait()
+      except Queue.Empty:
+        return
+      url_obj = self._create_url_to_scan(creative, port)
+      started = None
+      if url_obj:
+        started = time.time()
+        yield (str(creative.creative_id), url_obj)
+
+  def deferred_creatives(self):
+    """
+    Return the creatives left in the queue after the browsers stopped for the deadline.
+
+    :return: a list of creatives.
+    """
+    creatives = []
+    while True:
+      try:
+        creatives.append(self.jobs.get_nowait()[2])
+      except Queue.Empty:
+        return creatives
 
   def start(self):
     """
-    Start browsers.
+    Start browsers. The browsers share a queue of the creatives, and each browser takes the creative with the highest
+    priority when it finishes the previous one, so the creatives that matter most are scanned first however long each
+    scan takes.
     """
-    # Caluculate how many creatives are allotted to each browser process.
-    allotment = len(self.creatives) / self.browser_count
-    if allotment == 0:
-      allotment = 1
-    if len(self.creatives) % allotment != 0:
-      allotment += 1
-
-    for i in xrange(0, self.browser_count):
+    for order, creative in enumerate(self.creatives):
+      self.jobs.put((-(creative.priority or 0), order, creative))
+
+    for i in xrange(0, min(self.browser_count, len(self.creatives))):
       display_id = self.xserver_offset + i + 1
       log_dir = '%s/%d' % (self.workspace, i)
-
-      allotted_creatives = self.creatives[(i * allotment):((i + 1) * allotment)]
       allotted_port = self.ports[i % len(self.ports)]
 
-      url_dict = self._create_urls_to_scan(allotted_creatives, allotted_port)
-      if len(url_dict) > 0:
-        thread = BrowserHost(url_dict, self.protocol, self.phantomjs, self.browserjs, display_id, log_dir, self.cookie_dir, self.log_func, self.debug)
-        thread.start()
-        self.threads.append(thread)
-        time.sleep(1)
+      thread = BrowserHost(
+        self._take_urls_to_scan(allotted_port), self.protocol, self.phantomjs, self.browserjs, display_id, log_dir,
+        self.cookie_dir, self.log_func, self.debug, self.verify)
+      thread.start()
+      self.threads.append(thread)
+      time.sleep(1)
 
   def wait(self):
     """
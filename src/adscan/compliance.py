@@ -0,0 +1,128 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+"""
+Classes that aggregate the SSL compliance of creatives while they are scanned.
+
+Every scan log is added to the aggregator as it arrives, so the compliance and request match status of all the
+creatives are known as soon as browsing finishes, without querying the scan logs of the day again.
+"""
+
+import threading
+
+from adscan.issue import IssueType
+
+
+# The issue ids that do not make creatives non-compliant.
+COMPLIANT_ISSUES = [IssueType.NO_ISSUE, IssueType.NO_EXTERNAL]
+
+
+class CreativeCompliance(object):
+  """
+  Class that represents the compliance state of a creative. A count is None if the creative was not scanned over the
+  protocol.
+  """
+  __slots__ = ('noncompliant', 'https_count', 'http_count')
+
+  def __init__(self):
+    """
+    Initialize the instance.
+    """
+    self.noncompliant = False
+    self.https_count = None
+    self.http_count = None
+
+
+class ComplianceAggregator(object):
+  """
+  Class that keeps the compliance state of each creative. The scan logs can be added from multiple threads.
+  """
+
+  def __init__(self):
+    """
+    Initialize the instance.
+    """
+    self.lock = threading.Lock()
+    self.states = {}
+    # The protocols whose scan logs are added to this aggregator.
+    self.protocols = set()
+
+  def reset(self, protocol):
+    """
+    Clear the state of the protocol before the creatives are scanned over it.
+
+    :param protocol: an HTTP protocol, `https` or `http`.
+    """
+    with self.lock:
+      for creative_id, state in self.states.items():
+        setattr(state, '%s_count' % protocol, None)
+        if protocol == 'https':
+          state.noncompliant = False
+        if state.https_count is None and state.http_count is None:
+          del self.states[creative_id]
+      self.protocols.add(protocol)
+
+  def add(self, creative_id, issue_id, protocol, url=None):
+    """
+    Add a scan log. The arguments are the same as the ones of :meth:`adscan.scanner.Scanner.scanlog`.
+
+    :param creative_id: a creative id.
+    :param issue_id: an issue id defined in :class:`adscan.issue.IssueType`.
+    :param protocol: an HTTP protocol, `https` or `http`.
+    :param url: a URL.
+    """
+    with self.lock:
+      state = self.states.get(int(creative_id))
+      if state is None:
+        state = self.states[int(creative_id)] = CreativeCompliance()
+      attr = '%s_count' % protocol
+      setattr(state, attr, (getattr(state, attr) or 0) + (1 if url is not None else 0))
+      if protocol == 'https' and issue_id is not None and issue_id not in COMPLIANT_ISSUES:
+        state.noncompliant = True
+
+  def load(self, protocol, rows):
+    """
+    Load the state of the protocol that was aggregated from the scan logs in the database.
+
+    :param protocol: an HTTP protocol, `https` or `http`.
+    :param rows: a list of tuples of a creative id, the number of urls and the number of non-compliant scan logs.
+    """
+    self.reset(protocol)
+    with self.lock:
+      for creative_id, url_count, noncompliant_count in rows:
+        state = self.states.get(int(creative_id))
+        if state is None:
+          state = self.states[int(creative_id)] = CreativeCompliance()
+        setattr(state, '%s_count' % protocol, url_count or 0)
+        if protocol == 'https' and noncompliant_count:
+          state.noncompliant = True
+
+  def results(self):
+    """
+    Return the creative ids grouped by their compliance and request match status. The request match status is only
+    given to the creatives scanned over http.
+
+    :return: a tuple of lists of compliant ids, non-compliant ids, request matched ids and request unmatched ids.
+    """
+    compliant_ids, noncompliant_ids, match_ids, unmatch_ids = [], [], [], []
+    with self.lock:
+      for creative_id, state in self.states.iteritems():
+        if state.noncompliant:
+          noncompliant_ids.append(creative_id)
+        else:
+          compliant_ids.append(creative_id)
+        if state.http_count is not None:
+          if state.https_count == state.http_count:
+            match_ids.append(creative_id)
+          else:
+            unmatch_ids.append(creative_id)
+    return (compliant_ids, noncompliant_ids, match_ids, unmatch_ids)
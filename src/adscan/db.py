@@ -16,11 +16,95 @@ Utility functions for handling databases.
 Requires SQLAlchemy.
 """
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, select, exists, literal, and_, MetaData, Table, Column, Integer
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import sessionmaker
 
 
-def new_session(database, table, drop_if_exist=False):
+# The SQLite settings applied to each connection with PRAGMA statements of the same names.
+SQLITE_PRAGMAS = ['busy_timeout', 'cache_size', 'journal_mode', 'mmap_size', 'synchronous', 'temp_store']
+
+# The settings of the connection pool used for server databases.
+POOL_OPTIONS = ['pool_size', 'max_overflow', 'pool_recycle']
+
+# The name of the temporary table into which ids are loaded by :func:`load_ids`.
+BULK_ID_TABLE = 'bulk_id'
+
+# Presets of the engine options. Options set explicitly take precedence over the preset.
+PRESETS = {
+  'default': {},
+  'bulk': {
+    # Write-ahead logging lets the readers and the writer work at the same time, and the "NORMAL" synchronous level
+    # only syncs at checkpoints in WAL mode.
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': '-262144',  # 256MB.
+    'mmap_size': '1073741824',  # 1GB.
+    'busy_timeout': '60000',
+    'temp_store': 'MEMORY',
+    'pool_size': '10',
+    'max_overflow': '20'
+  }
+}
+
+
+def engine_options(options):
+  """
+  Resolve the preset in the options and drop the empty values.
+
+  :param options: a dictionary of engine options such as the ones in the Database section of config.ini.
+  :return: a dictionary of engine options.
+  """
+  options = dict(options or {})
+  preset = options.pop('preset', None) or 'default'
+  if preset not in PRESETS:
+    raise ValueError('Unknown database preset: %s' % preset)
+  resolved = dict(PRESETS[preset])
+  for key, value in options.iteritems():
+    if value is not None and str(value).strip() != '':
+      resolved[key] = str(value).strip()
+  return resolved
+
+
+def new_engine(database, options=None):
+  """
+  Create a new engine for the database. The SQLite settings in `options` are applied to each new connection with
+  PRAGMA statements, and the pool settings are applied to the databases other than SQLite.
+
+  :param database: a string that represents the location of database.
+  :param options: a dictionary of engine options. See `PRESETS` for the available options.
+  :return: a new engine.
+  """
+  options = engine_options(options)
+  is_sqlite = make_url(database).get_backend_name() == 'sqlite'
+
+  kwargs = {}
+  if not is_sqlite:
+    for key in POOL_OPTIONS:
+      if key in options:
+        kwargs[key] = int(options[key])
+  engine = create_engine(database, **kwargs)
+
+  if is_sqlite:
+    pragmas = []
+    for key in SQLITE_PRAGMAS:
+      if key in options:
+        value = options[key]
+        if not value.lstrip('-').isdigit() and not value.isalpha():
+          raise ValueError('Invalid value for %s: %s' % (key, value))
+        pragmas.append('PRAGMA %s = %s' % (key, value))
+
+    if pragmas:
+      @event.listens_for(engine, 'connect')
+      def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+          cursor.execute(pragma)
+        cursor.close()
+  return engine
+
+
+def new_session(database, table, drop_if_exist=False, options=None):
   """
   Create a new session for the database and the table(s). Create the table(s) if they do not exist yet. Multiple tables
   can be specified.
@@ -29,9 +113,10 @@ def new_session(database, table, drop_if_exist=False):
   :param table: a string or a list that represents the table(s) to use.
   :param drop_if_exist: a boolean value that indicates the existing table(s) will be dropped if True. Otherwise, the
     table(s) will not be dropped.
+  :param options: a dictionary of engine options passed to :func:`new_engine`.
   :return: a new session.
   """
-  engine = create_engine(database)
+  engine = new_engine(database, options)
   if isinstance(table, list):
     for _table in table:
       create_table(engine, _table, drop_if_exist)
@@ -43,13 +128,119 @@ def new_session(database, table, drop_if_exist=False):
 
 def create_table(engine, table, drop_if_exist=False):
   """
-  Create a new table.
+  Create a new table, or a view if the table class has the `__view__` attribute, which is the SELECT statement of the
+  view.
 
   :param engine: a string that represents the location of database.
   :param table: a string that represents the table to create.
   :param drop_if_exist: a boolean value that indicates the existing table will be dropped if True. Otherwise, the table
     will not be dropped.
   """
+  view = getattr(table, '__view__', None)
+  if view:
+    exists = table.__tablename__ in inspect(engine).get_view_names()
+    if exists and drop_if_exist:
+      engine.execute('DROP VIEW %s' % table.__tablename__)
+    if not exists or drop_if_exist:
+      engine.execute('CREATE VIEW %s AS %s' % (table.__tablename__, view))
+    return
+
   if drop_if_exist:
     table.__table__.drop(engine, checkfirst=True)
   table.__table__.create(engine, checkfirst=True)
+  migrate_table(engine, table)
+
+
+def migrate_table(engine, table):
+  """
+  Add the columns and indexes that are defined in the table class but do not exist in the database yet. This lets the
+  databases created by older versions keep working after new columns or indexes are added to the table classes.
+
+  :param engine: the engine of the database.
+  :param table: the table class to migrate.
+  """
+  inspector = inspect(engine)
+  existing = set(column['name'] for column in inspector.get_columns(table.__tablename__))
+  for column in table.__table__.columns:
+    if column.name not in existing:
+      column_type = column.type.compile(dialect=engine.dialect)
+      engine.execute('ALTER TABLE %s ADD COLUMN %s %s' % (table.__tablename__, column.name, column_type))
+
+  existing = set(index['name'] for index in inspector.get_indexes(table.__tablename__))
+  for index in table.__table__.indexes:
+    if index.name not in existing:
+      print 'Creating index %s on %s.' % (index.name, table.__tablename__)
+      index.create(engine)
+
+
+def load_ids(session, ids, name=BULK_ID_TABLE):
+  """
+  Load the ids into a temporary table on the connection of the session. The ids are inserted with a parameterized bulk
+  insert, so that the statements that use them do not grow with the number of ids. The table is only visible in the
+  current transaction of the session, and it is emptied every time this function is called.
+
+  :param session: a session.
+  :param ids: a list of integer ids.
+  :param name: the name of the temporary table.
+  :return: the temporary table, which has a single column `id`.
+  """
+  table = Table(name, MetaData(), Column('id', Integer, primary_key=True, autoincrement=False), prefixes=['TEMPORARY'])
+  # SQLite commits the open transaction before the statements that look up or create a table, so the table is only
+  # looked up once on each connection, which keeps the temporary table as long as the connection.
+  connection = session.connection()
+  created = connection.info.setdefault('temporary_tables', set())
+  if name not in created:
+    table.create(connection, checkfirst=True)
+    created.add(name)
+  session.execute(table.delete())
+  rows = [{'id': int(i)} for i in set(ids)]
+  if rows:
+    session.execute(table.insert(), rows)
+  return table
+
+
+def update_by_ids(session, column, ids, values, *criteria):
+  """
+  Update the rows whose `column` is one of the ids. The ids are loaded with :func:`load_ids`, so any number of ids can
+  be updated with a single statement.
+
+  :param session: a session.
+  :param column: the column of a table class that the ids are matched with, e.g. `Creative.creative_id`.
+  :param ids: a list of integer ids.
+  :param values: a dictionary of column names and the values to be updated.
+  :param criteria: additional criteria of the rows to be updated.
+  :return: the number of updated rows.
+  """
+  ids_table = load_ids(session, ids)
+  table = column.property.columns[0].table
+  stmt = table.update().where(
+    and_(column.in_(select([ids_table.c.id])), *criteria)
+  ).values(**values)
+  return session.execute(stmt).rowcount
+
+
+def insert_new_ids(session, column, ids, values=None):
+  """
+  Insert a row for each id that does not have a row yet. A row exists if its `column` is the id and its columns have
+  the `values`. The new rows have the id and the `values`. The ids are loaded with :func:`load_ids`, and the rows are
+  inserted with a single INSERT ... SELECT statement.
+
+  :param session: a session.
+  :param column: the column of a table class that the ids are stored in, e.g. `Creative.creative_id`.
+  :param ids: a list of integer ids.
+  :param values: a dictionary of column names and the values of the rows.
+  :return: a tuple of the numbers of the inserted ids and the existing ids.
+  """
+  values = values or {}
+  ids_table = load_ids(session, ids)
+  id_count = session.query(ids_table.c.id).count()
+  table = column.property.columns[0].table
+  names = [column.property.columns[0].name] + values.keys()
+
+  rows = select(
+    [ids_table.c.id] + [literal(value, type_=table.c[name].type) for name, value in values.iteritems()]
+  ).where(
+    ~exists().where(and_(column == ids_table.c.id, *[table.c[name] == value for name, value in values.iteritems()]))
+  )
+  new_count = session.execute(table.insert().from_select(names, rows)).rowcount
+  return (new_count, id_count - new_count)
@@ -0,0 +1,126 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+"""
+Classes that keep a scan within a time budget.
+
+The browsers measure how long each creative takes, and stop taking new creatives when the next one would not finish
+before the deadline. The creatives being browsed are finished, and the creatives left are deferred to the next run.
+"""
+
+import copy
+import time
+import datetime
+import threading
+
+
+def parse_deadline(value, now=None):
+  """
+  Parse a deadline given as a time of day, `HH:MM`. A time earlier than now is the time of the next day.
+
+  :param value: a string of the time of day. An empty string means no deadline.
+  :param now: the current datetime. The current local time is used if None.
+  :return: a datetime, or None if no deadline is given.
+  """
+  if not value:
+    return None
+  now = now or datetime.datetime.now()
+  time_of_day = datetime.datetime.strptime(value.strip(), '%H:%M').time()
+  deadline = datetime.datetime.combine(now.date(), time_of_day)
+  if deadline <= now:
+    deadline += datetime.timedelta(days=1)
+  return deadline
+
+
+class ThroughputEstimator(object):
+  """
+  Class that estimates how long a browser takes for a creative from the durations observed so far. Recent durations
+  weigh more, so the estimate follows slow creatives at the end of a run. Durations can be added from multiple threads.
+  """
+
+  def __init__(self, alpha=0.2):
+    """
+    Initialize the instance.
+
+    :param alpha: the weight of a new duration in the moving average.
+    """
+    self.alpha = alpha
+    self.lock = threading.Lock()
+    self.average = None
+    self.count = 0
+
+  def add(self, seconds):
+    """
+    Add the duration of a creative.
+
+    :param seconds: the number of seconds a browser took for a creative.
+    """
+    with self.lock:
+      if self.average is None:
+        self.average = float(seconds)
+      else:
+        self.average += self.alpha * (seconds - self.average)
+      self.count += 1
+
+  def estimate(self):
+    """
+    Return the estimated number of seconds for the next creative, or 0 if no duration has been observed.
+    """
+    with self.lock:
+      return self.average or 0.0
+
+
+class Deadline(object):
+  """
+  Class that represents the time by which the scan should finish. A part of the time is reserved for the steps after
+  browsing, such as checking the compliance and uploading the creatives.
+  """
+
+  def __init__(self, end_time, reserve_seconds=0, margin=1.5, clock=time.time):
+    """
+    Initialize the instance.
+
+    :param end_time: a datetime of the deadline.
+    :param reserve_seconds: the number of seconds reserved before the deadline for the steps after browsing.
+    :param margin: the factor applied to the estimated duration of the next creative.
+    :param clock: the function that returns the current time in seconds since the epoch.
+    """
+    self.end = time.mktime(end_time.timetuple())
+    self.reserve_seconds = reserve_seconds
+    self.margin = margin
+    self.clock = clock
+
+  def remaining(self):
+    """
+    Return the number of seconds left for browsing.
+    """
+    return self.end - self.reserve_seconds - self.clock()
+
+  def allows(self, seconds):
+    """
+    Return True if a task that takes `seconds` is expected to finish in time.
+
+    :param seconds: the estimated number of seconds of the task.
+    :return: a boolean value.
+    """
+    return self.remaining() > seconds * self.margin
+
+  def reserve_share(self, share):
+    """
+    Return a deadline that leaves a share of the time left for browsing to a later pass.
+
+    :param share: the share of the time left, between 0 and 1.
+    :return: an instance of :class:`Deadline` that ends earlier.
+    """
+    deadline = copy.copy(self)
+    deadline.reserve_seconds += max(self.remaining(), 0) * share
+    return deadline
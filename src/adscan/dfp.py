@@ -15,23 +15,106 @@ Utility functions for handling DoubleClick for Publishers (DFP) API.
 
 For more information about DFP API, please refer to https://developers.google.com/doubleclick-publishers/.
 
-Requires Google Ads APIs Python Client Libraries - https://github.com/googleads/googleads-python-legacy-lib.
+Requires Google Ads APIs Python Client Libraries - https://github.com/googleads/googleads-python-legacy-lib. The library
+is imported and the client is created on the first call to DFP, so importing this module needs neither of them.
 """
 
 import os
+import re
 import sys
 import time
+import Queue
+import socket
+import urllib2
+import httplib
 import datetime
 import tempfile
+import threading
+import collections
 import gzip
 
-import googleads.dfp
-import googleads.errors
+import suds
+import suds.sudsobject
 
 
 DFP_VERSION = 'v201505'
 
-CLIENT = googleads.dfp.DfpClient.LoadFromStorage()
+# The SOAP faults that may succeed if the request is sent again.
+TRANSIENT_FAULTS = ['ServerError', 'SERVER_ERROR', 'SERVER_BUSY', 'QuotaError', 'EXCEEDED_QUOTA', 'CONCURRENT']
+
+# The field path of an ApiError that names an entry of the request, e.g. `[RequiredError.REQUIRED @ creatives[2].name]`.
+ENTRY_FAULT_PATTERN = re.compile(r'@ \w+\[\d+\]')
+
+PAGE_PATTERN = re.compile(r'^(.*) LIMIT (\d+) OFFSET (\d+)$', re.DOTALL)
+
+# The number of entries in a page, which is the same as googleads.dfp.SUGGESTED_PAGE_LIMIT.
+PAGE_LIMIT = 500
+
+# The backends that get_client() can create. `live` talks to DFP, `record` talks to DFP and saves the interactions into
+# fixture files, and `replay` serves the fixture files without DFP. See :mod:`adscan.replay`.
+BACKENDS = ['live', 'record', 'replay']
+
+# The client created by get_client(), and the backend it is created for.
+_client = None
+_client_lock = threading.Lock()
+_backend = {'name': 'live', 'fixture_dir': None, 'latency': 0.0, 'fault_rate': 0.0}
+
+
+def set_backend(name, fixture_dir=None, latency=0.0, fault_rate=0.0):
+  """
+  Select the backend of the client. The client is created again on the next call to get_client().
+
+  :param name: the name of the backend in BACKENDS.
+  :param fixture_dir: the directory of the fixture files, which is used by the `record` and `replay` backends.
+  :param latency: the average number of seconds each call of the `replay` backend takes.
+  :param fault_rate: the probability that a call of the `replay` backend fails with a network error.
+  """
+  global _client
+  if name not in BACKENDS:
+    raise Exception('Unknown DFP backend: %s' % name)
+  if name != 'live' and not fixture_dir:
+    raise Exception('The %s backend needs a fixture directory' % name)
+  with _client_lock:
+    _backend.update({'name': name, 'fixture_dir': fixture_dir, 'latency': latency, 'fault_rate': fault_rate})
+    _client = None
+
+
+def get_client():
+  """
+  Return the DFP client. The client is loaded from the googleads.yaml file on the first call and shared afterwards.
+  With the `replay` backend, a client that serves the fixture files is returned instead.
+
+  :return: an instance of googleads.dfp.DfpClient, or a client of :mod:`adscan.replay`.
+  """
+  global _client
+  with _client_lock:
+    if _client is None:
+      if _backend['name'] == 'replay':
+        import adscan.replay
+        _client = adscan.replay.ReplayClient(_backend['fixture_dir'], _backend['latency'], _backend['fault_rate'])
+      else:
+        import googleads.dfp
+        _client = googleads.dfp.DfpClient.LoadFromStorage()
+        if _backend['name'] == 'record':
+          import adscan.replay
+          _client = adscan.replay.RecordingClient(_client, _backend['fixture_dir'])
+    return _client
+
+
+def creative_service():
+  """
+  Return a new CreativeService of the DFP client.
+  """
+  return get_client().GetService('CreativeService', version=DFP_VERSION)
+
+
+def network_code():
+  """
+  Return the network code of the DFP client, which identifies the network the creatives belong to.
+
+  :return: a string of the network code, or an empty string if the client has none.
+  """
+  return str(getattr(get_client(), 'network_code', None) or '')
 
 
 def create_report_service_job(days_ago=2, country=None):
@@ -67,40 +150,67 @@ def create_report_service_job(days_ago=2, country=None):
   return report_job
 
 
+def read_report_records(report):
+  """
+  Parse the lines of a CSV report of creative ids and impressions. The lines are read one by one, so the memory does
+  not grow with the report.
+
+  :param report: an iterable of the lines of the report. The first line is the header.
+  :return: a generator of tuples of a creative id and the number of impressions.
+  """
+  lines = iter(report)
+  # Ignore the first line, which contains this line "Dimension.CREATIVE_ID,Column.AD_SERVER_IMPRESSIONS"
+  next(lines, None)
+  for line in lines:
+    fields = line.strip().split(',')
+    if len(fields) < 2 or not fields[0]:
+      continue
+    yield (int(fields[0]), int(fields[1] or 0))
+
+
 def run_report_service_job(report_job):
   """
-  Run the report job and return a list of creative ids.
+  Run the report job and return the creative ids and their impressions. The report is downloaded into a temporary
+  file, which is removed once all the records are read.
 
   :param report_job: a report job.
-  :return: a list of creative ids.
+  :return: a generator of tuples of a creative id and the number of impressions.
   """
-  data_downloader = CLIENT.GetDataDownloader(version=DFP_VERSION)
+  data_downloader = get_client().GetDataDownloader(version=DFP_VERSION)
   try:
     report_job_id = data_downloader.WaitForReport(report_job)
-  except googleads.errors.DfpReportError, e:
+  except Exception, e:
     print 'Failed to generate report. [Error] %s' % e
-    raise e
+    raise
   report_file = tempfile.NamedTemporaryFile(suffix='.csv.gz', delete=False)
   data_downloader.DownloadReportToFile(report_job_id, 'CSV_DUMP', report_file)
   report_file.close()
 
   report = gzip.open(report_file.name)
-  ids = [r.split(',')[0] for r in report]
-  report.close()
-
-  os.remove(report_file.name)
-  # Ignore the first line, which contains this line "Dimension.CREATIVE_ID,Column.AD_SERVER_IMPRESSIONS"
-  return ids[1:]
+  try:
+    for record in read_report_records(report):
+      yield record
+  finally:
+    report.close()
+    os.remove(report_file.name)
 
 
-def create_creative_service_statement(creative_ids, offset=0, only_new=True, days_ago=2):
+def create_creative_service_statement(creative_ids, offset=0, only_new=True, days_ago=2,
+                                      page_size=PAGE_LIMIT, since=None):
   """
   Download creatives from DFP.
 
+  The ids are split into chunks of `page_size` and each statement has only the ids of its chunk, so the statements
+  can be run independently and their total size grows linearly with the number of ids. The creatives are ordered by
+  id, so the pages are stable when the statements are split or merged.
+
   :param creative_ids: a list of creative ids.
   :param offset: the offset for the list to start download from.
   :param only_new: a boolean that indicates whether downloading only recently updated creatives or not.
   :param days_ago: a number that represents days the creatives are served.
+  :param page_size: the maximum number of ids in a statement.
+  :param since: a string of the time, `YYYY-MM-DDTHH:MM:SS`, after which the creatives were updated. It is used
+    instead of `days_ago` if `only_new` is set.
   :return: a list of creatives.
   """
   values = []
@@ -108,60 +218,568 @@ def create_creative_service_statement(creative_ids, offset=0, only_new=True, day
 
   if only_new:
     date_setting = 'lastModifiedDateTime > :date AND'
-    days = datetime.date.today() - datetime.timedelta(days=days_ago)
+    if since is None:
+      days = datetime.date.today() - datetime.timedelta(days=days_ago)
+      since = days.strftime('%Y-%m-%dT%H:%M:%S')
     values.append({
       'key': 'date',
       'value': {
         'xsi_type': 'TextValue',
-        'value': days.strftime('%Y-%m-%dT%H:%M:%S')
+        'value': since
       }
     })
-    print 'Only recently updated creatives will be downloaded.'
-  else:
-    print 'At most, %d creatives will be downloaded.' % len(creative_ids)
-
-  id_str = ','.join(str(i) for i in creative_ids)
 
   statements = []
-  for offset in range(offset, len(creative_ids), googleads.dfp.SUGGESTED_PAGE_LIMIT):
+  for offset in range(offset, len(creative_ids), page_size):
+    id_str = ','.join(str(i) for i in creative_ids[offset:(offset + page_size)])
     statements.append({
-      'query': 'WHERE %s id IN (%s) LIMIT %d OFFSET %d' % (date_setting, id_str, googleads.dfp.SUGGESTED_PAGE_LIMIT, offset),
+      'query': 'WHERE %s id IN (%s) ORDER BY id ASC LIMIT %d OFFSET 0' % (date_setting, id_str, page_size),
       'values': values
     })
   return statements
 
 
-def run_creative_service_statements(statements):
+def create_modified_creatives_statements(since, offset=0, count=1, page_size=PAGE_LIMIT):
+  """
+  Create the statements of the creatives in the network modified after a time, regardless of their ids. The creatives
+  are ordered by id, so the pages are stable while they are downloaded.
+
+  :param since: a string of the time, `YYYY-MM-DDTHH:MM:SS`, after which the creatives were modified.
+  :param offset: the offset of the first page.
+  :param count: the number of pages.
+  :param page_size: the number of creatives in a page.
+  :return: a list of statements.
+  """
+  values = [{
+    'key': 'date',
+    'value': {
+      'xsi_type': 'TextValue',
+      'value': since
+    }
+  }]
+  return [{
+    'query': 'WHERE lastModifiedDateTime > :date ORDER BY id ASC LIMIT %d OFFSET %d' % (page_size, page_offset),
+    'values': values
+  } for page_offset in xrange(offset, offset + count * page_size, page_size)]
+
+
+def shift_time(value, seconds):
+  """
+  Add seconds to a time of DFP.
+
+  :param value: a string of the time, `YYYY-MM-DDTHH:MM:SS`.
+  :param seconds: the number of seconds, which can be negative.
+  :return: a string of the time.
+  """
+  time_value = datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S') + datetime.timedelta(seconds=seconds)
+  return time_value.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def to_serializable(obj):
+  """
+  Convert a DFP object into nested dictionaries and lists that can be serialized into JSON. The DFP type of each object
+  is kept in its `xsi_type` key, so the dictionaries can be passed to DFP services again.
+
+  :param obj: a DFP object, or a dictionary, list or value in it.
+  :return: the converted object.
+  """
+  if isinstance(obj, suds.sudsobject.Object):
+    data = dict((key, to_serializable(value)) for key, value in suds.sudsobject.asdict(obj).iteritems())
+    data['xsi_type'] = obj.__class__.__name__
+    return data
+  if isinstance(obj, dict):
+    return dict((key, to_serializable(value)) for key, value in obj.iteritems())
+  if isinstance(obj, (list, tuple)):
+    return [to_serializable(value) for value in obj]
+  if isinstance(obj, basestring):
+    return unicode(obj)
+  return obj
+
+
+def last_modified(dfp_creative):
+  """
+  Return the lastModifiedDateTime of a DFP creative.
+
+  :param dfp_creative: a DFP creative, or its dictionary.
+  :return: a string of the time, `YYYY-MM-DDTHH:MM:SS`, or None if the creative has no time.
+  """
+  if 'lastModifiedDateTime' not in dfp_creative or not dfp_creative['lastModifiedDateTime']:
+    return None
+  value = dfp_creative['lastModifiedDateTime']
+  date = value['date']
+  return '%04d-%02d-%02dT%02d:%02d:%02d' % (
+    int(date['year']), int(date['month']), int(date['day']), int(value['hour']), int(value['minute']),
+    int(value['second']))
+
+
+def is_transient_error(error):
+  """
+  Return True if the error may not occur when the request is sent again, such as network errors and server-side
+  faults.
+
+  :param error: an exception.
+  :return: a boolean value.
+  """
+  if isinstance(error, (socket.error, urllib2.URLError, httplib.HTTPException)):
+    return True
+  if isinstance(error, suds.WebFault):
+    return any(fault in str(error.fault) for fault in TRANSIENT_FAULTS)
+  return False
+
+
+def is_entry_error(error):
+  """
+  Return True if the error is an ApiException raised for invalid entries of the request, which are named by the field
+  paths of its errors. Other entries in the request are accepted if they are sent without the invalid ones.
+
+  :param error: an exception.
+  :return: a boolean value.
+  """
+  return isinstance(error, suds.WebFault) and bool(ENTRY_FAULT_PATTERN.search(str(error.fault)))
+
+
+def parse_page(statement):
+  """
+  Parse a statement paged by LIMIT and OFFSET.
+
+  :param statement: a statement.
+  :return: a tuple of the query without LIMIT and OFFSET, the limit and the offset. The limit is None if the statement
+    is not paged.
+  """
+  match = PAGE_PATTERN.match(statement['query'])
+  if not match:
+    return (statement['query'], None, 0)
+  return (match.group(1), int(match.group(2)), int(match.group(3)))
+
+
+def split_statement(statement, min_page_size):
+  """
+  Split a statement paged by LIMIT and OFFSET into two statements of half the size.
+
+  :param statement: a statement.
+  :param min_page_size: the minimum page size of the split statements.
+  :return: a list of the split statements, or a list of the statement if it cannot be split.
+  """
+  query, limit, offset = parse_page(statement)
+  if limit is None or limit / 2 < min_page_size:
+    return [statement]
+  half = limit / 2
+  return [
+    {'query': '%s LIMIT %d OFFSET %d' % (query, half, offset), 'values': statement['values']},
+    {'query': '%s LIMIT %d OFFSET %d' % (query, limit - half, offset + half), 'values': statement['values']}
+  ]
+
+
+def merge_statements(statements, max_page_size):
+  """
+  Merge the pairs of adjacent pages of the same query into pages of twice the size. This undoes
+  :func:`split_statement`.
+
+  :param statements: a list of statements.
+  :param max_page_size: the maximum page size of the merged statements.
+  :return: a list of the statements.
+  """
+  merged = []
+  i = 0
+  while i < len(statements):
+    statement = statements[i]
+    if i + 1 < len(statements):
+      query, limit, offset = parse_page(statement)
+      next_query, next_limit, next_offset = parse_page(statements[i + 1])
+      if (limit is not None and next_limit is not None and query == next_query and offset + limit == next_offset and
+          limit + next_limit <= max_page_size):
+        merged.append({'query': '%s LIMIT %d OFFSET %d' % (query, limit + next_limit, offset),
+                       'values': statement['values']})
+        i += 2
+        continue
+    merged.append(statement)
+    i += 1
+  return merged
+
+
+class ServicePool(object):
+  """
+  Base class that runs tasks on a pool of DFP services concurrently. Each thread uses its own service, and the calls
+  that failed due to transient errors are retried with exponential backoff. Subclasses implement :meth:`_run`.
+  """
+
+  def __init__(self, service_factory, method, client_count=4, max_retries=5, backoff=1.0):
+    """
+    Initialize the instance.
+
+    :param service_factory: the function that returns a new DFP service. Each thread uses its own service.
+    :param method: the name of the method of the service, e.g. 'getCreativesByStatement'.
+    :param client_count: the number of services used concurrently.
+    :param max_retries: the maximum number of retries of a call.
+    :param backoff: the number of seconds to wait before the first retry. It doubles on each retry.
+    """
+    self.service_factory = service_factory
+    self.method = method
+    self.client_count = client_count
+    self.max_retries = max_retries
+    self.backoff = backoff
+    # The task queue, the done queue and the threads kept between :meth:`open` and :meth:`close`.
+    self.pool = None
+
+  def open(self):
+    """
+    Start the threads and keep them until :meth:`close` is called, so that the following calls share the threads and
+    their services instead of creating new ones each time.
+    """
+    if self.pool is None:
+      self.pool = self._start(self.client_count)
+
+  def close(self):
+    """
+    Stop the threads started by :meth:`open`.
+    """
+    if self.pool is not None:
+      tasks, done, threads = self.pool
+      self.pool = None
+      self._stop(tasks, done, threads, 0)
+
+  def _call(self, service, arg):
+    """
+    Call the method of the service, retrying on transient errors.
+
+    :param service: a DFP service.
+    :param arg: the argument of the method.
+    :return: a tuple of the response, the number of seconds of the last attempt and the number of attempts.
+    """
+    attempt = 0
+    while True:
+      start = time.time()
+      try:
+        response = getattr(service, self.method)(arg)
+        return (response, time.time() - start, attempt + 1)
+      except Exception, e:
+        if attempt >= self.max_retries or not is_transient_error(e):
+          raise
+        print 'Retrying %s after an error: %s' % (self.method, e)
+        time.sleep(self.backoff * (2 ** attempt))
+        attempt += 1
+
+  def _run(self, service, task):
+    """
+    Run a task.
+
+    :param service: a DFP service.
+    :param task: a task.
+    :return: a tuple of the results and the metrics of the task.
+    """
+    raise NotImplementedError()
+
+  def _work(self, tasks, done):
+    """
+    Run the tasks in the task queue until None is taken.
+
+    :param tasks: the queue of tasks.
+    :param done: the queue into which the task, the results, the metrics and the error are put.
+    """
+    service = None
+    while True:
+      task = tasks.get()
+      if task is None:
+        break
+      try:
+        if service is None:
+          service = self.service_factory()
+        results, metrics = self._run(service, task)
+        done.put((task, results, metrics, None))
+      except Exception, e:
+        done.put((task, None, None, e))
+
+  def _start(self, task_count):
+    """
+    Start the threads for the tasks, or return the threads started by :meth:`open`.
+
+    :param task_count: the number of tasks to be run.
+    :return: a tuple of the task queue, the done queue and the list of threads.
+    """
+    if self.pool is not None:
+      return self.pool
+    tasks = Queue.Queue()
+    done = Queue.Queue()
+    threads = []
+    for _ in xrange(0, min(self.client_count, task_count)):
+      thread = threading.Thread(target=self._work, args=(tasks, done))
+      thread.daemon = True
+      thread.start()
+      threads.append(thread)
+    return (tasks, done, threads)
+
+  def _stop(self, tasks, done, threads, in_flight):
+    """
+    Stop the threads started for the tasks. The threads started by :meth:`open` are kept, and the results of the tasks
+    still running are discarded, so that they are not taken by the next call.
+
+    :param tasks: the task queue.
+    :param done: the done queue.
+    :param threads: the list of threads.
+    :param in_flight: the number of tasks still running.
+    """
+    if self.pool is not None and tasks is self.pool[0]:
+      for _ in xrange(0, in_flight):
+        done.get()
+      return
+    for _ in threads:
+      tasks.put(None)
+
+
+class PageFetcher(ServicePool):
+  """
+  Class that runs statements on a pool of DFP services concurrently. If a page takes too long or is too large, the
+  statements not sent yet are split into smaller pages. After consecutive pages took less than half of the limits, the
+  split statements are merged back up to the size of the statements given.
+  """
+
+  def __init__(self, service_factory, method, client_count=4, max_retries=5, backoff=1.0, max_page_seconds=30.0,
+               max_page_bytes=8 * 1024 * 1024, min_page_size=50, grow_after=3):
+    """
+    Initialize the instance.
+
+    :param service_factory: the function that returns a new DFP service. Each thread uses its own service.
+    :param method: the name of the method of the service called with a statement, e.g. 'getCreativesByStatement'.
+    :param client_count: the number of services used concurrently.
+    :param max_retries: the maximum number of retries of a statement.
+    :param backoff: the number of seconds to wait before the first retry. It doubles on each retry.
+    :param max_page_seconds: the number of seconds a page should take at most.
+    :param max_page_bytes: the approximate size of a page at most.
+    :param min_page_size: the minimum number of entries in a page.
+    :param grow_after: the number of consecutive fast pages after which the pages grow back.
+    """
+    ServicePool.__init__(self, service_factory, method, client_count, max_retries, backoff)
+    self.max_page_seconds = max_page_seconds
+    self.max_page_bytes = max_page_bytes
+    self.min_page_size = min_page_size
+    self.grow_after = grow_after
+
+  def _run(self, service, statement):
+    """
+    Run a statement.
+
+    :param service: a DFP service.
+    :param statement: a statement.
+    :return: a tuple of the results and the metrics of the page.
+    """
+    response, seconds, attempts = self._call(service, statement)
+    results = response['results'] if 'results' in response else []
+    metrics = {
+      'query': statement['query'],
+      'count': len(results),
+      'seconds': seconds,
+      'bytes': len(str(results)),
+      'attempts': attempts
+    }
+    return (results, metrics)
+
+  def fetch(self, statements):
+    """
+    Run the statements and yield the pages as they arrive. Once a page has fewer entries than its limit, the
+    following pages of the same query are not fetched.
+
+    :param statements: a list of statements.
+    :return: a generator of tuples of the results and the metrics of each page.
+    """
+    pending = collections.deque(statements)
+    # The smallest offset of the pages that reached the end of the query.
+    ends = {}
+    # The pages do not grow larger than the statements given.
+    max_page_size = max([parse_page(statement)[1] or 0 for statement in statements] or [0])
+    fast_count = 0
+    tasks, done, threads = self._start(len(statements))
+    in_flight = 0
+
+    try:
+      while pending or in_flight:
+        while pending and in_flight < len(threads):
+          statement = pending.popleft()
+          query, limit, offset = parse_page(statement)
+          if query in ends and offset > ends[query]:
+            continue
+          tasks.put(statement)
+          in_flight += 1
+        if not in_flight:
+          break
+
+        statement, results, metrics, error = done.get()
+        in_flight -= 1
+        if error:
+          raise error
+
+        query, limit, offset = parse_page(statement)
+        if limit is not None and len(results) < limit:
+          ends[query] = min(ends.get(query, offset), offset)
+        if metrics['seconds'] > self.max_page_seconds or metrics['bytes'] > self.max_page_bytes:
+          pending = collections.deque(s for stmt in pending for s in split_statement(stmt, self.min_page_size))
+          fast_count = 0
+        elif metrics['seconds'] * 2 <= self.max_page_seconds and metrics['bytes'] * 2 <= self.max_page_bytes:
+          fast_count += 1
+          if fast_count >= self.grow_after:
+            pending = collections.deque(merge_statements(list(pending), max_page_size))
+            fast_count = 0
+        else:
+          fast_count = 0
+        yield (results, metrics)
+    finally:
+      self._stop(tasks, done, threads, in_flight)
+
+
+class BatchUploader(ServicePool):
+  """
+  Class that uploads entries in batches on a pool of DFP services concurrently. If a batch is rejected for invalid
+  entries, it is split in half and the halves are uploaded again, so that only the invalid entries fail. A batch that
+  failed for other errors, such as an authentication error, fails as a whole.
+  """
+
+  def __init__(self, service_factory, method, batch_size=100, client_count=4, max_retries=5, backoff=1.0):
+    """
+    Initialize the instance.
+
+    :param service_factory: the function that returns a new DFP service. Each thread uses its own service.
+    :param method: the name of the method of the service called with a list of entries, e.g. 'updateCreatives'.
+    :param batch_size: the maximum number of entries uploaded at once.
+    :param client_count: the number of services used concurrently.
+    :param max_retries: the maximum number of retries of a batch.
+    :param backoff: the number of seconds to wait before the first retry. It doubles on each retry.
+    """
+    ServicePool.__init__(self, service_factory, method, client_count, max_retries, backoff)
+    self.batch_size = batch_size
+
+  def _run(self, service, batch):
+    """
+    Upload a batch.
+
+    :param service: a DFP service.
+    :param batch: a list of entries.
+    :return: a tuple of the updated entries returned by DFP and the metrics of the batch.
+    """
+    response, seconds, attempts = self._call(service, batch)
+    updated = list(response or [])
+    metrics = {
+      'count': len(batch),
+      'updated': len(updated),
+      'seconds': seconds,
+      'attempts': attempts
+    }
+    return (updated, metrics)
+
+  def upload(self, entries):
+    """
+    Upload the entries and yield the results of the batches as they finish. A batch rejected for invalid entries is
+    split in half until the invalid entries are isolated, and each of them is yielded with its error. The entries of a
+    batch that failed for other errors are yielded with the error.
+
+    :param entries: a list of entries.
+    :return: a generator of tuples of the updated entries, the failed entries with their errors, and the metrics of
+      each batch.
+    """
+    pending = collections.deque(entries[i:(i + self.batch_size)] for i in xrange(0, len(entries), self.batch_size))
+    tasks, done, threads = self._start(len(pending))
+    in_flight = 0
+
+    try:
+      while pending or in_flight:
+        while pending and in_flight < len(threads):
+          tasks.put(pending.popleft())
+          in_flight += 1
+
+        batch, updated, metrics, error = done.get()
+        in_flight -= 1
+        if error is None:
+          yield (updated, [], metrics)
+        elif len(batch) > 1 and is_entry_error(error):
+          half = len(batch) / 2
+          pending.appendleft(batch[half:])
+          pending.appendleft(batch[:half])
+        else:
+          metrics = {'count': len(batch), 'updated': 0, 'seconds': 0.0, 'attempts': 0}
+          yield ([], [(entry, error) for entry in batch], metrics)
+    finally:
+      self._stop(tasks, done, threads, in_flight)
+
+
+def run_creative_service_statements(statements, client_count=4, max_retries=5):
   """
   Download creatives from DFP.
 
   :param statements: a list of CreativeService statements to download creatives.
+  :param client_count: the number of services used concurrently.
+  :param max_retries: the maximum number of retries of a statement.
   :return: a list of creatives.
   """
   print '%d statements will be executed on DFP Creative Service' % len(statements)
 
-  creative_service = CLIENT.GetService('CreativeService', version=DFP_VERSION)
+  fetcher = PageFetcher(
+    creative_service, 'getCreativesByStatement',
+    client_count=client_count, max_retries=max_retries)
 
   creatives = []
-  for stmt in statements:
-    response = creative_service.getCreativesByStatement(stmt)
-    results = response['results'] if 'results' in response else []
+  for results, metrics in fetcher.fetch(statements):
+    print 'Fetched data size: %d in %.2fs (%d bytes, %d attempts).' % (
+      metrics['count'], metrics['seconds'], metrics['bytes'], metrics['attempts'])
+    creatives.extend(results)
+  return creatives
+
+
+def download_modified_creatives(since, client_count=4, max_retries=5, page_size=PAGE_LIMIT):
+  """
+  Download all the creatives in the network modified after a time. As many pages as the clients are fetched at once,
+  until a round of pages is not full.
+
+  :param since: a string of the time, `YYYY-MM-DDTHH:MM:SS`, after which the creatives were modified.
+  :param client_count: the number of services used concurrently.
+  :param max_retries: the maximum number of retries of a statement.
+  :param page_size: the number of creatives in a page.
+  :return: a list of creatives.
+  """
+  print 'The creatives modified after %s will be downloaded.' % since
 
-    print 'Fetched data size: %d.' % len(results)
+  fetcher = PageFetcher(
+    creative_service, 'getCreativesByStatement',
+    client_count=client_count, max_retries=max_retries)
 
-    if len(results) > 0:
-      creatives.extend(results)
-    else:
-      break
+  creatives = []
+  offset = 0
+  # The rounds share the threads and their services.
+  fetcher.open()
+  try:
+    while True:
+      statements = create_modified_creatives_statements(since, offset, client_count, page_size)
+      round_count = 0
+      for results, metrics in fetcher.fetch(statements):
+        print 'Fetched data size: %d in %.2fs (%d bytes, %d attempts).' % (
+          metrics['count'], metrics['seconds'], metrics['bytes'], metrics['attempts'])
+        creatives.extend(results)
+        round_count += len(results)
+      if round_count < len(statements) * page_size:
+        break
+      offset += len(statements) * page_size
+  finally:
+    fetcher.close()
   return creatives
 
 
-def upload_creatives(dfp_creatives):
+def upload_creatives(dfp_creatives, batch_size=100, client_count=4, max_retries=5):
   """
-  Upload the creatives to DFP.
+  Upload the creatives to DFP in batches. The creatives rejected by DFP are reported and skipped.
 
   :param dfp_creatives: a list of DFP creatives.
-  :return: a list of updated creatives.
+  :param batch_size: the maximum number of creatives uploaded at once.
+  :param client_count: the number of services used concurrently.
+  :param max_retries: the maximum number of retries of a batch.
+  :return: a list of updated creatives returned by DFP.
   """
-  creative_service = CLIENT.GetService('CreativeService', version=DFP_VERSION)
-  return creative_service.updateCreatives(dfp_creatives)
+  uploader = BatchUploader(
+    creative_service, 'updateCreatives', batch_size=batch_size,
+    client_count=client_count, max_retries=max_retries)
+
+  updated = []
+  for results, failures, metrics in uploader.upload(dfp_creatives):
+    for dfp_creative, error in failures:
+      print 'Failed to upload creative %s. [Error] %s' % (dfp_creative['id'], error)
+    if metrics['attempts']:
+      print 'Uploaded %d of %d creatives in %.2fs (%d attempts).' % (
+        metrics['updated'], metrics['count'], metrics['seconds'], metrics['attempts'])
+    updated.extend(results)
+  return updated
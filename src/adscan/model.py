@@ -14,14 +14,21 @@
 Classes for database schema.
 """
 
+import json
+import zlib
+import hashlib
 from datetime import date
 
-from sqlalchemy import event
-from sqlalchemy import Column, Integer, String, Date, Boolean
+from sqlalchemy import event, func
+from sqlalchemy import Column, Index, Integer, Float, String, Date, Boolean, LargeBinary
+from sqlalchemy.orm import object_session
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+# The maximum number of hashes in an 'IN' clause when looking up blobs.
+BLOB_CHUNK_SIZE = 500
+
 
 def before_insert_listener(mapper, connection, instance):
   """
@@ -37,11 +44,160 @@ def before_update_listener(mapper, connection, instance):
   instance.updated_at = date.today()
 
 
+class Blob(Base):
+  """
+  Class that represents a compressed text, such as a snippet, stored once and referred to by the hash of its content.
+  """
+  __tablename__ = 'blob'
+
+  hash = Column(String, primary_key=True)
+  created_at = Column(Date)
+  content = Column(LargeBinary)
+
+  @classmethod
+  def hash_text(cls, text):
+    """
+    Return the hash of the text, which is used as the key of the blob.
+
+    :param text: a string.
+    :return: a hex string of the SHA-1 hash of the UTF-8 encoded text.
+    """
+    if isinstance(text, unicode):
+      text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+  @classmethod
+  def from_text(cls, text):
+    """
+    Create a new blob of the text.
+
+    :param text: a string.
+    :return: a new instance of :class:`Blob`.
+    """
+    data = text.encode('utf-8') if isinstance(text, unicode) else text
+    return Blob(hash=cls.hash_text(text), content=zlib.compress(data))
+
+  def text(self):
+    """
+    Return the text stored in this blob.
+    """
+    return zlib.decompress(self.content).decode('utf-8')
+
+
+event.listen(Blob, 'before_insert', before_insert_listener)
+
+
+class BlobText(object):
+  """
+  Descriptor that stores a text in the blob table and keeps its hash in the `<name>_ref` column. The value stored by
+  older versions in the `_<name>` column, if the class has it, is returned when there is no reference.
+
+  On the class, the descriptor is an SQL expression that is NULL only if there is no text, so that queries like
+  `Creative.snippet != None` keep working.
+  """
+
+  def __init__(self, name):
+    """
+    Initialize the instance.
+
+    :param name: the name of the attribute.
+    """
+    self.name = name
+    self.ref = '%s_ref' % name
+    self.legacy = '_%s' % name
+
+  def __get__(self, instance, owner):
+    if instance is None:
+      if hasattr(owner, self.legacy):
+        return func.coalesce(getattr(owner, self.ref), getattr(owner, self.legacy))
+      return getattr(owner, self.ref)
+
+    texts = instance.__dict__.setdefault('_blob_texts', {})
+    if self.name not in texts:
+      ref = getattr(instance, self.ref)
+      if ref is not None:
+        session = object_session(instance)
+        blob = session.query(Blob).get(ref) if session else None
+        texts[self.name] = blob.text() if blob else None
+      else:
+        texts[self.name] = getattr(instance, self.legacy, None)
+    return texts[self.name]
+
+  def __set__(self, instance, value):
+    instance.__dict__.setdefault('_blob_texts', {})[self.name] = value
+    ref = None
+    if value is not None:
+      ref = Blob.hash_text(value)
+      instance.__dict__.setdefault('_pending_blobs', {})[ref] = value
+    setattr(instance, self.ref, ref)
+    if hasattr(type(instance), self.legacy) and getattr(instance, self.legacy) is not None:
+      setattr(instance, self.legacy, None)
+
+
+def load_blobs(session, instances):
+  """
+  Load the texts of the instances from the blob table with a few queries, instead of one query for each text.
+
+  :param session: a session.
+  :param instances: a list of instances of classes that have :class:`BlobText` attributes.
+  """
+  refs = {}
+  for instance in instances:
+    texts = instance.__dict__.setdefault('_blob_texts', {})
+    for name in type(instance).blob_fields:
+      ref = getattr(instance, '%s_ref' % name)
+      if name not in texts and ref is not None:
+        refs.setdefault(ref, []).append((texts, name))
+
+  hashes = refs.keys()
+  for i in xrange(0, len(hashes), BLOB_CHUNK_SIZE):
+    for blob in session.query(Blob).filter(Blob.hash.in_(hashes[i:(i + BLOB_CHUNK_SIZE)])):
+      text = blob.text()
+      for texts, name in refs[blob.hash]:
+        texts[name] = text
+
+
+def save_blobs_listener(session, flush_context, instances):
+  """
+  Add the blobs of the texts set to the instances to be flushed, unless the blobs already exist.
+  """
+  pending = {}
+  for instance in list(session.new) + list(session.dirty):
+    pending.update(instance.__dict__.pop('_pending_blobs', {}))
+
+  known = session.info.setdefault('blob_hashes', set())
+  hashes = [h for h in pending if h not in known]
+  for i in xrange(0, len(hashes), BLOB_CHUNK_SIZE):
+    chunk = hashes[i:(i + BLOB_CHUNK_SIZE)]
+    known.update(t[0] for t in session.query(Blob.hash).filter(Blob.hash.in_(chunk)))
+    for h in chunk:
+      if h not in known:
+        session.add(Blob.from_text(pending[h]))
+        known.add(h)
+
+
+def save_blobs(session):
+  """
+  Save the blobs of the texts set to the instances whenever the session is flushed. Only the sessions that store
+  :class:`BlobText` attributes need this, so the other sessions do not pay for it.
+
+  :param session: a session, or a sessionmaker whose sessions save the blobs.
+  :return: the session.
+  """
+  if not event.contains(session, 'before_flush', save_blobs_listener):
+    event.listen(session, 'before_flush', save_blobs_listener)
+  return session
+
+
 class Creative(Base):
   """
   Class that represents a creative.
   """
   __tablename__ = 'creative'
+  __table_args__ = (
+    # For looking up the latest rows of creatives in the cache.
+    Index('ix_creative_creative_id_created_at', 'creative_id', 'created_at'),
+  )
 
   created_at = Column(Date, primary_key=True)
   updated_at = Column(Date)
@@ -49,12 +205,28 @@ class Creative(Base):
   creative_type = Column(String)
   preview_url = Column(String)
   modified = Column(Boolean)
-  snippet = Column(String)
-  modified_snippet = Column(String)
-  expanded_snippet = Column(String)
+  _snippet = Column('snippet', String)
+  _modified_snippet = Column('modified_snippet', String)
+  _expanded_snippet = Column('expanded_snippet', String)
   compliance = Column(Boolean)
   request_match = Column(Boolean)
   uploaded = Column(Boolean)
+  snippet_hash = Column(String)
+  scanned_at = Column(Date)
+  snippet_ref = Column(String)
+  modified_snippet_ref = Column(String)
+  expanded_snippet_ref = Column(String)
+  # The creatives with higher priority are downloaded and scanned first. See :mod:`adscan.priority`.
+  priority = Column(Float)
+  # True if the creative was not browsed before the deadline and is left to the next run.
+  deferred = Column(Boolean)
+
+  # The snippets are stored in the blob table. The columns above without `_ref` keep the snippets stored by older
+  # versions.
+  blob_fields = ['snippet', 'modified_snippet', 'expanded_snippet']
+  snippet = BlobText('snippet')
+  modified_snippet = BlobText('modified_snippet')
+  expanded_snippet = BlobText('expanded_snippet')
 
   # Fields not stored in the database
   modified_expanded_snippet = None
@@ -80,20 +252,208 @@ event.listen(Creative, 'before_insert', before_insert_listener)
 event.listen(Creative, 'before_update', before_update_listener)
 
 
+class CreativeCache(Base):
+  """
+  Class that represents the latest snippet downloaded for a creative. Unlike :class:`Creative`, there is only one row
+  for each creative, so the snippets can be looked up by creative id.
+  """
+  __tablename__ = 'creative_cache'
+
+  created_at = Column(Date)
+  updated_at = Column(Date)
+  creative_id = Column(Integer, primary_key=True)
+  creative_type = Column(String)
+  preview_url = Column(String)
+  _snippet = Column('snippet', String)
+  _expanded_snippet = Column('expanded_snippet', String)
+  snippet_ref = Column(String)
+  expanded_snippet_ref = Column(String)
+  # The lastModifiedDateTime of the creative in DFP when the snippets were downloaded, `YYYY-MM-DDTHH:MM:SS`.
+  last_modified = Column(String)
+
+  blob_fields = ['snippet', 'expanded_snippet']
+  snippet = BlobText('snippet')
+  expanded_snippet = BlobText('expanded_snippet')
+
+  def merge(self, creative):
+    """
+    Copy the snippets of the creative to this cache.
+
+    :param creative: the creative of which data is merged to this object.
+    """
+    self.creative_type = creative.creative_type
+    self.preview_url = creative.preview_url
+    self.snippet = creative.snippet
+    self.expanded_snippet = creative.expanded_snippet
+
+
+event.listen(CreativeCache, 'before_insert', before_insert_listener)
+event.listen(CreativeCache, 'before_update', before_update_listener)
+
+
+class DfpCreative(Base):
+  """
+  Class that represents the DFP object of a creative downloaded in the download step, which is used again to upload the
+  modified creative. The object is stored as compressed JSON of nested dictionaries, with `xsi_type` keys that give the
+  DFP types.
+  """
+  __tablename__ = 'dfp_creative'
+
+  creative_id = Column(Integer, primary_key=True)
+  created_at = Column(Date)
+  updated_at = Column(Date)
+  # The lastModifiedDateTime of the object in DFP, `YYYY-MM-DDTHH:MM:SS`.
+  last_modified = Column(String)
+  content = Column(LargeBinary)
+
+  def set_object(self, obj):
+    """
+    Store the object.
+
+    :param obj: a dictionary that can be serialized into JSON.
+    """
+    self.content = zlib.compress(json.dumps(obj, separators=(',', ':')))
+
+  def get_object(self):
+    """
+    Return the object stored.
+    """
+    return json.loads(zlib.decompress(self.content))
+
+
+event.listen(DfpCreative, 'before_insert', before_insert_listener)
+event.listen(DfpCreative, 'before_update', before_update_listener)
+
+
+class SyncWatermark(Base):
+  """
+  Class that represents the latest lastModifiedDateTime of the creatives downloaded from a DFP network. The next
+  download step only asks the network for the creatives modified after it.
+  """
+  __tablename__ = 'sync_watermark'
+
+  network_code = Column(String, primary_key=True)
+  created_at = Column(Date)
+  updated_at = Column(Date)
+  # The lastModifiedDateTime in DFP, `YYYY-MM-DDTHH:MM:SS`.
+  synced_until = Column(String)
+
+
+event.listen(SyncWatermark, 'before_insert', before_insert_listener)
+event.listen(SyncWatermark, 'before_update', before_update_listener)
+
+
+class CreativeImpression(Base):
+  """
+  Class that represents the number of impressions of a creative on a day, from the report of DFP.
+  """
+  __tablename__ = 'creative_impression'
+
+  served_at = Column(Date, primary_key=True)
+  creative_id = Column(Integer, primary_key=True)
+  created_at = Column(Date)
+  impressions = Column(Integer)
+
+
+event.listen(CreativeImpression, 'before_insert', before_insert_listener)
+
+
+class Url(Base):
+  """
+  Class that represents a URL requested by creatives. Scan logs refer to the URLs by id instead of repeating them.
+  """
+  __tablename__ = 'url'
+
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  created_at = Column(Date)
+  url = Column(String, unique=True)
+
+
+event.listen(Url, 'before_insert', before_insert_listener)
+
+
 class ScanLog(Base):
   """
-  Class that represents a request log made by a browser.
+  Class that represents a request log made by a browser. Use :class:`ScanLogDetail` to read the URLs.
   """
   __tablename__ = 'scanlog'
+  __table_args__ = (
+    # For deleting and counting the scan logs of a day by protocol, and finding non-compliant creatives.
+    Index('ix_scanlog_created_at_protocol_creative_id', 'created_at', 'protocol', 'creative_id', 'issue_id'),
+    # For finding the creatives scanned on a day.
+    Index('ix_scanlog_created_at_creative_id', 'created_at', 'creative_id'),
+  )
 
   id = Column(Integer, primary_key=True, autoincrement=True)
   created_at = Column(Date)
   updated_at = Column(Date)
   creative_id = Column(Integer)
   issue_id = Column(Integer)
-  url = Column(String)
+  # The URL stored by older versions. New scan logs refer to the url table with `url_id`.
+  _url = Column('url', String)
   protocol = Column(String)
+  url_id = Column(Integer)
 
 
 event.listen(ScanLog, 'before_insert', before_insert_listener)
 event.listen(ScanLog, 'before_update', before_update_listener)
+
+
+class ScanLogDetail(Base):
+  """
+  Class that represents the view of scan logs with their URLs. This view is read-only.
+  """
+  __tablename__ = 'scanlog_detail'
+  __view__ = (
+    'SELECT s.id AS id, s.created_at AS created_at, s.updated_at AS updated_at, s.creative_id AS creative_id, '
+    's.issue_id AS issue_id, coalesce(u.url, s.url) AS url, s.protocol AS protocol '
+    'FROM scanlog s LEFT OUTER JOIN url u ON u.id = s.url_id'
+  )
+
+  id = Column(Integer, primary_key=True)
+  created_at = Column(Date)
+  updated_at = Column(Date)
+  creative_id = Column(Integer)
+  issue_id = Column(Integer)
+  url = Column(String)
+  protocol = Column(String)
+
+
+class ScanLogHost(Base):
+  """
+  Class that represents the number of requests a creative made to a host with the same issue. This table is used
+  instead of the scanlog table if the scan logs are aggregated by hosts. The count is 0 for the creatives that made no
+  external request.
+  """
+  __tablename__ = 'scanlog_host'
+  __table_args__ = (
+    Index('ix_scanlog_host_created_at_protocol_creative_id', 'created_at', 'protocol', 'creative_id', 'issue_id'),
+  )
+
+  id = Column(Integer, primary_key=True, autoincrement=True)
+  created_at = Column(Date)
+  creative_id = Column(Integer)
+  host = Column(String)
+  issue_id = Column(Integer)
+  protocol = Column(String)
+  count = Column(Integer)
+
+
+event.listen(ScanLogHost, 'before_insert', before_insert_listener)
+
+
+class HostVerdict(Base):
+  """
+  Class that represents whether the requests to a host were SSL compliant on the last scan.
+  """
+  __tablename__ = 'host_verdict'
+
+  host = Column(String, primary_key=True)
+  created_at = Column(Date)
+  updated_at = Column(Date)
+  compliance = Column(Boolean)
+  changed_at = Column(Date)
+
+
+event.listen(HostVerdict, 'before_insert', before_insert_listener)
+event.listen(HostVerdict, 'before_update', before_update_listener)
@@ -14,7 +14,13 @@
 Utility functions that handles networks.
 """
 
+import re
 import socket
+import urlparse
+
+
+# The IP addresses of private networks, which are the same as the ones browser.js blocks.
+PRIVATE_IP_PATTERN = re.compile(r'^(127\.0\.0\.1|192\.168\.|172\.(1[6-9]|2[0-9]|3[0-1])\.|10\.)')
 
 
 def find_open_ports(num):
@@ -45,3 +51,19 @@ def find_open_ports(num):
       else:
         trial += 1
   return ports
+
+
+def is_private_network(url):
+  """
+  Return True if the host of the url resolves to an address inside of a private network.
+
+  :param url: a URL.
+  :return: a boolean value. False is returned if the host cannot be resolved.
+  """
+  try:
+    hostname = urlparse.urlparse(url).hostname
+    if not hostname:
+      return False
+    return bool(PRIVATE_IP_PATTERN.match(socket.gethostbyname(hostname)))
+  except (socket.error, UnicodeError, ValueError):
+    return False
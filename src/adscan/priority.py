@@ -0,0 +1,64 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+"""
+Function that scores which creatives should be scanned first.
+
+The score adds up the recent traffic of a creative and the signs that its compliance may have changed, so a scan that
+is capped by `max_scan` or interrupted has covered the creatives that matter most:
+
+* the impressions in the recent reports, on a logarithmic scale,
+* whether the creative was non-compliant on its last scan,
+* whether its snippet changed or it was never seen before,
+* the number of days since its last scan.
+"""
+
+import math
+
+
+# The score added for every tenfold of impressions.
+IMPRESSION_WEIGHT = 1.0
+
+# The score added to the creatives that were non-compliant on their last scan.
+NONCOMPLIANT_WEIGHT = 3.0
+
+# The score added to the creatives whose snippet changed.
+CHANGED_WEIGHT = 2.0
+
+# The score added to the creatives not scanned for `MAX_AGE_DAYS` days or more. Less is added to the creatives scanned
+# more recently.
+AGE_WEIGHT = 2.0
+MAX_AGE_DAYS = 30
+
+# The number of days of the reports whose impressions are added up.
+IMPRESSION_DAYS = 7
+
+
+def priority_score(impressions, noncompliant, changed, days_since_scan):
+  """
+  Return the priority of a creative.
+
+  :param impressions: the number of recent impressions.
+  :param noncompliant: a boolean value that indicates whether the creative was non-compliant on its last scan.
+  :param changed: a boolean value that indicates whether the snippet changed since the last scan.
+  :param days_since_scan: the number of days since the last scan, or None if the creative was never scanned.
+  :return: a score. A higher score is scanned first.
+  """
+  score = IMPRESSION_WEIGHT * math.log10(1 + max(impressions or 0, 0))
+  if noncompliant:
+    score += NONCOMPLIANT_WEIGHT
+  if changed:
+    score += CHANGED_WEIGHT
+  if days_since_scan is None:
+    days_since_scan = MAX_AGE_DAYS
+  score += AGE_WEIGHT * min(max(days_since_scan, 0), MAX_AGE_DAYS) / float(MAX_AGE_DAYS)
+  return score
@@ -0,0 +1,439 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+"""
+Classes that record the interactions with DFP into fixture files and replay them without DFP.
+
+The recording client wraps the DFP client and saves the creatives downloaded, the creatives uploaded and the report
+into a fixture directory:
+
+* `creatives.jsonl` has a creative on each line, converted by :func:`adscan.dfp.to_serializable`. A creative saved
+  later replaces the one with the same id.
+* `updates.jsonl` has a creative returned by DFP on each upload.
+* `report.csv.gz` is the last report of creative ids and impressions.
+
+The replay client has the same methods as the DFP client used by :mod:`adscan.dfp`. It runs the statements on the
+creatives in the fixture directory, so the statements need not be the ones recorded, and it can wait and fail like a
+remote service to test the pipeline under load.
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import random
+import shutil
+import socket
+import datetime
+import threading
+
+import adscan.fs
+import adscan.dfp
+
+
+CREATIVES_FILE = 'creatives.jsonl'
+UPDATES_FILE = 'updates.jsonl'
+REPORT_FILE = 'report.csv.gz'
+
+# The network code of the replay client, which keeps its sync watermark apart from the ones of the real networks.
+REPLAY_NETWORK_CODE = 'replay'
+
+REPORT_HEADER = 'Dimension.CREATIVE_ID,Column.AD_SERVER_IMPRESSIONS'
+
+ID_PATTERN = re.compile(r'\bid IN \(([^)]*)\)')
+SINCE_PATTERN = re.compile(r'\blastModifiedDateTime > :(\w+)')
+
+
+class FixtureWriter(object):
+  """
+  Class that appends the recorded interactions to the files in a fixture directory. It can be used from multiple
+  threads.
+  """
+
+  def __init__(self, fixture_dir):
+    """
+    Initialize the instance.
+
+    :param fixture_dir: the directory in which the fixture files are saved.
+    """
+    self.fixture_dir = fixture_dir
+    self.lock = threading.Lock()
+    adscan.fs.makedirs(fixture_dir)
+
+  def _append(self, filename, objects):
+    """
+    Append the objects to the file, one on each line.
+
+    :param filename: the name of the file in the fixture directory.
+    :param objects: a list of DFP objects.
+    """
+    lines = [json.dumps(adscan.dfp.to_serializable(obj), separators=(',', ':')) for obj in objects]
+    if not lines:
+      return
+    with self.lock:
+      fp = open(os.path.join(self.fixture_dir, filename), 'ab')
+      try:
+        fp.write('\n'.join(lines) + '\n')
+      finally:
+        fp.close()
+
+  def add_creatives(self, creatives):
+    """
+    Save the creatives downloaded from DFP.
+
+    :param creatives: a list of DFP creatives.
+    """
+    self._append(CREATIVES_FILE, creatives)
+
+  def add_updates(self, creatives):
+    """
+    Save the creatives returned by DFP on upload.
+
+    :param creatives: a list of DFP creatives.
+    """
+    self._append(UPDATES_FILE, creatives)
+
+  def set_report(self, path):
+    """
+    Save a copy of the report file.
+
+    :param path: the path to the gzip-compressed CSV report.
+    """
+    with self.lock:
+      shutil.copyfile(path, os.path.join(self.fixture_dir, REPORT_FILE))
+
+
+class RecordingService(object):
+  """
+  Class that wraps a DFP CreativeService and records the creatives it returns.
+  """
+
+  def __init__(self, service, writer):
+    """
+    Initialize the instance.
+
+    :param service: a DFP CreativeService.
+    :param writer: an instance of :class:`FixtureWriter`.
+    """
+    self.service = service
+    self.writer = writer
+
+  def getCreativesByStatement(self, statement):
+    response = self.service.getCreativesByStatement(statement)
+    self.writer.add_creatives(response['results'] if 'results' in response else [])
+    return response
+
+  def updateCreatives(self, creatives):
+    updated = self.service.updateCreatives(creatives)
+    self.writer.add_updates(updated or [])
+    return updated
+
+  def __getattr__(self, name):
+    return getattr(self.service, name)
+
+
+class RecordingDataDownloader(object):
+  """
+  Class that wraps a DFP DataDownloader and records the reports it downloads.
+  """
+
+  def __init__(self, downloader, writer):
+    """
+    Initialize the instance.
+
+    :param downloader: a DFP DataDownloader.
+    :param writer: an instance of :class:`FixtureWriter`.
+    """
+    self.downloader = downloader
+    self.writer = writer
+
+  def WaitForReport(self, report_job):
+    return self.downloader.WaitForReport(report_job)
+
+  def DownloadReportToFile(self, report_job_id, export_format, outfile):
+    self.downloader.DownloadReportToFile(report_job_id, export_format, outfile)
+    outfile.flush()
+    self.writer.set_report(outfile.name)
+
+
+class RecordingClient(object):
+  """
+  Class that wraps a DFP client and records the interactions of the CreativeService and the reports into a fixture
+  directory.
+  """
+
+  def __init__(self, client, fixture_dir):
+    """
+    Initialize the instance.
+
+    :param client: an instance of googleads.dfp.DfpClient.
+    :param fixture_dir: the directory in which the fixture files are saved.
+    """
+    self.client = client
+    self.network_code = getattr(client, 'network_code', None)
+    self.writer = FixtureWriter(fixture_dir)
+
+  def GetService(self, service_name, version=adscan.dfp.DFP_VERSION):
+    service = self.client.GetService(service_name, version=version)
+    if service_name == 'CreativeService':
+      return RecordingService(service, self.writer)
+    return service
+
+  def GetDataDownloader(self, version=adscan.dfp.DFP_VERSION):
+    return RecordingDataDownloader(self.client.GetDataDownloader(version=version), self.writer)
+
+
+def load_creatives(fixture_dir):
+  """
+  Load the creatives recorded in the fixture directory.
+
+  :param fixture_dir: the directory in which the fixture files are saved.
+  :return: a dictionary of creative ids and dictionaries of the creatives.
+  """
+  creatives = {}
+  path = os.path.join(fixture_dir, CREATIVES_FILE)
+  if not os.path.exists(path):
+    return creatives
+  fp = open(path, 'rb')
+  try:
+    for line in fp:
+      if line.strip():
+        creative = json.loads(line)
+        creatives[int(creative['id'])] = creative
+  finally:
+    fp.close()
+  return creatives
+
+
+class ReplayBackend(object):
+  """
+  Class that holds the creatives of a fixture directory and imitates the latency and the errors of DFP. The services
+  and the data downloader of a replay client share it.
+  """
+
+  def __init__(self, fixture_dir, latency=0.0, fault_rate=0.0, seed=None):
+    """
+    Initialize the instance.
+
+    :param fixture_dir: the directory in which the fixture files are saved.
+    :param latency: the average number of seconds each call takes. The actual time varies by half of it.
+    :param fault_rate: the probability that a call fails with a network error.
+    :param seed: the seed of the random numbers, which makes the latency and the errors reproducible.
+    """
+    self.fixture_dir = fixture_dir
+    self.latency = latency
+    self.fault_rate = fault_rate
+    self.random = random.Random(seed)
+    self.lock = threading.Lock()
+    self.creatives = load_creatives(fixture_dir)
+    self.call_count = 0
+    self.fault_count = 0
+
+  def call(self):
+    """
+    Wait for the latency of a call, and raise a network error at the fault rate.
+    """
+    with self.lock:
+      self.call_count += 1
+      seconds = self.latency * self.random.uniform(0.5, 1.5)
+      fault = self.random.random() < self.fault_rate
+      if fault:
+        self.fault_count += 1
+    if seconds > 0:
+      time.sleep(seconds)
+    if fault:
+      raise socket.error('Injected fault of the replayed DFP')
+
+  def select(self, statement):
+    """
+    Run a statement of the CreativeService on the creatives. The ids in 'id IN (...)', the time bound of
+    'lastModifiedDateTime > :date', and LIMIT and OFFSET are understood, and the rest of the query is ignored.
+
+    :param statement: a statement.
+    :return: a list of the creatives sorted by id.
+    """
+    query, limit, offset = adscan.dfp.parse_page(statement)
+    with self.lock:
+      match = ID_PATTERN.search(query)
+      if match:
+        ids = set(int(i) for i in match.group(1).split(',') if i.strip())
+        creatives = [self.creatives[i] for i in ids if i in self.creatives]
+      else:
+        creatives = self.creatives.values()
+
+    match = SINCE_PATTERN.search(query)
+    if match:
+      values = dict((value['key'], value['value']['value']) for value in statement.get('values') or [])
+      since = values[match.group(1)]
+      creatives = [c for c in creatives if (adscan.dfp.last_modified(c) or '') > since]
+
+    creatives.sort(key=lambda c: int(c['id']))
+    if limit is None:
+      return creatives[offset:]
+    return creatives[offset:(offset + limit)]
+
+  def update(self, creatives):
+    """
+    Replace the creatives with the uploaded ones, which are modified now as in DFP.
+
+    :param creatives: a list of DFP creatives.
+    :return: a list of the creatives updated.
+    """
+    updated = []
+    now = _dfp_time(datetime.datetime.now().replace(microsecond=0))
+    with self.lock:
+      for creative in creatives:
+        creative = adscan.dfp.to_serializable(creative)
+        creative['lastModifiedDateTime'] = now
+        self.creatives[int(creative['id'])] = creative
+        updated.append(creative)
+    return updated
+
+
+class ReplayService(object):
+  """
+  Class that has the methods of the DFP CreativeService used by :mod:`adscan.dfp`.
+  """
+
+  def __init__(self, backend):
+    """
+    Initialize the instance.
+
+    :param backend: an instance of :class:`ReplayBackend`.
+    """
+    self.backend = backend
+
+  def getCreativesByStatement(self, statement):
+    self.backend.call()
+    results = self.backend.select(statement)
+    return {'results': results, 'totalResultSetSize': len(results)}
+
+  def updateCreatives(self, creatives):
+    self.backend.call()
+    return self.backend.update(creatives)
+
+
+class ReplayDataDownloader(object):
+  """
+  Class that has the methods of the DFP DataDownloader used by :mod:`adscan.dfp`. The recorded report is returned for
+  any report job.
+  """
+
+  def __init__(self, backend):
+    """
+    Initialize the instance.
+
+    :param backend: an instance of :class:`ReplayBackend`.
+    """
+    self.backend = backend
+
+  def WaitForReport(self, report_job):
+    return 'replay'
+
+  def DownloadReportToFile(self, report_job_id, export_format, outfile):
+    path = os.path.join(self.backend.fixture_dir, REPORT_FILE)
+    if not os.path.exists(path):
+      raise Exception('No report is recorded in %s' % self.backend.fixture_dir)
+    fp = open(path, 'rb')
+    try:
+      shutil.copyfileobj(fp, outfile)
+    finally:
+      fp.close()
+
+
+class ReplayClient(object):
+  """
+  Class that has the methods of the DFP client used by :mod:`adscan.dfp`, and serves the fixture files.
+  """
+
+  def __init__(self, fixture_dir, latency=0.0, fault_rate=0.0, seed=None):
+    """
+    Initialize the instance.
+
+    :param fixture_dir: the directory in which the fixture files are saved.
+    :param latency: the average number of seconds each call takes.
+    :param fault_rate: the probability that a call fails with a network error.
+    :param seed: the seed of the random numbers.
+    """
+    self.backend = ReplayBackend(fixture_dir, latency, fault_rate, seed)
+    self.network_code = REPLAY_NETWORK_CODE
+
+  def GetService(self, service_name, version=adscan.dfp.DFP_VERSION):
+    if service_name != 'CreativeService':
+      raise Exception('%s is not replayed' % service_name)
+    return ReplayService(self.backend)
+
+  def GetDataDownloader(self, version=adscan.dfp.DFP_VERSION):
+    return ReplayDataDownloader(self.backend)
+
+
+def _dfp_time(value):
+  """
+  Convert a datetime into a DateTime dictionary of DFP.
+  """
+  return {
+    'date': {'year': value.year, 'month': value.month, 'day': value.day},
+    'hour': value.hour,
+    'minute': value.minute,
+    'second': value.second,
+    'timeZoneID': 'America/Los_Angeles'
+  }
+
+
+def generate_fixtures(fixture_dir, count, seed=0):
+  """
+  Save synthetic creatives and a report of them into a fixture directory, so the pipeline can be run at any scale
+  without recording it first. Half of the creatives have insecure urls, and they were modified in the last two weeks.
+
+  :param fixture_dir: the directory in which the fixture files are saved.
+  :param count: the number of creatives.
+  :param seed: the seed of the random numbers.
+  """
+  rand = random.Random(seed)
+  now = datetime.datetime.now().replace(microsecond=0)
+  creatives = []
+  for creative_id in xrange(1, count + 1):
+    scheme = rand.choice(['http', 'https'])
+    url = '%s://ads%d.example.com/%d.png' % (scheme, creative_id % 50, creative_id)
+    creative = {
+      'id': creative_id,
+      'name': 'creative %d' % creative_id,
+      'previewUrl': 'https://www.example.com/preview?creativeId=%d' % creative_id,
+      'lastModifiedDateTime': _dfp_time(now - datetime.timedelta(seconds=rand.randint(0, 14 * 24 * 3600)))
+    }
+    kind = creative_id % 3
+    if kind == 0:
+      creative['xsi_type'] = 'ThirdPartyCreative'
+      creative['snippet'] = '<a href="%%%%CLICK_URL_UNESC%%%%"><img src="%s"></a>' % url
+      creative['expandedSnippet'] = creative['snippet']
+    elif kind == 1:
+      creative['xsi_type'] = 'CustomCreative'
+      creative['htmlSnippet'] = '<script src="%s://js.example.com/ad.js"></script><img src="%s">' % (scheme, url)
+    else:
+      creative['xsi_type'] = 'ImageCreative'
+      creative['primaryImageAsset'] = {'xsi_type': 'CreativeAsset', 'assetUrl': url}
+    creatives.append(creative)
+
+  writer = FixtureWriter(fixture_dir)
+  path = os.path.join(fixture_dir, CREATIVES_FILE)
+  if os.path.exists(path):
+    os.remove(path)
+  writer.add_creatives(creatives)
+
+  report = gzip.open(os.path.join(fixture_dir, REPORT_FILE), 'wb')
+  try:
+    report.write(REPORT_HEADER + '\n')
+    for creative in creatives:
+      report.write('%d,%d\n' % (creative['id'], int(rand.paretovariate(1.2) * 100)))
+  finally:
+    report.close()
@@ -16,6 +16,7 @@ Functions to launch a new scanning process.
 
 import sys
 import os.path
+import argparse
 from ConfigParser import SafeConfigParser
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
@@ -38,10 +39,29 @@ def get_boolean(config, section, option):
   return config.has_option(section, option) and config.getboolean(section, option)
 
 
+def parse_args(args=None):
+  """
+  Parse the command line arguments.
+
+  :param args: a list of arguments. The arguments of the process are used if None.
+  :return: the parsed arguments.
+  """
+  parser = argparse.ArgumentParser(description='Scan creatives to detect and fix SSL non-compliant ones.')
+  parser.add_argument('--backfill-cache', action='store_true',
+                      help='fill the creative cache from the creatives in the database and exit')
+  parser.add_argument('--compact-snippets', action='store_true',
+                      help='move the snippets stored by older versions into the blob table and exit')
+  parser.add_argument('--deadline', metavar='HH:MM',
+                      help='the time of day by which the scan should finish, which overrides the config')
+  return parser.parse_args(args)
+
+
 def main():
   """
   The main method to launch the scanner.
   """
+  args = parse_args()
+
   # Move to the project directory.
   project_dir = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir)
   os.chdir(project_dir)
@@ -51,8 +71,18 @@ def main():
   config.read(conf_file)
 
   scanner = Scanner(config)
+  if args.deadline:
+    scanner.set_deadline(args.deadline)
   scanner.setup_environment()
 
+  if args.backfill_cache:
+    scanner.backfill_creative_cache()
+    sys.exit(0)
+
+  if args.compact_snippets:
+    scanner.compact_snippets()
+    sys.exit(0)
+
   if get_boolean(config, 'Steps', 'download_new_creative_ids'):
     scanner.download_new_creative_ids()
 
@@ -74,6 +104,9 @@ def main():
   if get_boolean(config, 'Steps', 'compress_log_file'):
     scanner.compress_log_file()
 
+  if get_boolean(config, 'Steps', 'archive_old_rows'):
+    scanner.archive_old_rows()
+
   if get_boolean(config, 'Steps', 'remove_temp_files'):
     scanner.remove_temp_files()
 
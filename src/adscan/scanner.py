@@ -16,7 +16,9 @@ setting False to the corresponding item in config.ini.
 
 1. download_new_creative_ids
    This step downloads the IDs of recently-served creatives from DFP. The IDs
-   are saved in the creative table in the database.
+   are saved in the creative table in the database, and their impressions in
+   the creative_impression table. The report is read as a stream and saved in
+   chunks.
 
 2. download_creatives
    This steps downloads the creatives corresponding to the IDs downloaded in
@@ -41,11 +43,12 @@ setting False to the corresponding item in config.ini.
 4. browse_creatives_over_http
    Similar to the previous step, but this step serves the creatives on HTTP
    servers. The network logs are used as a hint for detecting the SSL non-
-   compliant creatives in the next step.
+   compliant creatives in the next step. By default, only the modified
+   creatives are browsed and their requests are only counted.
 
 5. check_compliance
-   This steps analyzes the network logs to detect SSL non-compliant creatives,
-   and save the SSL compliance into the databse.
+   This steps saves the SSL compliance of the creatives into the databse. The
+   compliance is aggregated from the network logs while browsing creatives.
 
 6. upload_creatives
    The creatives are uploaded to DFP if they will become SSL compliant after
@@ -54,26 +57,38 @@ setting False to the corresponding item in config.ini.
 7. compress_log_file
    Compress the network log file at the end of the scanning process.
 
-8. remove_temp_files
+8. archive_old_rows
+   Move the rows older than the retention period from the database into
+   compressed archive files, and shrink the database.
+
+9. remove_temp_files
    Delete the all files under the temporary directory.
 """
 
 import os.path
 import datetime
+import urlparse
+import itertools
 
-from sqlalchemy import func, text
+from sqlalchemy import func, and_, or_, case, exists, select, union
 
 import adscan.db
 import adscan.dfp
+import adscan.archive
 import adscan.fs
 import adscan.net
+import adscan.priority
 import adscan.transform
 from adscan.issue import IssueType
 from adscan.xvfb import XvfbController
 from adscan.server import ServerController
 from adscan.browser import BrowserController
-from adscan.model import Creative, ScanLog
+from adscan.analyzer import AnalyzerController
+from adscan.deadline import Deadline, parse_deadline
+from adscan.compliance import ComplianceAggregator, COMPLIANT_ISSUES
+from adscan.model import Blob, Creative, CreativeCache, CreativeImpression, DfpCreative, SyncWatermark, Url, ScanLog, ScanLogDetail, ScanLogHost, HostVerdict, load_blobs, save_blobs
 from adscan.workspace import Workspace
+from adscan.writer import ScanLogRecord, ScanLogWriter, UrlDictionary
 
 
 class Scanner(object):
@@ -84,6 +99,7 @@ class Scanner(object):
   CONF_STEPS = 'Steps'
   CONF_DIRS = 'Directories'
   CONF_LOGS = 'Logs'
+  CONF_DATABASE = 'Database'
   CONF_BROWSER = 'Browser'
   CONF_SERVER = 'Server'
   CONF_MISCS = 'Miscs'
@@ -97,9 +113,22 @@ class Scanner(object):
     # Directories
     self.logroot_dir = self.config.get(self.CONF_DIRS, 'logroot_dir')
     self.tmp_dir = self.config.get(self.CONF_DIRS, 'tmp_dir')
+    self.archive_dir = self.config.get(self.CONF_DIRS, 'archive_dir')
+    self.fixture_dir = self.config.get(self.CONF_DIRS, 'fixture_dir')
 
     # Logs
     self.creative_db = self.config.get(self.CONF_LOGS, 'creative_db')
+    self.scanlog_batch_size = self.config.getint(self.CONF_LOGS, 'scanlog_batch_size')
+    self.scanlog_flush_interval = self.config.getfloat(self.CONF_LOGS, 'scanlog_flush_interval')
+    self.scanlog_queue_size = self.config.getint(self.CONF_LOGS, 'scanlog_queue_size')
+    self.scanlog_mode = self.config.get(self.CONF_LOGS, 'scanlog_mode')
+    if self.scanlog_mode not in ['url', 'host']:
+      raise Exception('Unknown scanlog mode: %s' % self.scanlog_mode)
+
+    # Database
+    self.db_options = {}
+    if self.config.has_section(self.CONF_DATABASE):
+      self.db_options = dict(self.config.items(self.CONF_DATABASE))
 
     # Browser
     self.browser_count = self.config.getint(self.CONF_BROWSER, 'browser_count')
@@ -109,6 +138,10 @@ class Scanner(object):
     self.cookie_dir = self.config.get(self.CONF_BROWSER, 'cookie_dir')
     self.save_netlog = self.config.get(self.CONF_BROWSER, 'save_netlog')
     self.xserver_offset = self.config.getint(self.CONF_BROWSER, 'xserver_offset')
+    self.analyzer_count = self.config.getint(self.CONF_BROWSER, 'analyzer_count')
+    self.analyzer_timeout = self.config.getfloat(self.CONF_BROWSER, 'analyzer_timeout')
+    self.http_modified_only = self.config.getboolean(self.CONF_BROWSER, 'http_modified_only')
+    self.http_count_only = self.config.getboolean(self.CONF_BROWSER, 'http_count_only')
 
     # Server
     self.server_count = self.config.getint(self.CONF_SERVER, 'server_count')
@@ -119,6 +152,24 @@ class Scanner(object):
     self.days_ago = self.config.getint(self.CONF_MISCS, 'days_ago')
     self.country = self.config.get(self.CONF_MISCS, 'country')
     self.max_scan = self.config.getint(self.CONF_MISCS, 'max_scan')
+    self.incremental = self.config.getboolean(self.CONF_MISCS, 'incremental')
+    self.max_scan_age = self.config.getint(self.CONF_MISCS, 'max_scan_age')
+    self.rescan_days = self.config.getint(self.CONF_MISCS, 'rescan_days')
+    if self.rescan_days < 0:
+      raise Exception('rescan_days should be 0 or more: %d' % self.rescan_days)
+    self.retention_days = self.config.getint(self.CONF_MISCS, 'retention_days')
+    self.dfp_client_count = self.config.getint(self.CONF_MISCS, 'dfp_client_count')
+    self.dfp_max_retries = self.config.getint(self.CONF_MISCS, 'dfp_max_retries')
+    self.dfp_upload_batch_size = self.config.getint(self.CONF_MISCS, 'dfp_upload_batch_size')
+    self.sync_overlap = self.config.getint(self.CONF_MISCS, 'sync_overlap')
+    self.deadline_reserve = self.config.getint(self.CONF_MISCS, 'deadline_reserve')
+    self.deadline_http_share = self.config.getfloat(self.CONF_MISCS, 'deadline_http_share')
+    self.deadline = None
+    self.set_deadline(self.config.get(self.CONF_MISCS, 'deadline'))
+    adscan.dfp.set_backend(
+      self.config.get(self.CONF_MISCS, 'dfp_backend'), self.fixture_dir,
+      latency=self.config.getfloat(self.CONF_MISCS, 'dfp_replay_latency'),
+      fault_rate=self.config.getfloat(self.CONF_MISCS, 'dfp_replay_fault_rate'))
 
     dirname = datetime.date.today().strftime('%Y%m%d')
     self.log_dir = os.path.join(self.logroot_dir, dirname)
@@ -127,18 +178,76 @@ class Scanner(object):
     self.db_session = None
     self.debug = False
 
+    # The ids of the creatives that have the same snippet as the creative scanned.
+    self.duplicate_ids = {}
+
+    # The writer of scan logs, which runs while browsing creatives.
+    self.scanlog_writer = None
+
+    # The compliance state of the creatives, which is aggregated from the scan logs.
+    self.compliance = ComplianceAggregator()
+
+    # The ids of the URLs in the scan logs.
+    self.urls = UrlDictionary(Url.__table__)
+
+  def set_deadline(self, value):
+    """
+    Set the time by which the scan should finish. The browsers stop taking new creatives when `deadline_reserve`
+    minutes are left, so that the compliance of the creatives scanned can be checked and uploaded.
+
+    :param value: a string of the time of day, `HH:MM`. An empty string means no deadline.
+    """
+    end_time = parse_deadline(value)
+    self.deadline = Deadline(end_time, self.deadline_reserve * 60) if end_time else None
+    if end_time:
+      print 'The creatives will be browsed until %d minutes before %s.' % (self.deadline_reserve, end_time)
+
   def _update_creatives(self, creative_ids, values):
     """
-    Update creaives in the database. We need to construct a sql because criteria does not accept so many entries in 'IN' statement.
+    Update today's creaives in the database. The ids are loaded into a temporary table because criteria does not accept
+    so many entries in 'IN' statement.
 
     :param creative_ids: a list of creative ids.
     :param values: a dict of data to be updaed in the database.
     """
-    date = datetime.date.today().strftime('%Y-%m-%d')
-    ids = ','.join([str(i) for i in creative_ids])
-    self.db_session.execute(
-      'UPDATE %s SET %s where created_at = \'%s\' AND creative_id IN (%s)' % (Creative.__tablename__, values, date, ids)
-    )
+    adscan.db.update_by_ids(
+      self.db_session, Creative.creative_id, creative_ids, values, Creative.created_at == datetime.date.today())
+
+  def _latest_creatives_subquery(self, creative_ids, *criteria):
+    """
+    Return a subquery of the creative id and the created date of the latest row of each creative that satisfies the
+    criteria.
+
+    :param creative_ids: a list of creative ids.
+    :param criteria: the criteria of the rows.
+    :return: a subquery.
+    """
+    ids_table = adscan.db.load_ids(self.db_session, creative_ids)
+    return self.db_session.query(
+      Creative.creative_id.label('creative_id'),
+      func.max(Creative.created_at).label('created_at')
+    ).join(
+      ids_table, ids_table.c.id == Creative.creative_id
+    ).filter(
+      *criteria
+    ).group_by(
+      Creative.creative_id
+    ).subquery()
+
+  def _load_latest_creatives(self, creative_ids, *criteria):
+    """
+    Load the latest row of each creative that satisfies the criteria.
+
+    :param creative_ids: a list of creative ids.
+    :param criteria: the criteria of the rows.
+    :return: a list of creatives.
+    """
+    latest = self._latest_creatives_subquery(creative_ids, *criteria)
+    return self.db_session.query(
+      Creative
+    ).join(
+      latest, and_(Creative.creative_id == latest.c.creative_id, Creative.created_at == latest.c.created_at)
+    ).all()
 
   def setup_environment(self):
     """
@@ -156,32 +265,489 @@ class Scanner(object):
     self.workspace = Workspace(self.tmp_dir, self.browser_count)
     self.workspace.create()
 
-    self.db_session = adscan.db.new_session(self.creative_db, [Creative, ScanLog])
+    self.db_session = save_blobs(adscan.db.new_session(self.creative_db, [Blob, Creative, CreativeCache, CreativeImpression, DfpCreative, SyncWatermark, Url, ScanLog, ScanLogDetail, ScanLogHost, HostVerdict], options=self.db_options))
+
+  def _load_caches(self, creative_ids):
+    """
+    Load the latest snippets of the creatives from the cache.
+
+    :param creative_ids: a list of creative ids.
+    :return: a list of :class:`~model.CreativeCache`.
+    """
+    ids_table = adscan.db.load_ids(self.db_session, creative_ids)
+    return self.db_session.query(
+      CreativeCache
+    ).join(
+      ids_table, ids_table.c.id == CreativeCache.creative_id
+    ).all()
+
+  def _update_caches(self, creatives, modified_times=None):
+    """
+    Save the snippets of the creatives into the cache. This function does not commit the change.
+
+    :param creatives: a list of creatives that have snippets.
+    :param modified_times: a dictionary of creative ids and the lastModifiedDateTime of the creatives downloaded from
+      DFP. The time of a cache is kept if its creative was not downloaded.
+    """
+    modified_times = modified_times or {}
+    cache_dict = dict((cache.creative_id, cache) for cache in self._load_caches([c.creative_id for c in creatives]))
+    for creative in creatives:
+      cache = cache_dict.get(creative.creative_id)
+      if cache is None:
+        cache = CreativeCache(creative_id=creative.creative_id)
+        self.db_session.add(cache)
+        cache_dict[creative.creative_id] = cache
+      cache.merge(creative)
+      if creative.creative_id in modified_times:
+        cache.last_modified = modified_times[creative.creative_id]
+
+  def _skip_cached_dfp_creatives(self, dfp_creatives):
+    """
+    Remove the DFP creatives whose cache was made from the same version, so that they are loaded from the cache
+    instead of being converted again. TemplateCreative is always kept because it is not loaded from the cache.
+
+    :param dfp_creatives: a list of creative objects downloaded from DFP.
+    :return: a list of the creative objects that are newer than their caches.
+    """
+    cached = dict(
+      (cache.creative_id, cache.last_modified)
+      for cache in self._load_caches([int(dfp['id']) for dfp in dfp_creatives])
+      if cache.last_modified and cache.creative_type != 'TemplateCreative')
+    return [dfp for dfp in dfp_creatives
+            if cached.get(int(dfp['id'])) is None or cached[int(dfp['id'])] != adscan.dfp.last_modified(dfp)]
+
+  def _expire_caches(self, dfp_creatives):
+    """
+    Delete the caches older than the DFP creatives, so that the creatives are downloaded again when they are served.
+    This function does not commit the change.
+
+    :param dfp_creatives: a list of creative objects downloaded from DFP.
+    :return: the number of caches deleted.
+    """
+    times = dict((int(dfp['id']), adscan.dfp.last_modified(dfp)) for dfp in dfp_creatives)
+    count = 0
+    for cache in self._load_caches(times.keys()):
+      if cache.last_modified is None or cache.last_modified != times[cache.creative_id]:
+        self.db_session.delete(cache)
+        count += 1
+    return count
+
+  def _load_sync_watermark(self):
+    """
+    Load the sync watermark of the DFP network. A new watermark is added to the session if the network has none.
+
+    :return: an instance of :class:`~model.SyncWatermark`.
+    """
+    network_code = adscan.dfp.network_code()
+    watermark = self.db_session.query(SyncWatermark).get(network_code)
+    if watermark is None:
+      watermark = SyncWatermark(network_code=network_code)
+      self.db_session.add(watermark)
+    return watermark
+
+  def _load_dfp_creatives(self, creative_ids):
+    """
+    Load the DFP objects of the creatives stored in the download step.
+
+    :param creative_ids: a list of creative ids.
+    :return: a list of :class:`~model.DfpCreative`.
+    """
+    ids_table = adscan.db.load_ids(self.db_session, creative_ids)
+    return self.db_session.query(
+      DfpCreative
+    ).join(
+      ids_table, ids_table.c.id == DfpCreative.creative_id
+    ).all()
+
+  def _save_dfp_creatives(self, dfp_creatives):
+    """
+    Store the DFP objects of the creatives so that the upload step does not download them again. TemplateCreative is
+    not stored because its template variables are read as DFP objects. This function does not commit the change.
+
+    :param dfp_creatives: a list of creative objects downloaded from DFP.
+    """
+    dfp_creatives = [dfp for dfp in dfp_creatives if adscan.transform.dfp_type(dfp) != 'TemplateCreative']
+    stored_dict = dict(
+      (stored.creative_id, stored) for stored in self._load_dfp_creatives([int(dfp['id']) for dfp in dfp_creatives]))
+    for dfp in dfp_creatives:
+      stored = stored_dict.get(int(dfp['id']))
+      if stored is None:
+        stored = DfpCreative(creative_id=int(dfp['id']))
+        self.db_session.add(stored)
+        stored_dict[stored.creative_id] = stored
+      stored.last_modified = adscan.dfp.last_modified(dfp)
+      stored.set_object(adscan.dfp.to_serializable(dfp))
+
+  def backfill_creative_cache(self):
+    """
+    Fill the cache with the latest snippet of each creative in the creative table. The creatives already in the cache
+    are not changed. This is needed only once for the databases created before the cache was introduced.
+    """
+    latest = self.db_session.query(
+      Creative.creative_id.label('creative_id'),
+      func.max(Creative.created_at).label('created_at')
+    ).filter(
+      Creative.snippet != None
+    ).group_by(
+      Creative.creative_id
+    ).subquery()
+
+    rows = self.db_session.query(
+      Creative.created_at, Creative.updated_at, Creative.creative_id, Creative.creative_type, Creative.preview_url,
+      Creative._snippet, Creative._expanded_snippet, Creative.snippet_ref, Creative.expanded_snippet_ref
+    ).join(
+      latest, and_(Creative.creative_id == latest.c.creative_id, Creative.created_at == latest.c.created_at)
+    ).filter(
+      ~exists().where(CreativeCache.creative_id == Creative.creative_id)
+    )
+
+    columns = ['created_at', 'updated_at', 'creative_id', 'creative_type', 'preview_url', 'snippet', 'expanded_snippet',
+               'snippet_ref', 'expanded_snippet_ref']
+    result = self.db_session.execute(CreativeCache.__table__.insert().from_select(columns, rows.statement))
+    self.db_session.commit()
+    print '%d creatives were added to the cache.' % result.rowcount
+
+  def compact_snippets(self, batch_size=1000):
+    """
+    Move the snippets stored in the creative and cache tables by older versions into the blob table, and reclaim the
+    space they used. This is needed only once for the databases created before the blob table was introduced.
+
+    :param batch_size: the number of rows moved in each transaction.
+    """
+    for table in [Creative, CreativeCache]:
+      legacy = [getattr(table, '_%s' % name) for name in table.blob_fields]
+      count = 0
+      while True:
+        rows = self.db_session.query(table).filter(or_(*[column != None for column in legacy])).limit(batch_size).all()
+        if not rows:
+          break
+        for row in rows:
+          for name in table.blob_fields:
+            # Setting the value stores it in the blob table and clears the old column.
+            setattr(row, name, getattr(row, name))
+        self.db_session.commit()
+        count += len(rows)
+      print '%d rows in %s were compacted.' % (count, table.__tablename__)
+
+    engine = self.db_session.get_bind()
+    if engine.dialect.name == 'sqlite':
+      engine.execute('VACUUM')
+
+  def _select_incremental_creatives(self, creatives):
+    """
+    Select the creatives that need to be scanned again. A creative is scanned again if it has not been scanned yet, its
+    snippet changed, its last scan is older than `max_scan_age` days or was deferred over http, the SSL compliance of a
+    host it made requests to changed after its last scan, or it is in today's share of the rolling rescan that covers
+    all creatives in `rescan_days` days. The other creatives carry forward the compliance and request match of their last scan.
+
+    :param creatives: a list of creatives of today.
+    :return: a list of the creatives to be scanned.
+    """
+    today = datetime.date.today()
+    if len(creatives) == 0:
+      return creatives
+
+    # Load the last scanned row of each creative.
+    previous = self._load_latest_creatives(
+      [creative.creative_id for creative in creatives],
+      Creative.created_at < today,
+      Creative.scanned_at != None
+    )
+    previous_dict = dict((p.creative_id, p) for p in previous)
+
+    # The creatives that carry forward their last scan unless a host they made requests to changed. A `rescan_days` of
+    # 0 scans all the creatives every day.
+    candidates = []
+    for creative in creatives:
+      p = previous_dict.get(creative.creative_id)
+      if not (p is None or p.compliance is None or
+              creative.snippet_hash is None or creative.snippet_hash != p.snippet_hash or
+              (today - p.scanned_at).days > self.max_scan_age or p.deferred or self.rescan_days == 0 or
+              creative.creative_id % self.rescan_days == today.toordinal() % self.rescan_days):
+        candidates.append((creative, p))
+
+    # Find the candidates that made requests to the hosts whose compliance changed after their last scan. Only their
+    # scan logs of the days they were last scanned are read.
+    changed_ids = set()
+    if candidates:
+      changed_hosts = dict(self.db_session.query(
+        HostVerdict.host, HostVerdict.changed_at
+      ).filter(
+        HostVerdict.changed_at > min(p.scanned_at for _, p in candidates)
+      ).all())
+      last_change = max(changed_hosts.values()) if changed_hosts else None
+      checked = [(creative, p) for creative, p in candidates if last_change and p.scanned_at < last_change]
+      if checked:
+        table = self._scanlog_table()
+        ids_table = adscan.db.load_ids(self.db_session, [creative.creative_id for creative, _ in checked])
+        hosts = self._requested_hosts(
+          table.creative_id, table.created_at
+        ).join(
+          ids_table, ids_table.c.id == table.creative_id
+        ).filter(
+          table.created_at.in_(set(p.scanned_at for _, p in checked))
+        ).distinct()
+        for value, creative_id, created_at in hosts:
+          p = previous_dict[creative_id]
+          host = self._to_host(value)
+          if p.scanned_at == created_at and host in changed_hosts and changed_hosts[host] > p.scanned_at:
+            changed_ids.add(creative_id)
+
+    carried = dict((creative.creative_id, p) for creative, p in candidates if creative.creative_id not in changed_ids)
+    to_scan = []
+    for creative in creatives:
+      p = carried.get(creative.creative_id)
+      if p is None:
+        to_scan.append(creative)
+      else:
+        creative.compliance = p.compliance
+        creative.request_match = p.request_match
+        creative.scanned_at = p.scanned_at
+
+    print '%d creatives carry forward their last scan results.' % (len(creatives) - len(to_scan))
+    return to_scan
+
+  def _load_priority_history(self, creative_ids):
+    """
+    Load what the priorities of creatives are scored from, other than their snippets: the snippet hash, the compliance
+    and the scanned date of the last row of each creative, and its recent impressions. Only these columns are loaded,
+    and the history can be used for the same creatives again after their snippets are known.
+
+    :param creative_ids: a list of creative ids.
+    :return: a tuple of a dictionary of creative ids and their last rows, and a dictionary of creative ids and their
+      impressions.
+    """
+    today = datetime.date.today()
+    latest = self._latest_creatives_subquery(creative_ids, Creative.created_at < today)
+    previous = self.db_session.query(
+      Creative.creative_id, Creative.snippet_hash, Creative.compliance, Creative.scanned_at
+    ).join(
+      latest, and_(Creative.creative_id == latest.c.creative_id, Creative.created_at == latest.c.created_at)
+    ).all()
+
+    since = today - datetime.timedelta(days=self.days_ago + adscan.priority.IMPRESSION_DAYS)
+    ids_table = adscan.db.load_ids(self.db_session, creative_ids)
+    impressions = dict(self.db_session.query(
+      CreativeImpression.creative_id, func.sum(CreativeImpression.impressions)
+    ).join(
+      ids_table, ids_table.c.id == CreativeImpression.creative_id
+    ).filter(
+      CreativeImpression.served_at > since
+    ).group_by(
+      CreativeImpression.creative_id
+    ).all())
+    return (dict((p.creative_id, p) for p in previous), impressions)
+
+  def _update_priorities(self, creatives, history=None):
+    """
+    Set the priority of today's creatives from their recent impressions and their last rows. This function does not
+    commit the change.
+
+    :param creatives: a list of creatives of today.
+    :param history: the history of the creatives loaded by :meth:`_load_priority_history`. It is loaded if None.
+    """
+    today = datetime.date.today()
+    if len(creatives) == 0:
+      return
+    if history is None:
+      history = self._load_priority_history([creative.creative_id for creative in creatives])
+    previous_dict, impressions = history
+
+    for creative in creatives:
+      p = previous_dict.get(creative.creative_id)
+      changed = p is None or (creative.snippet_hash is not None and creative.snippet_hash != p.snippet_hash)
+      days_since_scan = (today - p.scanned_at).days if p is not None and p.scanned_at else None
+      creative.priority = adscan.priority.priority_score(
+        impressions.get(creative.creative_id, 0), p is not None and p.compliance == False, changed, days_since_scan)
+
+  def _scanlog_table(self):
+    """
+    Return the table class in which the scan logs are saved.
+    """
+    return ScanLogHost if self.scanlog_mode == 'host' else ScanLogDetail
+
+  def _scanlog_host_column(self):
+    """
+    Return the column that identifies the hosts in the scan log table. The URLs are used if the scan logs are not
+    aggregated by hosts.
+    """
+    return ScanLogHost.host if self.scanlog_mode == 'host' else ScanLogDetail.url
+
+  def _requested_hosts(self, *columns):
+    """
+    Return a query of the hosts, or the URLs if the scan logs are not aggregated by hosts, that creatives made
+    requests to over https. Use :meth:`_to_host` to get the host of the first column of each row.
+
+    :param columns: the columns queried with the hosts.
+    :return: a query.
+    """
+    host_column = self._scanlog_host_column()
+    return self.db_session.query(
+      host_column, *columns
+    ).filter(
+      self._scanlog_table().protocol == 'https',
+      host_column != None
+    )
+
+  def _to_host(self, value):
+    """
+    Return the host of a value of the column returned by :meth:`_scanlog_host_column`.
+
+    :param value: a host or a URL.
+    :return: the host.
+    """
+    return value if self.scanlog_mode == 'host' else urlparse.urlparse(value).hostname
+
+  def _update_host_verdicts(self):
+    """
+    Save the SSL compliance of the hosts that creatives made requests to over https today. The date of the change is
+    recorded if the compliance of a host changed from the last scan.
+    """
+    today = datetime.date.today()
+    verdicts = {}
+    for value, max_issue_id in self._requested_hosts(
+      func.max(self._scanlog_table().issue_id)
+    ).filter(
+      self._scanlog_table().created_at == today
+    ).group_by(
+      self._scanlog_host_column()
+    ):
+      host = self._to_host(value)
+      if host:
+        verdicts[host] = verdicts.get(host, True) and max_issue_id == IssueType.NO_ISSUE
+
+    existing = dict((h.host, h) for h in self.db_session.query(HostVerdict).all())
+    for host, compliance in verdicts.iteritems():
+      verdict = existing.get(host)
+      if verdict is None:
+        self.db_session.add(HostVerdict(host=host, compliance=compliance))
+      elif verdict.compliance != compliance:
+        verdict.compliance = compliance
+        verdict.changed_at = today
+    print '# of hosts: %d' % len(verdicts)
+
+  def _group_duplicate_creatives(self, creatives, protocol):
+    """
+    Group the creatives by the hash of their normalized scan snippets. The first creative in each group represents the
+    group, and the ids of the other creatives are kept in `duplicate_ids` so that the scan logs are copied to them.
+
+    :param creatives: a list of creatives.
+    :param protocol: `https` or `http`.
+    :return: a list of the creatives that represent the groups.
+    """
+    self.duplicate_ids = {}
+    representatives = {}
+    unique_creatives = []
+    for creative in creatives:
+      s_snippet, ms_snippet = adscan.transform.select_scan_snippets(creative)
+      key = adscan.transform.snippet_hash(ms_snippet if protocol == 'https' else s_snippet)
+      if key is None:
+        unique_creatives.append(creative)
+      elif key in representatives:
+        self.duplicate_ids[str(representatives[key].creative_id)].append(creative.creative_id)
+      else:
+        representatives[key] = creative
+        self.duplicate_ids[str(creative.creative_id)] = []
+        unique_creatives.append(creative)
+    return unique_creatives
 
   def scanlog(self, creative_id, issue_id, protocol, url=None):
     """
-    A function to add a scan log to the database. This function does not commit the change.
+    A function to add a scan log to the database and the compliance aggregator. The scan log is also added for the
+    creatives that have the same snippet as the creative. While browsing creatives, the scan log is passed to the
+    background writer, which can be called from multiple threads. Otherwise, this function does not commit the change.
 
     :param creative_id: a creative id.
     :param issue_id: an issue id defined in :class:`adscan.issue.IssueType`.
     :param protocol: an HTTP protocol, `https` or `http`.
     :param url: a URL.
     """
-    scanlog = ScanLog(creative_id=creative_id, issue_id=issue_id, protocol=protocol, url=url)
-    self.db_session.add(scanlog)
-
-  def download_new_creative_ids(self):
+    creative_ids = [creative_id] + self.duplicate_ids.get(str(creative_id), [])
+    for _creative_id in creative_ids:
+      self.compliance.add(_creative_id, issue_id, protocol, url=url)
+      if self.scanlog_writer:
+        self.scanlog_writer.put(ScanLogRecord(datetime.date.today(), int(_creative_id), issue_id, protocol, url=url))
+      elif self.scanlog_mode == 'host':
+        host = urlparse.urlparse(url).hostname if url else None
+        scanlog = ScanLogHost(
+          creative_id=_creative_id, host=host, issue_id=issue_id, protocol=protocol, count=1 if url else 0)
+        self.db_session.add(scanlog)
+      else:
+        url_id = self.urls.intern(self.db_session, [url]).get(url)
+        scanlog = ScanLog(creative_id=_creative_id, issue_id=issue_id, protocol=protocol, url_id=url_id)
+        self.db_session.add(scanlog)
+
+  def download_new_creative_ids(self, chunk_size=5000):
     """
-    Download the IDs of recently-served creatives from DFP. The IDs are saved in the creative
-    table in the database.
+    Download the IDs of recently-served creatives and their impressions from DFP. The IDs are saved in the creative
+    table, and the impressions are saved in the creative_impression table for the day the creatives were served.
+
+    :param chunk_size: the number of records saved at once.
+    :return: a tuple of the numbers of the new ids and the ids already saved today.
     """
     report_job = adscan.dfp.create_report_service_job(self.days_ago, self.country)
-    creative_ids = adscan.dfp.run_report_service_job(report_job)
-    if creative_ids:
-      for creative_id in creative_ids:
-        creative = Creative(creative_id=creative_id, created_at=datetime.date.today())
-        self.db_session.merge(creative)
-      self.db_session.commit()
+    records = adscan.dfp.run_report_service_job(report_job)
+    return self._save_report_records(records, chunk_size)
+
+  def _save_report_records(self, records, chunk_size=5000):
+    """
+    Save today's rows of the creatives and their impressions in bulk, a chunk of records at a time. The records are
+    saved in a single transaction, so a report that fails halfway leaves the impressions saved before.
+
+    :param records: an iterable of tuples of a creative id and the number of impressions.
+    :param chunk_size: the number of records saved at once.
+    :return: a tuple of the numbers of the new ids and the ids already saved today.
+    """
+    today = datetime.date.today()
+    served_at = today - datetime.timedelta(days=self.days_ago)
+    new_count, existing_count = 0, 0
+    try:
+      # The temporary table of the ids is created before the deletion, as SQLite commits the open transaction first.
+      adscan.db.load_ids(self.db_session, [])
+      # The report of the day replaces the impressions saved by an earlier run.
+      self.db_session.execute(CreativeImpression.__table__.delete().where(CreativeImpression.served_at == served_at))
+
+      records = iter(records)
+      while True:
+        chunk = list(itertools.islice(records, chunk_size))
+        if not chunk:
+          break
+        counts = adscan.db.insert_new_ids(
+          self.db_session, Creative.creative_id, [creative_id for creative_id, _ in chunk], {'created_at': today})
+        new_count += counts[0]
+        existing_count += counts[1]
+        self.db_session.execute(CreativeImpression.__table__.insert(), [{
+          'served_at': served_at,
+          'creative_id': creative_id,
+          'created_at': today,
+          'impressions': impressions
+        } for creative_id, impressions in chunk])
+    except:
+      self.db_session.rollback()
+      raise
+    self.db_session.commit()
+    print '%d new creative ids were saved. %d ids already existed.' % (new_count, existing_count)
+    return (new_count, existing_count)
+
+  def _run_creative_service_statements(self, statements):
+    """
+    Download the creatives with the DFP clients set in the config.
+
+    :param statements: a list of CreativeService statements.
+    :return: a list of DFP creatives.
+    """
+    return adscan.dfp.run_creative_service_statements(
+      statements, client_count=self.dfp_client_count, max_retries=self.dfp_max_retries)
+
+  def _download_modified_creatives(self, since):
+    """
+    Download the creatives in the network modified after a time with the DFP clients set in the config.
+
+    :param since: a string of the time, `YYYY-MM-DDTHH:MM:SS`.
+    :return: a list of DFP creatives.
+    """
+    return adscan.dfp.download_modified_creatives(
+      since, client_count=self.dfp_client_count, max_retries=self.dfp_max_retries)
 
   def download_creatives(self):
     """
@@ -189,16 +755,21 @@ class Scanner(object):
     them to become SSL compliant. The original creatives and modified ones are both stored in the
     database.
     """
-    # Load creatives from the database.
-    query = self.db_session.query(
+    # Load creatives from the database, and keep the ones with the highest priority if the number is limited.
+    creative_list = self.db_session.query(
       Creative
     ).filter(
       Creative.created_at == datetime.date.today()
-    )
+    ).all()
+    # The history is loaded once, and used again after the snippets are downloaded.
+    history = None
+    if creative_list:
+      history = self._load_priority_history([creative.creative_id for creative in creative_list])
+    self._update_priorities(creative_list, history)
+    creative_list.sort(key=lambda creative: (-creative.priority, creative.creative_id))
     if self.max_scan > 0:
-      query = query.limit(self.max_scan)
+      creative_list = creative_list[:self.max_scan]
 
-    creative_list = query.all()
     creative_dict = {}
     for creative in creative_list:
       creative_dict[str(creative.creative_id)] = creative
@@ -207,10 +778,34 @@ class Scanner(object):
     # The ids of creatives to be downloaded or fetched from cache.
     remaining_ids = [creative.creative_id for creative in creative_list]
 
-    # Download recently updated creatives.
+    # The lastModifiedDateTime of the creatives downloaded.
+    modified_times = {}
+    watermark = None
+
+    # Download the creatives modified since the last download. Only the changes in the network since the sync
+    # watermark are downloaded, and the caches of the changed creatives not served today are expired. The first
+    # download has no watermark and falls back to the creatives served today and modified in the last `days_ago` days.
+    # Its watermark is the start of that window, so the next download catches the creatives not served today as well.
     if len(remaining_ids) > 0:
-      stmts = adscan.dfp.create_creative_service_statement(remaining_ids, days_ago=self.days_ago)
-      dfp_creatives = adscan.dfp.run_creative_service_statements(stmts)
+      watermark = self._load_sync_watermark()
+      if watermark.synced_until:
+        changed = self._download_modified_creatives(
+          adscan.dfp.shift_time(watermark.synced_until, -self.sync_overlap * 60))
+        served_ids = set(remaining_ids)
+        dfp_creatives = [dfp for dfp in changed if int(dfp['id']) in served_ids]
+        expired = self._expire_caches([dfp for dfp in changed if int(dfp['id']) not in served_ids])
+        print '%d creatives were modified in DFP. %d caches of the creatives not served today were expired.' % (
+          len(changed), expired)
+      else:
+        first_since = (datetime.date.today() - datetime.timedelta(days=self.days_ago)).strftime('%Y-%m-%dT%H:%M:%S')
+        print 'Only recently updated creatives will be downloaded.'
+        stmts = adscan.dfp.create_creative_service_statement(remaining_ids, since=first_since)
+        changed = dfp_creatives = self._run_creative_service_statements(stmts)
+      modified_times.update((int(dfp['id']), adscan.dfp.last_modified(dfp)) for dfp in changed)
+
+      # The creatives downloaded again within the overlap of the watermark are loaded from the cache.
+      dfp_creatives = self._skip_cached_dfp_creatives(dfp_creatives)
+      self._save_dfp_creatives(dfp_creatives)
       updated = [adscan.transform.from_dfp(dfp) for dfp in dfp_creatives]
       for creative in updated:
         if creative:
@@ -222,14 +817,8 @@ class Scanner(object):
 
     # Load from cache.
     if len(remaining_ids) > 0:
-      ids = ','.join([str(i) for i in remaining_ids])
-      caches = self.db_session.query(
-        Creative
-      ).from_statement(
-        text('select c.* from %s c join '
-        '(select creative_id, max(created_at) as created_at from %s where creative_id in (%s) and snippet is not null group by creative_id) t '
-        'on c.creative_id = t.creative_id and c.created_at = t.created_at' % (Creative.__tablename__, Creative.__tablename__, ids))
-      ).all()
+      caches = self._load_caches(remaining_ids)
+      load_blobs(self.db_session, caches)
 
       for cache in caches:
         creative = adscan.transform.renew(cache)
@@ -242,14 +831,35 @@ class Scanner(object):
 
     # Download creatives that did not in the cache.
     if len(remaining_ids) > 0:
+      print 'At most, %d creatives will be downloaded.' % len(remaining_ids)
       stmts = adscan.dfp.create_creative_service_statement(remaining_ids, days_ago=self.days_ago, only_new=False)
-      dfp_creatives = adscan.dfp.run_creative_service_statements(stmts)
+      dfp_creatives = self._run_creative_service_statements(stmts)
+      self._save_dfp_creatives(dfp_creatives)
+      modified_times.update((int(dfp['id']), adscan.dfp.last_modified(dfp)) for dfp in dfp_creatives)
       refetched = [adscan.transform.from_dfp(dfp) for dfp in dfp_creatives]
       for creative in refetched:
         if creative:
           creative_dict[str(creative.creative_id)].merge(creative)
       print '%d creative were downloaded.' % len(refetched)
 
+    self._update_caches([creative for creative in creative_list if creative.snippet], modified_times)
+
+    for creative in creative_list:
+      creative.snippet_hash = adscan.transform.snippet_hash(
+        '%s%s' % (creative.snippet or '', creative.expanded_snippet or ''))
+
+    # The snippets are known now, so the creatives whose snippet changed get a higher priority.
+    self._update_priorities(creative_list, history)
+
+    # The watermark advances in the same transaction as the creatives, so a failed download is synced again. Only the
+    # creatives modified since the watermark move it, as the refetched ones may be newer than the changes not fetched.
+    if watermark is not None:
+      if watermark.synced_until:
+        synced_times = [t for t in (adscan.dfp.last_modified(dfp) for dfp in changed) if t]
+        if synced_times:
+          watermark.synced_until = max(synced_times + [watermark.synced_until])
+      else:
+        watermark.synced_until = first_since
     self.db_session.commit()
 
   def browse_creatives(self, protocol):
@@ -265,12 +875,16 @@ class Scanner(object):
       raise Exception('No private key found.')
 
     # Delete the existing scanlog.
-    self.db_session.query(
-      ScanLog
-    ).filter(
-      ScanLog.created_at == datetime.date.today(),
-      ScanLog.protocol == protocol
-    ).delete()
+    for table in [ScanLog, ScanLogHost]:
+      self.db_session.query(
+        table
+      ).filter(
+        table.created_at == datetime.date.today(),
+        table.protocol == protocol
+      ).delete()
+    self.compliance.reset(protocol)
+    # Commit the deletion before the scan log writer writes through its own connection, or SQLite stays locked.
+    self.db_session.commit()
 
     query = self.db_session.query(
       Creative
@@ -278,121 +892,223 @@ class Scanner(object):
       Creative.created_at == datetime.date.today()
     )
 
+    if self.incremental and protocol == 'http':
+      # Browse the same creatives as the ones browsed over https.
+      query = query.filter(Creative.scanned_at == datetime.date.today())
+
+    if protocol == 'http':
+      # The creatives deferred by the deadline were not browsed over https.
+      query = query.filter(or_(Creative.deferred == None, Creative.deferred == False))
+
+    if self.http_modified_only and protocol == 'http':
+      # The requests over http are only compared with the ones over https for the modified creatives.
+      query = query.filter(Creative.modified == True)
+
+    # The issues found over http are not used. Only the requests are counted if `http_count_only` is set.
+    verify = protocol == 'https' or not self.http_count_only
+
+    # Scan the creatives with the highest priority first.
+    query = query.order_by(Creative.priority.desc(), Creative.creative_id)
+
     if self.max_scan > 0:
       query = query.limit(self.max_scan)
 
     creatives = query.all()
+    load_blobs(self.db_session, creatives)
+
+    if protocol == 'https':
+      if self.incremental:
+        creatives = self._select_incremental_creatives(creatives)
+      self._update_creatives(
+        [creative.creative_id for creative in creatives], {'scanned_at': datetime.date.today(), 'deferred': False})
+      # Flush the scan results carried forward and detach the creatives, so that the commit does not expire them and
+      # they are not loaded again one by one while being scanned.
+      self.db_session.flush()
+      self.db_session.expunge_all()
+      self.db_session.commit()
+
+    # Scan only one creative for each group of creatives that have the same snippet, and copy its scan log to the
+    # others in the group.
+    creatives = self._group_duplicate_creatives(creatives, protocol)
+    print '%d creatives will be scanned after removing duplicates.' % len(creatives)
+
+    for creative in creatives:
+      adscan.transform.create_scan_snippet(creative)
+
+    # Keep a share of the time for the http pass over the creatives scanned now.
+    deadline = self.deadline
+    if deadline and protocol == 'https':
+      deadline = deadline.reserve_share(self.deadline_http_share)
+
+    # Scan the creatives that are only a URL or static HTML tags without browsers.
+    analyzers = AnalyzerController(
+      protocol, self.analyzer_count, self.scanlog, verify=verify, debug=self.debug, timeout=self.analyzer_timeout,
+      deadline=deadline)
+    creatives = analyzers.assign(creatives)
+    print '%d creatives will be analyzed without browsers.' % len(analyzers.creative_urls)
+    print '%d of them are static HTML tags.' % analyzers.static_count
+
     servers, xvfbs, browsers = None, None, None
 
+    deferred = []
+
+    if self.scanlog_mode == 'host':
+      self.scanlog_writer = ScanLogWriter(
+        self.db_session.get_bind(), ScanLogHost.__table__, batch_size=self.scanlog_batch_size,
+        flush_interval=self.scanlog_flush_interval, max_queue_size=self.scanlog_queue_size, aggregate=True)
+    else:
+      self.scanlog_writer = ScanLogWriter(
+        self.db_session.get_bind(), ScanLog.__table__, batch_size=self.scanlog_batch_size,
+        flush_interval=self.scanlog_flush_interval, max_queue_size=self.scanlog_queue_size, urls=self.urls)
+    self.scanlog_writer.start()
+
     try:
-      # Open ports and bind them to servers.
-      ports = adscan.net.find_open_ports(self.server_count)
-      servers = ServerController(protocol, ports, self.certificate_file, self.privatekey_file)
-      servers.start()
-
-      # Start virtual X windows.
-      xvfbs = XvfbController(self.browser_count, self.display_dimension, xserver_offset=self.xserver_offset)
-      xvfbs.start()
-
-      # Start browsers
-      browsers = BrowserController(
-        creatives, protocol, ports, self.browser_count, self.phantomjs, self.browserjs, self.cookie_dir,
-        self.workspace.dirname, self.scanlog, adscan.transform.create_scan_snippet, debug=self.debug,
-        xserver_offset=self.xserver_offset)
-      browsers.start()
-      browsers.wait()
+      analyzers.start()
+
+      if creatives:
+        # Open ports and bind them to servers.
+        ports = adscan.net.find_open_ports(self.server_count)
+        servers = ServerController(protocol, ports, self.certificate_file, self.privatekey_file)
+        servers.start()
+
+        # Start virtual X windows.
+        xvfbs = XvfbController(self.browser_count, self.display_dimension, xserver_offset=self.xserver_offset)
+        xvfbs.start()
+
+        # Start browsers
+        browsers = BrowserController(
+          creatives, protocol, ports, self.browser_count, self.phantomjs, self.browserjs, self.cookie_dir,
+          self.workspace.dirname, self.scanlog, None, debug=self.debug, xserver_offset=self.xserver_offset,
+          verify=verify, deadline=deadline)
+        browsers.start()
+        browsers.wait()
+        deferred.extend(browsers.deferred_creatives())
+      analyzers.wait()
+      deferred.extend(analyzers.deferred_creatives())
     except KeyboardInterrupt:
       raise
     finally:
+      analyzers.shutdown()
       if browsers:
         browsers.shutdown()
       if servers:
         servers.shutdown()
       if xvfbs:
         xvfbs.shutdown()
+      writer, self.scanlog_writer = self.scanlog_writer, None
+      writer.close()
+      print 'Scan logs: %(records)d records in %(flushes)d flushes (max %(max_flush_time).3f sec, ' \
+            'average %(average_flush_time).3f sec per flush).' % writer.stats()
 
     self.db_session.commit()
 
+    if deferred:
+      self._defer_creatives(deferred, protocol)
+
     if self.save_netlog:
       dest_dir = '%s/%s/netlog' % (self.log_dir, protocol)
       self.workspace.move_netlog(dest_dir)
 
-  def check_compliance(self):
-    """
-    Analyzes the network logs to detect SSL non-compliant creatives, and save the SSL compliance
-    into the databse.
+  def _defer_creatives(self, creatives, protocol):
     """
-    def request_count(protocol):
-      """
-      Return the numver of requests for each creatives.
+    Record the creatives that were not scanned before the deadline, and the creatives that have the same snippet. The
+    creatives deferred over https are not scanned today, and are scanned first in the next run because they have no
+    last scan. The creatives deferred over http keep today's scan over https, but have no request match, so they are
+    scanned again in the next run.
 
-      :param protocol: 'https' or 'http'.
-      :return: a tuple of creative id and the number of requests.
-      """
-      return self.db_session.query(
-        ScanLog.creative_id.label('creative_id'),
-        func.count(ScanLog.url).label('url_count')
-      ).filter(
-        ScanLog.created_at == datetime.date.today(),
-        ScanLog.protocol == protocol
-      ).group_by(
-        ScanLog.creative_id
-      ).subquery(protocol)
-
-    def request_match_ids():
-      """
-      Return the ids of creatives that made difference numbers of requests over https and http.
-      """
-      https = request_count('https')
-      http = request_count('http')
-
-      return [t[0] for t in self.db_session.query(
-        https.c.creative_id
-      ).filter(
-        https.c.creative_id == http.c.creative_id,
-        https.c.url_count == http.c.url_count
-      ).all()]
-
-    creative_ids = [t[0] for t in self.db_session.query(
-      ScanLog.creative_id
-    ).filter(
-      ScanLog.created_at == datetime.date.today()
-    ).distinct().all()]
-    print '# of creatives: %d' % len(creative_ids)
+    :param creatives: a list of creatives left by the browsers and analyzers.
+    :param protocol: `https` or `http`.
+    """
+    creative_ids = []
+    for creative in creatives:
+      creative_ids.append(creative.creative_id)
+      creative_ids.extend(self.duplicate_ids.get(str(creative.creative_id), []))
+    if protocol == 'https':
+      self._update_creatives(creative_ids, {'deferred': True, 'scanned_at': None})
+    else:
+      self._update_creatives(creative_ids, {'deferred': True})
+    self.db_session.commit()
+    print '%d creatives were deferred to the next run over %s.' % (len(creative_ids), protocol)
 
-    noncompliant_ids = [t[0] for t in self.db_session.query(
-      ScanLog.creative_id
-    ).filter(
-      ScanLog.created_at == datetime.date.today(),
-      ScanLog.issue_id != IssueType.NO_ISSUE,
-      ScanLog.issue_id != IssueType.NO_EXTERNAL,
-      ScanLog.issue_id is not None,
-      ScanLog.protocol == 'https'
-    ).distinct().all()]
-
-    compliant_ids = list(set(creative_ids) - set(noncompliant_ids))
+  def check_compliance(self):
+    """
+    Save the SSL compliance and request match status of the scanned creatives into the databse. The status is
+    aggregated while browsing creatives. The status of the protocols that were not browsed by this scanner is
+    aggregated from the scan logs in the database.
+    """
+    for protocol in ['https', 'http']:
+      if protocol not in self.compliance.protocols:
+        if self.scanlog_mode == 'host':
+          table, url_count = ScanLogHost, func.sum(ScanLogHost.count)
+        else:
+          table, url_count = ScanLog, func.count(func.coalesce(ScanLog.url_id, ScanLog._url))
+        rows = self.db_session.query(
+          table.creative_id,
+          url_count,
+          func.sum(case([(table.issue_id.notin_(COMPLIANT_ISSUES), 1)], else_=0))
+        ).filter(
+          table.created_at == datetime.date.today(),
+          table.protocol == protocol
+        ).group_by(
+          table.creative_id
+        ).all()
+        self.compliance.load(protocol, rows)
+
+    compliant_ids, noncompliant_ids, match_ids, unmatch_ids = self.compliance.results()
+    print '# of creatives: %d' % (len(compliant_ids) + len(noncompliant_ids))
     print '# of compliant: %d' % len(compliant_ids)
     print '# of non-compliant: %d' % len(noncompliant_ids)
-
-    match_ids = request_match_ids()
-    unmatch_ids = list(set(creative_ids) - set(match_ids))
     print '# of request match: %d' % len(match_ids)
     print '# of request unmatch: %d' % len(unmatch_ids)
 
     # Update the compliance status.
     if len(compliant_ids) > 0:
-      self._update_creatives(compliant_ids, 'compliance=1')
+      self._update_creatives(compliant_ids, {'compliance': True})
     if len(noncompliant_ids) > 0:
-      self._update_creatives(noncompliant_ids, 'compliance=0')
+      self._update_creatives(noncompliant_ids, {'compliance': False})
 
-    # Update the request match status.
+    # Update the request match status. It is only set to the creatives browsed over http.
     if len(match_ids) > 0:
-      self._update_creatives(match_ids, 'request_match=1')
+      self._update_creatives(match_ids, {'request_match': True})
     if len(unmatch_ids) > 0:
-      self._update_creatives(unmatch_ids, 'request_match=0')
+      self._update_creatives(unmatch_ids, {'request_match': False})
+
+    if self.incremental:
+      self._update_host_verdicts()
 
     self.db_session.commit()
 
+  def _load_upload_dfp_creatives(self, creative_ids):
+    """
+    Return the DFP objects of the creatives to be uploaded. The objects stored in the download step are used, and only
+    the creatives modified in DFP after they were stored, or not stored, are downloaded again.
+
+    :param creative_ids: a list of creative ids.
+    :return: a list of DFP creatives and their dictionaries.
+    """
+    stored = dict((s.creative_id, s) for s in self._load_dfp_creatives(creative_ids) if s.last_modified)
+    dfp_dict = {}
+
+    # Download the stored creatives modified since the oldest of them was stored.
+    if stored:
+      since = min(s.last_modified for s in stored.values())
+      stmts = adscan.dfp.create_creative_service_statement(stored.keys(), since=since)
+      for dfp in self._run_creative_service_statements(stmts):
+        if adscan.dfp.last_modified(dfp) != stored[int(dfp['id'])].last_modified:
+          dfp_dict[int(dfp['id'])] = dfp
+      modified_count = len(dfp_dict)
+      for creative_id, s in stored.iteritems():
+        if creative_id not in dfp_dict:
+          dfp_dict[creative_id] = s.get_object()
+      print '%d stored creatives were used. %d were modified in DFP.' % (len(stored) - modified_count, modified_count)
+
+    remaining_ids = [creative_id for creative_id in creative_ids if creative_id not in dfp_dict]
+    if remaining_ids:
+      stmts = adscan.dfp.create_creative_service_statement(remaining_ids, only_new=False)
+      for dfp in self._run_creative_service_statements(stmts):
+        dfp_dict[int(dfp['id'])] = dfp
+    return dfp_dict.values()
+
   def upload_creatives(self):
     """
     Upload the creatives to DFP if they become SSL compliant after the modification.
@@ -406,6 +1122,7 @@ class Scanner(object):
       Creative.request_match,
       Creative.modified_snippet is not None
     ).all()
+    load_blobs(self.db_session, creatives)
 
     creative_ids = [creative.creative_id for creative in creatives]
 
@@ -415,14 +1132,17 @@ class Scanner(object):
       for creative in creatives:
         creative_dict[str(creative.creative_id)] = creative
 
-      stmts = adscan.dfp.create_creative_service_statement(creative_ids, only_new=False)
-      dfp_creatives = adscan.dfp.run_creative_service_statements(stmts)
+      dfp_creatives = self._load_upload_dfp_creatives(creative_ids)
       modified_dfp = [adscan.transform.to_dfp(creative_dict[str(dfp['id'])], dfp) for dfp in dfp_creatives]
-
-      # Upload the modified creatives.
-      updated = adscan.dfp.upload_creatives(modified_dfp)
-      print '%d creatives were modified.' % len(updated)
-      self._update_creatives(creative_ids, 'uploaded=1')
+      modified_dfp = [dfp for dfp in modified_dfp if dfp is not None]
+
+      # Upload the modified creatives. Only the creatives confirmed by DFP are marked as uploaded.
+      updated = adscan.dfp.upload_creatives(
+        modified_dfp, batch_size=self.dfp_upload_batch_size, client_count=self.dfp_client_count,
+        max_retries=self.dfp_max_retries)
+      print '%d creatives were modified. %d were not.' % (len(updated), len(modified_dfp) - len(updated))
+      self._update_creatives([int(dfp['id']) for dfp in updated], {'uploaded': True})
+      self.db_session.commit()
 
   def compress_log_file(self):
     """
@@ -439,6 +1159,85 @@ class Scanner(object):
 
     os.chdir(cwd)
 
+  def _iter_archived_creatives(self, date, columns, batch_size):
+    """
+    Read the creatives of a date with their snippets, a batch at a time, so that the creatives of a date are not loaded
+    at once.
+
+    :param date: the date when the creatives were created.
+    :param columns: a list of the column names.
+    :param batch_size: the number of creatives read at once.
+    :return: a generator of tuples of the values in the order of `columns`.
+    """
+    last_id = None
+    while True:
+      query = self.db_session.query(Creative).filter(Creative.created_at == date)
+      if last_id is not None:
+        query = query.filter(Creative.creative_id > last_id)
+      creatives = query.order_by(Creative.creative_id).limit(batch_size).all()
+      if not creatives:
+        return
+      load_blobs(self.db_session, creatives)
+      for creative in creatives:
+        yield tuple(getattr(creative, column) for column in columns)
+      last_id = creatives[-1].creative_id
+      self.db_session.expunge_all()
+
+  def archive_old_rows(self, batch_size=1000):
+    """
+    Move the rows of the creative, scan log and impression tables created before the retention period into archive
+    files, which can be read with :func:`adscan.archive.read_archive`. The URLs and snippets are saved in the files
+    instead of their ids, so the files do not depend on the database. The URLs and snippets no longer referred to are
+    deleted, and the space is reclaimed.
+
+    :param batch_size: the number of rows read from the database at once.
+    """
+    cutoff = datetime.date.today() - datetime.timedelta(days=self.retention_days)
+
+    # Creatives. The snippets are saved instead of their hashes.
+    columns = [
+      c.name for c in Creative.__table__.columns if c.name not in Creative.blob_fields and not c.name.endswith('_ref')]
+    columns += Creative.blob_fields
+    for (date,) in self.db_session.query(Creative.created_at).filter(Creative.created_at < cutoff).distinct().all():
+      count = self.db_session.query(Creative).filter(Creative.created_at == date).count()
+      rows = self._iter_archived_creatives(date, columns, batch_size)
+      adscan.archive.write_archive(self.archive_dir, Creative.__tablename__, date, columns, rows)
+      self.db_session.execute(Creative.__table__.delete().where(Creative.created_at == date))
+      self.db_session.commit()
+      print '%d creatives of %s were archived.' % (count, date)
+
+    # Scan logs. The URLs are saved instead of their ids.
+    sources = [(ScanLog, ScanLogDetail), (ScanLogHost, ScanLogHost), (CreativeImpression, CreativeImpression)]
+    for table, source in sources:
+      columns = [c.name for c in source.__table__.columns]
+      for (date,) in self.db_session.query(table.created_at).filter(table.created_at < cutoff).distinct().all():
+        count = self.db_session.query(table).filter(table.created_at == date).count()
+        rows = self.db_session.query(
+          *[getattr(source, column) for column in columns]
+        ).filter(
+          source.created_at == date
+        ).yield_per(batch_size)
+        adscan.archive.write_archive(self.archive_dir, table.__tablename__, date, columns, rows)
+        self.db_session.execute(table.__table__.delete().where(table.created_at == date))
+        self.db_session.commit()
+        print '%d rows of %s of %s were archived.' % (count, table.__tablename__, date)
+
+    # Delete the snippets and URLs no longer referred to.
+    refs = [
+      select([getattr(table, '%s_ref' % name)]).where(getattr(table, '%s_ref' % name) != None)
+      for table in [Creative, CreativeCache] for name in table.blob_fields
+    ]
+    self.db_session.execute(Blob.__table__.delete().where(~Blob.hash.in_(union(*refs))))
+    self.db_session.execute(
+      Url.__table__.delete().where(~Url.id.in_(select([ScanLog.url_id]).where(ScanLog.url_id != None))))
+    self.db_session.commit()
+    # The ids of the deleted URLs must not be written by the scan log writers started later.
+    self.urls.clear()
+
+    engine = self.db_session.get_bind()
+    if engine.dialect.name == 'sqlite':
+      engine.execute('VACUUM')
+
   def remove_temp_files(self):
     """
     Delete the all files under the temporary directory.
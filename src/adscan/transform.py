@@ -15,28 +15,38 @@ Utility functions that transform a creative from/to another object.
 """
 
 import re
+import hashlib
 import lxml
 import lxml.etree
 import lxml.html
-import lxml.cssselect
-import requests
-
-import googleads.dfp
 
 from adscan.model import Creative
 
 
+def dfp_type(dfp_creative, debug=False):
+  """
+  Return the DFP type of a creative object.
+
+  :param dfp_creative: a creative object downloaded from DFP, or its dictionary stored in the database.
+  :return: the name of the type, e.g. 'ImageCreative'.
+  """
+  if debug or isinstance(dfp_creative, dict):
+    return dfp_creative['xsi_type']
+  import googleads.dfp
+  return googleads.dfp.DfpClassType(dfp_creative)
+
+
 def to_dfp(creative, dfp_creative, debug=False):
   """
   Convert an instance of :class:`~model.Creative` into an object used in DFP.
 
   :param creative: an instance of :class:`~model.Creative`.
-  :param dfp_creative: a creative object downloaded from DFP.
+  :param dfp_creative: a creative object downloaded from DFP, or its dictionary stored in the database.
   :return: the modified DFP creative. If not supported, None will be returned.
   """
   m_snippet = creative.modified_snippet
   dfp = dfp_creative
-  ctype = dfp['xsi_type'] if debug else googleads.dfp.DfpClassType(dfp_creative)
+  ctype = dfp_type(dfp_creative, debug)
 
   if ctype == 'ThirdPartyCreative':
     dfp['snippet'] = m_snippet
@@ -87,7 +97,7 @@ def from_dfp(dfp_creative, debug=False):
 
   dfp = dfp_creative
   creative_id = dfp['id']
-  creative_type = dfp['xsi_type'] if debug else googleads.dfp.DfpClassType(dfp_creative)
+  creative_type = dfp_type(dfp_creative, debug)
   preview_url = dfp['previewUrl']
   modified = False
   snippet = None
@@ -416,14 +426,72 @@ def exist_in_string_creative_template_variables(host, variables):
   return False
 
 
-def create_scan_snippet(creative):
+def find_static_urls(snippet, protocol, allow_http=False):
   """
-  Create a snippet used to be browsed.
+  Find the urls that the snippet makes requests to if the snippet is provably static. A snippet is static when it
+  contains no scripts, no frames, no plugin objects, no style sheets and no event handlers, and all the urls of its
+  external resources are https, protocol-relative or relative urls. Browsing such snippets only makes requests to the
+  urls in the `src` and `background` attributes.
+
+  :param snippet: a string that represents a snippet, or an ad html tag.
+  :param protocol: the protocol of the page hosting the snippet, `https` or `http`.
+  :param allow_http: a boolean value that indicates whether http urls are allowed as well, e.g. in the original
+    snippet of a creative whose modified snippet is static.
+  :return: a list of absolute urls, or None if the snippet may make requests that cannot be found statically. The
+    relative urls are not included because they are requested to the hosting server.
+  """
+  dynamic_tags = [
+    'script', 'noscript', 'iframe', 'frame', 'frameset', 'object', 'embed', 'applet', 'param', 'style', 'link', 'base',
+    'meta', 'svg', 'math', 'video', 'audio', 'source', 'track', 'picture'
+  ]
+  url_attrs = ['src', 'background']
+
+  regex_https = re.compile(r'^https?\:' if allow_http else r'^https\:', re.IGNORECASE)
+  regex_scheme = re.compile(r'^[a-z][a-z0-9\+\-\.]*\:', re.IGNORECASE)
+  regex_css_url = re.compile(r'url\s*\(|expression\s*\(|@import', re.IGNORECASE)
+
+  if not snippet or re.match(r'^http', snippet, re.IGNORECASE):
+    return None
+
+  try:
+    doc = lxml.html.fromstring(snippet)
+  except (lxml.etree.XMLSyntaxError, lxml.etree.ParserError):
+    return None
+
+  urls = []
+  for node in doc.iter():
+    if not isinstance(node.tag, basestring):
+      # Comments and processing instructions.
+      continue
+    if node.tag.lower() in dynamic_tags:
+      return None
+    for attr, value in node.attrib.iteritems():
+      attr = attr.lower()
+      value = value.strip()
+      if attr.startswith('on') or attr in ['srcset', 'formaction'] or re.match(r'^javascript\:', value, re.IGNORECASE):
+        return None
+      if attr == 'style' and regex_css_url.search(value):
+        return None
+      if attr in url_attrs and value:
+        if regex_https.match(value):
+          urls.append(value)
+        elif value.startswith('//'):
+          urls.append('%s:%s' % (protocol, value))
+        elif regex_scheme.match(value):
+          return None
+  return urls
+
+
+def select_scan_snippets(creative):
+  """
+  Select the snippets used to be browsed over http and https. The %h in the snippets are not replaced yet.
+
+  :param creative: an instance of :class:`~model.Creative`.
+  :return: a pair of the snippet browsed over http and the one browsed over https.
   """
   snippet = creative.snippet
   e_snippet = creative.expanded_snippet
   s_snippet = e_snippet if e_snippet else snippet
-  s_snippet = replace_percent_h(s_snippet, preview_url=creative.preview_url)
 
   ms_snippet = None
   if creative.modified_expanded_snippet:
@@ -434,10 +502,54 @@ def create_scan_snippet(creative):
     ms_snippet = creative.modified_snippet
   else:
     ms_snippet = snippet
-  ms_snippet = replace_percent_h(ms_snippet, preview_url=creative.preview_url)
+  return (s_snippet, ms_snippet)
 
-  creative.scan_snippet = s_snippet
-  creative.modified_scan_snippet = ms_snippet
+
+def create_scan_snippet(creative):
+  """
+  Create a snippet used to be browsed.
+  """
+  s_snippet, ms_snippet = select_scan_snippets(creative)
+  creative.scan_snippet = replace_percent_h(s_snippet, preview_url=creative.preview_url)
+  creative.modified_scan_snippet = replace_percent_h(ms_snippet, preview_url=creative.preview_url)
+
+
+def normalize_snippet(snippet):
+  """
+  Remove the DFP macros from the snippet. The snippets that only differ in click urls or cache busters make the same
+  requests when they are browsed. The %h is kept as it is, so the snippet should be normalized before %h is replaced
+  with the host names.
+
+  :param snippet: a string that represents a snippet, or an ad html tag.
+  :return: the normalized snippet.
+  """
+  # Regex for finding the macros like %%CACHEBUSTER%% and %%PATTERN:key%%.
+  regex_macro = re.compile(r'%%[A-Z_]+(?:\:[^%\s]*)?%%')
+
+  # Regex for finding the click url macros %c and %u, and the cache buster macro %n. Skip url-encoded characters like %c3
+  # and escaped unicode characters like %u00e9.
+  regex_short_macro = re.compile(r'%c(?![0-9a-fA-F])|%n|%u(?![0-9a-fA-F]{4})')
+
+  if not snippet:
+    return snippet
+  normalized = regex_macro.sub('', snippet)
+  normalized = regex_short_macro.sub('', normalized)
+  return normalized.strip()
+
+
+def snippet_hash(snippet):
+  """
+  Compute the hash of the normalized snippet.
+
+  :param snippet: a string that represents a snippet, or an ad html tag.
+  :return: a hex string of the hash, or None if the snippet is empty.
+  """
+  normalized = normalize_snippet(snippet)
+  if not normalized:
+    return None
+  if type(normalized) == unicode:
+    normalized = normalized.encode('utf-8')
+  return hashlib.sha1(normalized).hexdigest()
 
 
 def download_html(url):
@@ -447,6 +559,7 @@ def download_html(url):
   :param url: the url.
   :return: the downloaded html.
   """
+  import requests
   r = requests.get(url, verify=False)
   return r.text
 
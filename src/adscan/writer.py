@@ -0,0 +1,306 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+"""
+Class that writes scan logs into the database in the background.
+
+Browser threads report every requested url. Instead of adding an ORM object to the shared session for each url, the
+threads put compact records on a queue and a single writer thread inserts them in batches.
+
+The URLs are stored once in the url table and the scan logs refer to them by id. The scan logs can also be aggregated
+into the number of requests to each host, which is much smaller than a row for each request.
+"""
+
+import time
+import Queue
+import datetime
+import urlparse
+import threading
+
+from sqlalchemy import select
+
+
+class ScanLogRecord(object):
+  """
+  Class that represents a scan log to be written. The fields are the same as the columns of the scanlog table.
+  """
+  __slots__ = ('created_at', 'creative_id', 'issue_id', 'url', 'protocol')
+
+  def __init__(self, created_at, creative_id, issue_id, protocol, url=None):
+    """
+    Initialize the instance.
+
+    :param created_at: the date of the scan.
+    :param creative_id: a creative id.
+    :param issue_id: an issue id defined in :class:`adscan.issue.IssueType`.
+    :param protocol: an HTTP protocol, `https` or `http`.
+    :param url: a URL.
+    """
+    self.created_at = created_at
+    self.creative_id = creative_id
+    self.issue_id = issue_id
+    self.protocol = protocol
+    self.url = url
+
+  def as_dict(self):
+    """
+    Return the fields as a dictionary, which can be passed to an insert statement.
+    """
+    return {
+      'created_at': self.created_at,
+      'creative_id': self.creative_id,
+      'issue_id': self.issue_id,
+      'url': self.url,
+      'protocol': self.protocol
+    }
+
+
+class UrlDictionary(object):
+  """
+  Class that maps URLs to their ids in the url table. The URLs not in the table are added to it.
+  """
+
+  def __init__(self, table, chunk_size=500):
+    """
+    Initialize the instance.
+
+    :param table: the url table.
+    :param chunk_size: the maximum number of URLs in an 'IN' clause when looking up the ids.
+    """
+    self.table = table
+    self.chunk_size = chunk_size
+    self.ids = {}
+    self.lock = threading.Lock()
+
+  def _load(self, executor, urls):
+    """
+    Load the ids of the URLs that exist in the table.
+
+    :param executor: an engine, a connection or a session.
+    :param urls: a list of URLs.
+    """
+    for i in xrange(0, len(urls), self.chunk_size):
+      chunk = urls[i:(i + self.chunk_size)]
+      stmt = select([self.table.c.url, self.table.c.id]).where(self.table.c.url.in_(chunk))
+      self.ids.update(executor.execute(stmt).fetchall())
+
+  def intern(self, executor, urls):
+    """
+    Return the ids of the URLs, adding the new URLs to the table.
+
+    :param executor: an engine, a connection or a session.
+    :param urls: a list of URLs. None is ignored.
+    :return: a dictionary of URLs and their ids.
+    """
+    with self.lock:
+      missing = list(set(url for url in urls if url is not None and url not in self.ids))
+      if missing:
+        self._load(executor, missing)
+        new = [url for url in missing if url not in self.ids]
+        if new:
+          today = datetime.date.today()
+          executor.execute(self.table.insert(), [{'url': url, 'created_at': today} for url in new])
+          self._load(executor, new)
+      return dict((url, self.ids[url]) for url in urls if url is not None)
+
+  def clear(self):
+    """
+    Forget the ids loaded so far, e.g. after URLs were deleted from the table.
+    """
+    with self.lock:
+      self.ids = {}
+
+
+class ScanLogWriter(threading.Thread):
+  """
+  Class that drains the queue of scan log records and inserts them in batches. A batch is flushed when it has
+  `batch_size` records or `flush_interval` seconds passed since the last flush. The queue is bounded, so the threads
+  putting records wait while the writer is behind.
+  """
+
+  # The item put on the queue to stop the writer.
+  _STOP = object()
+
+  # The number of seconds a thread waits for a room in the queue before it checks the writer again.
+  _PUT_TIMEOUT = 1.0
+
+  def __init__(self, engine, table, batch_size=5000, flush_interval=1.0, max_queue_size=100000, urls=None,
+               aggregate=False, host_flush_interval=60.0):
+    """
+    Initialize the instance.
+
+    :param engine: the engine of the database.
+    :param table: the table into which the records are inserted.
+    :param batch_size: the maximum number of records inserted at once.
+    :param flush_interval: the maximum number of seconds the records wait in the queue.
+    :param max_queue_size: the maximum number of records waiting in the queue.
+    :param urls: an instance of :class:`UrlDictionary`. If set, the URLs are written as `url_id`.
+    :param aggregate: a boolean value that indicates whether the records are aggregated by hosts. If True, `table` should
+      be the scanlog_host table, and the aggregated records are inserted when they have `batch_size` keys,
+      `host_flush_interval` seconds passed since they were inserted last, or the writer is closed. The counts of a key
+      may be split into multiple rows, which are added up by the queries.
+    :param host_flush_interval: the maximum number of seconds the aggregated records wait.
+    """
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.engine = engine
+    self.table = table
+    self.batch_size = batch_size
+    self.flush_interval = flush_interval
+    self.urls = urls
+    self.aggregate = aggregate
+    self.host_flush_interval = host_flush_interval
+    self.host_counts = {}
+    self.last_host_write = time.time()
+    self.queue = Queue.Queue(maxsize=max_queue_size)
+    self.error = None
+
+    # Counters
+    self.record_count = 0
+    self.flush_count = 0
+    self.last_flush_time = 0.0
+    self.max_flush_time = 0.0
+    self.total_flush_time = 0.0
+
+  def put(self, record):
+    """
+    Put a record on the queue, waiting while the queue is full. This method can be called from any thread. The error
+    that stopped the writer is raised here, so the records are not lost silently.
+
+    :param record: an instance of :class:`ScanLogRecord`.
+    """
+    while True:
+      if self.error:
+        raise self.error
+      try:
+        self.queue.put(record, timeout=self._PUT_TIMEOUT)
+        return
+      except Queue.Full:
+        pass
+
+  def queue_depth(self):
+    """
+    Return the approximate number of records waiting in the queue.
+    """
+    return self.queue.qsize()
+
+  def stats(self):
+    """
+    Return the counters of the writer.
+
+    :return: a dictionary of the counters.
+    """
+    return {
+      'queue_depth': self.queue_depth(),
+      'records': self.record_count,
+      'flushes': self.flush_count,
+      'last_flush_time': self.last_flush_time,
+      'max_flush_time': self.max_flush_time,
+      'average_flush_time': self.total_flush_time / self.flush_count if self.flush_count else 0.0
+    }
+
+  def _flush(self, batch):
+    """
+    Insert the records with a single bulk insert.
+
+    :param batch: a list of records.
+    """
+    if not batch:
+      return
+    start = time.time()
+    if self.aggregate:
+      for record in batch:
+        host = urlparse.urlparse(record.url).hostname if record.url else None
+        key = (record.created_at, record.creative_id, host, record.issue_id, record.protocol)
+        self.host_counts[key] = self.host_counts.get(key, 0) + (1 if record.url else 0)
+      if len(self.host_counts) >= self.batch_size or time.time() - self.last_host_write >= self.host_flush_interval:
+        self._write_host_counts()
+    else:
+      rows = [record.as_dict() for record in batch]
+      if self.urls:
+        ids = self.urls.intern(self.engine, [row['url'] for row in rows])
+        for row in rows:
+          row['url_id'] = ids.get(row.pop('url'))
+      self.engine.execute(self.table.insert(), rows)
+    elapsed = time.time() - start
+
+    self.record_count += len(batch)
+    self.flush_count += 1
+    self.last_flush_time = elapsed
+    self.max_flush_time = max(self.max_flush_time, elapsed)
+    self.total_flush_time += elapsed
+
+  def run(self):
+    """
+    Write the records until the writer is closed.
+    """
+    batch = []
+    deadline = time.time() + self.flush_interval
+    stopped = False
+    while not stopped:
+      try:
+        item = self.queue.get(timeout=max(deadline - time.time(), 0.01))
+        if item is self._STOP:
+          stopped = True
+        else:
+          batch.append(item)
+      except Queue.Empty:
+        pass
+
+      if stopped or len(batch) >= self.batch_size or time.time() >= deadline:
+        try:
+          self._flush(batch)
+        except Exception, e:
+          # Keep the error to raise it in the thread that closes the writer.
+          self.error = e
+          break
+        batch = []
+        deadline = time.time() + self.flush_interval
+
+    if self.aggregate and self.host_counts and not self.error:
+      try:
+        self._write_host_counts()
+      except Exception, e:
+        self.error = e
+
+  def _write_host_counts(self):
+    """
+    Insert the numbers of requests aggregated by hosts.
+    """
+    rows = []
+    for (created_at, creative_id, host, issue_id, protocol), count in self.host_counts.iteritems():
+      rows.append({
+        'created_at': created_at,
+        'creative_id': creative_id,
+        'host': host,
+        'issue_id': issue_id,
+        'protocol': protocol,
+        'count': count
+      })
+    for i in xrange(0, len(rows), self.batch_size):
+      self.engine.execute(self.table.insert(), rows[i:(i + self.batch_size)])
+    self.host_counts = {}
+    self.last_host_write = time.time()
+
+  def close(self):
+    """
+    Write the remaining records and stop the writer. The error raised while writing the records is raised again here.
+    """
+    while self.isAlive():
+      try:
+        self.queue.put(self._STOP, timeout=self._PUT_TIMEOUT)
+        break
+      except Queue.Full:
+        pass
+    self.join()
+    if self.error:
+      raise self.error
@@ -0,0 +1,312 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+import re
+import time
+import datetime
+import threading
+import unittest
+import BaseHTTPServer
+
+import adscan.net
+import adscan.analyzer
+from adscan.analyzer import AnalyzerHost, AnalyzerController
+from adscan.browser import BrowserHost
+from adscan.deadline import Deadline
+from adscan.model import Creative
+
+
+VAST_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<VAST version="2.0">
+  <Ad id="1">
+    <Wrapper>
+      <AdSystem>Example</AdSystem>
+      <VASTAdTagURI><![CDATA[ https://example.com/wrapped.xml ]]></VASTAdTagURI>
+      <Impression><![CDATA[http://example.com/impression]]></Impression>
+      <Creatives>
+        <Creative>
+          <Linear>
+            <TrackingEvents>
+              <Tracking event="start"><![CDATA[https://example.com/start]]></Tracking>
+            </TrackingEvents>
+            <MediaFiles>
+              <MediaFile type="video/mp4"><![CDATA[https://example.com/video.mp4]]></MediaFile>
+            </MediaFiles>
+            <VideoClicks>
+              <ClickThrough><![CDATA[http://example.com/landing]]></ClickThrough>
+            </VideoClicks>
+          </Linear>
+        </Creative>
+      </Creatives>
+    </Wrapper>
+  </Ad>
+</VAST>
+"""
+
+
+class RedirectHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """
+  Request handler that redirects /redirect to /image.png, and records the requested paths.
+  """
+
+  paths = []
+
+  def do_GET(self):
+    RedirectHandler.paths.append(self.path)
+    if self.path == '/redirect':
+      self.send_response(302)
+      self.send_header('Location', '/image.png')
+    else:
+      self.send_response(200)
+      self.send_header('Content-Type', 'image/png')
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+  def log_message(self, format, *args):
+    pass
+
+
+class FakeResponse(object):
+  """
+  Response that has a status code and headers.
+  """
+
+  def __init__(self, status_code, location=None):
+    self.status_code = status_code
+    self.headers = {'location': location} if location else {}
+    self.content = ''
+
+
+class FakeSession(object):
+  """
+  Session of requests library that answers with the status codes of the paths, whatever the protocol is.
+  """
+
+  responses = {
+    '/forbidden': (403, None),
+    '/missing': (404, None),
+    '/error': (500, None),
+    '/image.png': (200, None),
+    '/redirect': (302, '/forbidden'),
+    '/redirect-ok': (301, '/image.png')
+  }
+
+  def get(self, url, verify=True, allow_redirects=True, timeout=None):
+    while True:
+      status_code, location = self.responses[re.sub(r'^https?\:\/\/[^\/]+', '', url)]
+      if not allow_redirects or not location:
+        return FakeResponse(status_code, location)
+      url = 'https://example.com' + location
+
+
+class AnalyzerTestCase(unittest.TestCase):
+  """
+  Test the analyzer module.
+  """
+
+  def setUp(self):
+    """
+    Start a local server.
+    """
+    RedirectHandler.paths = []
+    self.httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RedirectHandler)
+    self.origin = 'http://127.0.0.1:%d' % self.httpd.server_port
+    thread = threading.Thread(target=self.httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+  def tearDown(self):
+    """
+    Stop the local server.
+    """
+    self.httpd.shutdown()
+    self.httpd.server_close()
+
+  def run_analyzer(self, creative_urls, protocol, verify=True, debug=False):
+    """
+    Run an analyzer and return the sorted logs passed to its callback.
+    """
+    logs = []
+
+    def callback(creative_id, issue_id, protocol, url=None):
+      logs.append((creative_id, issue_id, protocol, url))
+
+    AnalyzerHost(creative_urls.items(), protocol, callback, verify=verify, debug=debug).run()
+    return sorted(logs)
+
+  def test_find_vast_urls(self):
+    """
+    Test to find the urls requested by players and the urls of wrapped documents.
+    """
+    urls, wrapper_urls = adscan.analyzer.find_vast_urls(VAST_XML)
+    assert sorted(urls) == ['http://example.com/impression', 'https://example.com/start', 'https://example.com/video.mp4']
+    assert wrapper_urls == ['https://example.com/wrapped.xml']
+
+  def test_find_vast_urls_in_invalid_xml(self):
+    """
+    Test that no url is found in a document that is not XML.
+    """
+    assert adscan.analyzer.find_vast_urls('<html') == ([], [])
+
+  def test_assign(self):
+    """
+    Test that only the creatives that are a URL of an image or a VAST document, or static HTML tags are assigned to
+    analyzers.
+    """
+    def creative(creative_id, creative_type, snippet):
+      creative = Creative(creative_id=creative_id, creative_type=creative_type)
+      creative.scan_snippet = creative.modified_scan_snippet = snippet
+      return creative
+
+    image = creative(1, 'ImageCreative', 'https://example.com/image.png')
+    vast = creative(2, 'VastRedirectCreative', 'https://example.com/vast.xml')
+    custom = creative(3, 'CustomCreative', '<img src="https://example.com/image.png">')
+    not_url = creative(4, 'ImageCreative', 'image.png')
+    script = creative(5, 'ThirdPartyCreative', '<script src="https://example.com/ad.js"></script>')
+
+    analyzers = AnalyzerController('https', 1, None)
+    remaining = analyzers.assign([image, vast, custom, not_url, script])
+
+    assert remaining == [not_url, script]
+    assert analyzers.creative_urls == {
+      '1': ('ImageCreative', ['https://example.com/image.png']),
+      '2': ('VastRedirectCreative', ['https://example.com/vast.xml']),
+      '3': ('CustomCreative', ['https://example.com/image.png'])
+    }
+    assert analyzers.static_count == 1
+
+  def test_assign_over_http(self):
+    """
+    Test that the original snippet is scanned over http.
+    """
+    image = Creative(creative_id=1, creative_type='ImageCreative')
+    image.scan_snippet = 'http://example.com/image.png'
+    image.modified_scan_snippet = 'https://example.com/image.png'
+
+    analyzers = AnalyzerController('http', 1, None)
+    assert analyzers.assign([image]) == []
+    assert analyzers.creative_urls == {'1': ('ImageCreative', ['http://example.com/image.png'])}
+
+  def test_assign_in_both_passes(self):
+    """
+    Test that a static creative is scanned without browsers over both protocols, even if its original snippet has http
+    urls, and a creative is scanned with browsers over both protocols if either of its snippets is dynamic.
+    """
+    static = Creative(creative_id=1, creative_type='CustomCreative')
+    static.scan_snippet = '<img src="http://example.com/a.png">'
+    static.modified_scan_snippet = '<img src="https://example.com/a.png">'
+    dynamic = Creative(creative_id=2, creative_type='CustomCreative')
+    dynamic.scan_snippet = '<img src="http://example.com/a.png"><script src="http://example.com/a.js"></script>'
+    dynamic.modified_scan_snippet = '<img src="https://example.com/a.png">'
+
+    for protocol in ['https', 'http']:
+      analyzers = AnalyzerController(protocol, 1, None)
+      assert analyzers.assign([static, dynamic]) == [dynamic]
+      assert analyzers.creative_urls == {'1': ('CustomCreative', ['%s://example.com/a.png' % protocol])}
+
+  def test_count_only(self):
+    """
+    Test that the urls are passed to the callback without issue ids when they are not checked.
+    """
+    logs = []
+
+    def callback(creative_id, issue_id, protocol, url=None):
+      logs.append((creative_id, issue_id, protocol, url))
+
+    creative_urls = {'1': ('ImageCreative', ['http://example.com/image.png']), '2': ('CustomCreative', [])}
+    AnalyzerHost(creative_urls.items(), 'http', callback, verify=False).run()
+    assert sorted(logs) == [('1', None, 'http', 'http://example.com/image.png'), ('2', 9, 'http', None)]
+
+  def test_private_network(self):
+    """
+    Test that no request is sent to a private network unless debugging, and such urls are reported as browser.js does.
+    """
+    assert adscan.net.is_private_network(self.origin + '/image.png')
+    assert not adscan.net.is_private_network('http://')
+
+    creative_urls = {'1': ('ImageCreative', [self.origin + '/redirect']), '2': ('VastRedirectCreative', [self.origin])}
+    for verify in (True, False):
+      assert self.run_analyzer(creative_urls, 'http', verify=verify) == [
+        ('1', 8, 'http', self.origin + '/redirect'), ('2', 8, 'http', self.origin)]
+    assert RedirectHandler.paths == []
+
+  def test_redirects(self):
+    """
+    Test that every hop of a redirect is reported with its own check.
+    """
+    creative_urls = {'1': ('ImageCreative', [self.origin + '/redirect'])}
+    # The local server does not speak https, so the SSL handshakes for the https versions of the hops fail.
+    assert self.run_analyzer(creative_urls, 'http', debug=True) == [
+      ('1', 1, 'http', self.origin + '/image.png'), ('1', 1, 'http', self.origin + '/redirect')]
+    assert self.run_analyzer(creative_urls, 'http', verify=False, debug=True) == [
+      ('1', None, 'http', self.origin + '/image.png'), ('1', None, 'http', self.origin + '/redirect')]
+    assert RedirectHandler.paths == ['/redirect', '/image.png', '/redirect', '/image.png']
+
+  def test_static_redirects(self):
+    """
+    Test that the redirects of the images in a static creative are followed whether the urls are checked or only
+    counted, so that both scans count the same urls.
+    """
+    custom = Creative(creative_id=1, creative_type='CustomCreative')
+    custom.scan_snippet = custom.modified_scan_snippet = '<div><img src="%s/redirect"></div>' % self.origin.replace(
+      'http:', '')
+
+    for verify in (True, False):
+      logs = []
+      analyzers = AnalyzerController(
+        'http', 1, lambda creative_id, issue_id, protocol, url=None: logs.append(url), verify=verify, debug=True)
+      assert analyzers.assign([custom]) == []
+      analyzers.start()
+      analyzers.wait()
+      assert sorted(logs) == [self.origin + '/image.png', self.origin + '/redirect']
+
+  def test_browser_parity(self):
+    """
+    Test that the analyzers report the same issue id as the browsers do for each url they request.
+    """
+    session = FakeSession()
+    urls = ['http://example.com%s' % path for path in sorted(FakeSession.responses)]
+    logs = {}
+    analyzer = AnalyzerHost({}, 'http', lambda creative_id, issue_id, protocol, url=None: logs.update({url: issue_id}))
+    analyzer.session = session
+    for url in urls:
+      analyzer._verify_each_url('1', 'ImageCreative', [url])
+
+    assert sorted(logs.keys()) == urls
+    for url in urls:
+      assert logs[url] == BrowserHost.verify_http_url(session, url)
+    assert [logs['http://example.com%s' % path] for path in ['/forbidden', '/missing', '/error', '/redirect']] == [
+      4, 4, 5, 4]
+    assert logs['http://example.com/redirect-ok'] == 3
+
+  def test_take_creatives_until_deadline(self):
+    """
+    Test that the analyzers take the creatives in the order of their priority, stop taking them when the next one is not
+    expected to finish before the deadline, and the creatives left are deferred.
+    """
+    creatives = []
+    for creative_id in [1, 2, 3]:
+      creative = Creative(creative_id=creative_id, creative_type='ImageCreative', priority=float(creative_id))
+      creative.scan_snippet = creative.modified_scan_snippet = 'https://example.com/%d.png' % creative_id
+      creatives.append(creative)
+
+    now = [time.time()]
+    deadline = Deadline(datetime.datetime.fromtimestamp(now[0] + 100), clock=lambda: now[0])
+    analyzers = AnalyzerController('https', 1, None, deadline=deadline)
+    assert analyzers.assign(creatives) == []
+
+    creative_urls = analyzers._take_creative_urls()
+    assert next(creative_urls) == ('3', ('ImageCreative', ['https://example.com/3.png']))
+    analyzers.estimator.add(80)
+    now[0] += 10
+    assert list(creative_urls) == []
+    assert [creative.creative_id for creative in analyzers.deferred_creatives()] == [2, 1]
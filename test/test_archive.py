@@ -0,0 +1,63 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+import datetime
+import unittest
+
+import adscan.fs
+import adscan.archive
+
+
+class ArchiveTestCase(unittest.TestCase):
+  """
+  Test the archive module.
+  """
+
+  WORK_DIR = '__archive_test__'
+
+  def tearDown(self):
+    """
+    Remove the working directory.
+    """
+    adscan.fs.rmdirs(self.WORK_DIR)
+
+  def test_write_and_read_archive(self):
+    """
+    Test that the rows are archived by dates and read back between the dates.
+    """
+    day1 = datetime.date(2014, 5, 1)
+    day2 = datetime.date(2014, 5, 2)
+    columns = ['created_at', 'creative_id']
+    adscan.archive.write_archive(self.WORK_DIR, 'creative', day1, columns, [(day1, 1), (day1, 2)])
+    adscan.archive.write_archive(self.WORK_DIR, 'creative', day2, columns, [(day2, 3)])
+
+    assert adscan.archive.archived_dates(self.WORK_DIR, 'creative') == [day1, day2]
+    assert adscan.archive.archived_dates(self.WORK_DIR, 'scanlog') == []
+    rows = adscan.archive.read_archive(self.WORK_DIR, 'creative', day1, day2, columns=['creative_id'])
+    assert [row['creative_id'] for row in rows] == [1, 2, 3]
+    rows = adscan.archive.read_archive(self.WORK_DIR, 'creative', day2)
+    assert list(rows) == [{'created_at': '2014-05-02', 'creative_id': 3}]
+
+  def test_write_archive_again(self):
+    """
+    Test that writing the rows of a date again replaces the file without duplicates, and a file of other columns is
+    not replaced.
+    """
+    day = datetime.date(2014, 5, 1)
+    columns = ['created_at', 'creative_id']
+    adscan.archive.write_archive(self.WORK_DIR, 'creative', day, columns, [(day, 1), (day, 2)])
+    adscan.archive.write_archive(self.WORK_DIR, 'creative', day, columns, [(day, 1), (day, 2)])
+    assert [row['creative_id'] for row in adscan.archive.read_archive(self.WORK_DIR, 'creative', day)] == [1, 2]
+
+    self.assertRaises(
+      Exception, adscan.archive.write_archive, self.WORK_DIR, 'creative', day, ['creative_id'], [(3,)])
+    assert [row['creative_id'] for row in adscan.archive.read_archive(self.WORK_DIR, 'creative', day)] == [1, 2]
@@ -14,6 +14,7 @@ import re
 import os
 import json
 import socket
+import time
 import shutil
 import unittest
 import datetime
@@ -23,6 +24,8 @@ import adscan.fs
 import adscan.net
 from adscan.model import Creative
 from adscan.scanner import Scanner
+from adscan.browser import BrowserController
+from adscan.deadline import Deadline
 
 
 CONFIG_FILE = 'config.ini'
@@ -106,6 +109,55 @@ class BrowserTestCase(unittest.TestCase):
       netlog = json.load(fp)
     return netlog
 
+  def test_take_urls_in_order_of_priority(self):
+    """
+    Test that the browsers take the creatives with higher priority first from the shared queue, and the creatives
+    without a snippet to scan are skipped.
+    """
+    creatives = []
+    for creative_id, priority, snippet in [(1, 1.0, 'https://example.com/1'), (2, None, 'https://example.com/2'),
+                                           (3, 5.0, 'https://example.com/3'), (4, 9.0, None)]:
+      creative = Creative(creative_id=creative_id, priority=priority)
+      creative.modified_scan_snippet = snippet
+      creatives.append(creative)
+
+    browsers = BrowserController(
+      creatives, 'https', [443], 2, None, None, None, self.scanner.workspace.dirname, None, None)
+    for order, creative in enumerate(creatives):
+      browsers.jobs.put((-(creative.priority or 0), order, creative))
+
+    first = browsers._take_urls_to_scan(443)
+    second = browsers._take_urls_to_scan(443)
+    assert next(first)[0] == '3'
+    assert next(second)[0] == '1'
+    assert [creative_id for creative_id, url_obj in first] == ['2']
+    assert list(second) == []
+
+  def test_take_urls_until_deadline(self):
+    """
+    Test that the browsers stop taking creatives when the next one is not expected to finish before the deadline, and
+    the creatives left are deferred.
+    """
+    creatives = []
+    for creative_id in [1, 2, 3]:
+      creative = Creative(creative_id=creative_id, priority=float(creative_id))
+      creative.modified_scan_snippet = 'https://example.com/%d' % creative_id
+      creatives.append(creative)
+
+    now = [time.time()]
+    deadline = Deadline(datetime.datetime.fromtimestamp(now[0] + 100), clock=lambda: now[0])
+    browsers = BrowserController(
+      creatives, 'https', [443], 1, None, None, None, self.scanner.workspace.dirname, None, None, deadline=deadline)
+    for order, creative in enumerate(creatives):
+      browsers.jobs.put((-(creative.priority or 0), order, creative))
+
+    urls = browsers._take_urls_to_scan(443)
+    assert next(urls)[0] == '3'
+    browsers.estimator.add(80)
+    now[0] += 10
+    assert list(urls) == []
+    assert [creative.creative_id for creative in browsers.deferred_creatives()] == [2, 1]
+
   def test_browser_view_image(self):
     """
     Test if the browser can view an image.
@@ -0,0 +1,58 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+import unittest
+
+from adscan.issue import IssueType
+from adscan.compliance import ComplianceAggregator
+
+
+class ComplianceTestCase(unittest.TestCase):
+  """
+  Test the compliance module.
+  """
+
+  def test_results(self):
+    """
+    Test that the compliance and request match status are aggregated from the scan logs.
+    """
+    aggregator = ComplianceAggregator()
+    aggregator.reset('https')
+    aggregator.add('1', IssueType.NO_ISSUE, 'https', url='https://example.com/a.png')
+    aggregator.add('2', IssueType.HTTPS_AVAIL, 'https', url='http://example.com/b.png')
+    aggregator.add('3', IssueType.NO_EXTERNAL, 'https')
+    aggregator.add('4', IssueType.NO_ISSUE, 'https', url='https://example.com/a.png')
+    aggregator.reset('http')
+    aggregator.add('1', None, 'http', url='http://example.com/a.png')
+    aggregator.add('3', IssueType.NO_EXTERNAL, 'http')
+    aggregator.add('4', None, 'http', url='http://example.com/a.png')
+    aggregator.add('4', None, 'http', url='http://example.com/c.png')
+
+    compliant_ids, noncompliant_ids, match_ids, unmatch_ids = aggregator.results()
+    assert sorted(compliant_ids) == [1, 3, 4]
+    assert noncompliant_ids == [2]
+    assert sorted(match_ids) == [1, 3]
+    assert unmatch_ids == [4]
+
+  def test_reset_and_load(self):
+    """
+    Test that the state of a protocol is replaced when the creatives are scanned again or loaded from the database.
+    """
+    aggregator = ComplianceAggregator()
+    aggregator.add(1, IssueType.INVALID_CERT, 'https', url='https://example.com/a.png')
+    aggregator.add(2, None, 'http', url='http://example.com/a.png')
+    aggregator.reset('https')
+    assert aggregator.results() == ([2], [], [], [2])
+
+    aggregator.load('https', [(2, 1, 0), (3, 2, 1)])
+    assert aggregator.protocols == set(['https'])
+    assert aggregator.results() == ([2], [3], [2], [])
@@ -0,0 +1,130 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+import datetime
+import unittest
+
+from sqlalchemy import inspect
+
+import adscan.db
+import adscan.fs
+from adscan.model import Creative
+
+
+class DbTestCase(unittest.TestCase):
+  """
+  Test the db module.
+  """
+
+  WORK_DIR = '__db_test__'
+
+  def setUp(self):
+    """
+    Create the working directory.
+    """
+    adscan.fs.makedirs(self.WORK_DIR)
+    self.database = 'sqlite:///%s/creative.db' % self.WORK_DIR
+
+  def tearDown(self):
+    """
+    Remove the working directory.
+    """
+    adscan.fs.rmdirs(self.WORK_DIR)
+
+  def test_engine_options(self):
+    """
+    Test that the options set explicitly take precedence over the preset.
+    """
+    options = adscan.db.engine_options({'preset': 'bulk', 'synchronous': 'OFF', 'busy_timeout': ''})
+    assert options['journal_mode'] == 'WAL'
+    assert options['synchronous'] == 'OFF'
+    assert options['busy_timeout'] == adscan.db.PRESETS['bulk']['busy_timeout']
+    assert adscan.db.engine_options(None) == {}
+    self.assertRaises(ValueError, adscan.db.engine_options, {'preset': 'unknown'})
+
+  def test_new_engine_with_sqlite_pragmas(self):
+    """
+    Test that the SQLite settings are applied to the connections.
+    """
+    engine = adscan.db.new_engine(self.database, {'journal_mode': 'WAL', 'busy_timeout': '1234'})
+    assert engine.execute('PRAGMA journal_mode').scalar().lower() == 'wal'
+    assert engine.execute('PRAGMA busy_timeout').scalar() == 1234
+    self.assertRaises(ValueError, adscan.db.new_engine, self.database, {'synchronous': 'OFF; DROP TABLE creative'})
+
+  def test_migrate_table(self):
+    """
+    Test that the columns and indexes missing in an existing table are added.
+    """
+    engine = adscan.db.new_engine(self.database)
+    engine.execute('CREATE TABLE creative (created_at DATE, creative_id INTEGER, PRIMARY KEY (created_at, creative_id))')
+    adscan.db.create_table(engine, Creative)
+    columns = [column['name'] for column in inspect(engine).get_columns(Creative.__tablename__)]
+    assert sorted(columns) == sorted(column.name for column in Creative.__table__.columns)
+    indexes = [index['name'] for index in inspect(engine).get_indexes(Creative.__tablename__)]
+    assert sorted(indexes) == sorted(index.name for index in Creative.__table__.indexes)
+
+  def test_update_by_ids(self):
+    """
+    Test that the rows are updated by more ids than the limit of variables in a statement.
+    """
+    session = adscan.db.new_session(self.database, Creative)
+    today = datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    rows = [{'created_at': date, 'creative_id': i} for date in [today, yesterday] for i in xrange(1, 3001)]
+    session.execute(Creative.__table__.insert(), rows)
+
+    ids = range(1, 2001)
+    count = adscan.db.update_by_ids(session, Creative.creative_id, ids, {'compliance': True}, Creative.created_at == today)
+    session.commit()
+
+    assert count == 2000
+    updated = session.query(Creative.created_at, Creative.creative_id).filter(Creative.compliance == True).all()
+    assert sorted(updated) == [(today, i) for i in ids]
+
+  def test_load_ids(self):
+    """
+    Test that the temporary table only has the ids loaded last.
+    """
+    session = adscan.db.new_session(self.database, Creative)
+    adscan.db.load_ids(session, [1, 2, 3])
+    table = adscan.db.load_ids(session, [3, 4, 4])
+    assert sorted(t[0] for t in session.query(table.c.id).all()) == [3, 4]
+
+  def test_load_ids_in_transaction(self):
+    """
+    Test that loading the ids again does not commit the changes made in the transaction.
+    """
+    session = adscan.db.new_session(self.database, Creative)
+    adscan.db.load_ids(session, [1])
+    session.execute(Creative.__table__.insert(), [{'created_at': datetime.date.today(), 'creative_id': 1}])
+    adscan.db.load_ids(session, [2])
+    session.rollback()
+    assert session.query(Creative).count() == 0
+
+  def test_insert_new_ids(self):
+    """
+    Test that only the ids that do not have rows are inserted.
+    """
+    session = adscan.db.new_session(self.database, Creative)
+    today = datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    session.execute(Creative.__table__.insert(), [
+      {'created_at': today, 'creative_id': 1, 'snippet': 'kept'},
+      {'created_at': yesterday, 'creative_id': 2, 'snippet': None}
+    ])
+
+    counts = adscan.db.insert_new_ids(session, Creative.creative_id, ['1', '2', '3', '3'], {'created_at': today})
+    session.commit()
+
+    assert counts == (2, 1)
+    rows = session.query(Creative.created_at, Creative.creative_id, Creative._snippet).order_by(Creative.creative_id).all()
+    assert rows == [(today, 1, 'kept'), (yesterday, 2, None), (today, 2, None), (today, 3, None)]
@@ -0,0 +1,66 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+import time
+import datetime
+import unittest
+
+from adscan.deadline import Deadline, ThroughputEstimator, parse_deadline
+
+
+class DeadlineTestCase(unittest.TestCase):
+  """
+  Test the deadline module.
+  """
+
+  def test_parse_deadline(self):
+    """
+    Test that a time earlier than now is the time of the next day.
+    """
+    now = datetime.datetime(2014, 5, 1, 22, 0)
+    assert parse_deadline('23:30', now) == datetime.datetime(2014, 5, 1, 23, 30)
+    assert parse_deadline('07:00', now) == datetime.datetime(2014, 5, 2, 7, 0)
+    assert parse_deadline('', now) is None
+
+  def test_estimator(self):
+    """
+    Test that the estimate follows the recent durations.
+    """
+    estimator = ThroughputEstimator(alpha=0.5)
+    assert estimator.estimate() == 0.0
+    estimator.add(10)
+    assert estimator.estimate() == 10.0
+    estimator.add(20)
+    assert estimator.estimate() == 15.0
+
+  def test_deadline_allows(self):
+    """
+    Test that a task is allowed only if it is expected to finish before the reserved time with the margin.
+    """
+    now = [time.mktime(datetime.datetime(2014, 5, 1, 6, 0).timetuple())]
+    deadline = Deadline(datetime.datetime(2014, 5, 1, 7, 0), reserve_seconds=1800, margin=2.0, clock=lambda: now[0])
+    assert deadline.remaining() == 1800
+    assert deadline.allows(800)
+    assert not deadline.allows(1000)
+    now[0] += 1800
+    assert not deadline.allows(0)
+
+  def test_reserve_share(self):
+    """
+    Test that a share of the time left for browsing is kept for a later pass.
+    """
+    now = [time.mktime(datetime.datetime(2014, 5, 1, 6, 0).timetuple())]
+    deadline = Deadline(datetime.datetime(2014, 5, 1, 7, 0), reserve_seconds=1800, clock=lambda: now[0])
+    assert deadline.reserve_share(0.25).remaining() == 1350
+    assert deadline.remaining() == 1800
+    now[0] += 3600
+    assert deadline.reserve_share(0.25).remaining() == deadline.remaining()
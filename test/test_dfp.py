@@ -10,11 +10,19 @@
 # distributed under the License is distributed on an "AS IS" BASIS,
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 
+import os
+import sys
+import time
+import socket
 import datetime
+import subprocess
 import unittest
+import threading
+
+import suds
+import suds.sudsobject
 
 import adscan.dfp
-import googleads.dfp
 
 
 class DfpTestCase(unittest.TestCase):
@@ -53,20 +61,22 @@ class DfpTestCase(unittest.TestCase):
     """
     statements = adscan.dfp.create_creative_service_statement(creative_ids, offset=offset, only_new=only_new, days_ago=days_ago)
 
-    expect_len = len(creative_ids) / googleads.dfp.SUGGESTED_PAGE_LIMIT
-    if len(creative_ids) % googleads.dfp.SUGGESTED_PAGE_LIMIT != 0:
+    expect_len = len(creative_ids) / adscan.dfp.PAGE_LIMIT
+    if len(creative_ids) % adscan.dfp.PAGE_LIMIT != 0:
       expect_len += 1
 
     assert len(statements) == expect_len
 
+    page_size = adscan.dfp.PAGE_LIMIT
     for i in xrange(0, len(statements)):
       stmt = statements[i]
       date_setting = ''
       if only_new:
         date_setting = 'lastModifiedDateTime > :date AND'
-      id_str = ','.join(str(i) for i in creative_ids)
+      id_str = ','.join(str(j) for j in creative_ids[(page_size * i):(page_size * (i + 1))])
 
-      assert stmt['query'] == 'WHERE %s id IN (%s) LIMIT %d OFFSET %d' % (date_setting, id_str, googleads.dfp.SUGGESTED_PAGE_LIMIT, googleads.dfp.SUGGESTED_PAGE_LIMIT * i)
+      assert stmt['query'] == 'WHERE %s id IN (%s) ORDER BY id ASC LIMIT %d OFFSET 0' % (
+        date_setting, id_str, page_size)
 
   def test_create_report_service_job(self):
     """
@@ -109,3 +119,224 @@ class DfpTestCase(unittest.TestCase):
     Test the create_creative_service_statement method with multiple creative ids.
     """
     self.create_creative_service_statement([i for i in xrange(0, 1000)])
+
+  def test_page_fetcher_retries_transient_errors(self):
+    """
+    Test that a statement is sent again after a transient error, and a page shorter than its limit stops the
+    following pages of the same query.
+    """
+    service = FakeCreativeService(range(0, 250), failures=1)
+    fetcher = adscan.dfp.PageFetcher(lambda: service, 'getCreativesByStatement', client_count=1, backoff=0)
+    statements = [{'query': 'WHERE id IN (1) LIMIT 100 OFFSET %d' % offset, 'values': None} for offset in [0, 100, 200, 300]]
+
+    pages = list(fetcher.fetch(statements))
+    assert sorted(sum([results for results, metrics in pages], [])) == range(0, 250)
+    assert pages[0][1]['attempts'] == 2
+    assert service.offsets == [0, 0, 100, 200]
+
+  def test_page_fetcher_raises_permanent_errors(self):
+    """
+    Test that an error that is not transient is raised without retries.
+    """
+    service = FakeCreativeService(range(0, 10), failures=1, error=ValueError('invalid'))
+    fetcher = adscan.dfp.PageFetcher(lambda: service, 'getCreativesByStatement', client_count=2, backoff=0)
+    statements = [{'query': 'WHERE id IN (1) LIMIT 100 OFFSET 0', 'values': None}]
+
+    self.assertRaises(ValueError, list, fetcher.fetch(statements))
+    assert service.offsets == [0]
+
+  def test_page_fetcher_splits_large_pages(self):
+    """
+    Test that the pending statements are split after a page larger than the limit.
+    """
+    service = FakeCreativeService(range(0, 400))
+    fetcher = adscan.dfp.PageFetcher(lambda: service, 'getCreativesByStatement', client_count=1, max_page_bytes=10,
+                                     min_page_size=100)
+    statements = [{'query': 'WHERE id IN (1) LIMIT 200 OFFSET %d' % offset, 'values': None} for offset in [0, 200]]
+
+    pages = list(fetcher.fetch(statements))
+    assert [metrics['count'] for results, metrics in pages] == [200, 100, 100]
+    assert sorted(sum([results for results, metrics in pages], [])) == range(0, 400)
+
+  def test_page_fetcher_grows_pages_back(self):
+    """
+    Test that the split statements are merged back up to the size of the statements given after consecutive fast
+    pages.
+    """
+    service = FakeCreativeService(range(0, 1000), slow_offsets=[0])
+    fetcher = adscan.dfp.PageFetcher(lambda: service, 'getCreativesByStatement', client_count=1, max_page_seconds=0.05,
+                                     min_page_size=50, grow_after=2)
+    statements = [{'query': 'WHERE id IN (1) LIMIT 200 OFFSET %d' % offset, 'values': None} for offset in [0, 200, 400]]
+
+    pages = list(fetcher.fetch(statements))
+    assert [metrics['count'] for results, metrics in pages] == [200, 100, 100, 200]
+    assert sorted(sum([results for results, metrics in pages], [])) == range(0, 600)
+    statements = [
+      {'query': 'WHERE id IN (1) LIMIT 50 OFFSET %d' % offset, 'values': None} for offset in xrange(0, 400, 50)]
+    merged = adscan.dfp.merge_statements(statements, 100)
+    assert [adscan.dfp.parse_page(s)[1:] for s in merged] == [(100, 0), (100, 100), (100, 200), (100, 300)]
+
+  def test_page_fetcher_reuses_pool(self):
+    """
+    Test that the fetches between open and close share the threads and their services, and the results of a fetch
+    left early are not taken by the next one.
+    """
+    services = []
+
+    def create_service():
+      services.append(FakeCreativeService(range(0, 100)))
+      return services[-1]
+
+    fetcher = adscan.dfp.PageFetcher(create_service, 'getCreativesByStatement', client_count=2, backoff=0)
+    fetcher.open()
+    try:
+      for offset in [0, 40, 80]:
+        statements = [{'query': 'WHERE id IN (1) LIMIT 10 OFFSET %d' % (offset + i * 10)} for i in xrange(0, 2)]
+        pages = fetcher.fetch(statements)
+        assert pages.next()[0][0] in [offset, offset + 10]
+        pages.close()
+      pages = list(fetcher.fetch([{'query': 'WHERE id IN (1) LIMIT 10 OFFSET 90'}]))
+      assert pages[0][0] == range(90, 100)
+    finally:
+      fetcher.close()
+    assert len(services) <= 2
+
+  def test_read_report_records(self):
+    """
+    Test that the header and empty lines of a report are skipped.
+    """
+    report = ['Dimension.CREATIVE_ID,Column.AD_SERVER_IMPRESSIONS\n', '1,100\n', '\n', '2,0\n']
+    assert list(adscan.dfp.read_report_records(report)) == [(1, 100), (2, 0)]
+
+  def test_batch_uploader_isolates_invalid_entries(self):
+    """
+    Test that a rejected batch is bisected until the invalid entries are isolated, and the others are uploaded.
+    """
+    service = FakeCreativeService([], invalid_ids=[3, 6])
+    uploader = adscan.dfp.BatchUploader(lambda: service, 'updateCreatives', batch_size=4, client_count=2, backoff=0)
+    entries = [{'id': i} for i in xrange(0, 8)]
+
+    updated, failed = [], []
+    for results, failures, metrics in uploader.upload(entries):
+      updated.extend(results)
+      failed.extend(failures)
+    assert sorted(entry['id'] for entry in updated) == [0, 1, 2, 4, 5, 7]
+    assert sorted(entry['id'] for entry, error in failed) == [3, 6]
+    assert all(adscan.dfp.is_entry_error(error) for entry, error in failed)
+
+  def test_batch_uploader_fails_batch_on_other_errors(self):
+    """
+    Test that a batch that failed for an error that names no entries, such as an authentication error, is not split.
+    """
+    error = create_fault('[AuthenticationError.NOT_WHITELISTED_FOR_API_ACCESS @ ]')
+    service = FakeCreativeService([], failures=2, error=error)
+    uploader = adscan.dfp.BatchUploader(lambda: service, 'updateCreatives', batch_size=4, client_count=1, backoff=0)
+
+    batches = list(uploader.upload([{'id': i} for i in xrange(0, 8)]))
+    assert service.batch_sizes == [4, 4]
+    assert [len(failures) for results, failures, metrics in batches] == [4, 4]
+    self.assertFalse(adscan.dfp.is_entry_error(socket.error('connection reset')))
+
+  def test_batch_uploader_retries_transient_errors(self):
+    """
+    Test that a batch is uploaded again after a transient error without being split.
+    """
+    service = FakeCreativeService([], failures=1)
+    uploader = adscan.dfp.BatchUploader(lambda: service, 'updateCreatives', batch_size=10, client_count=1, backoff=0)
+
+    batches = list(uploader.upload([{'id': i} for i in xrange(0, 5)]))
+    assert len(batches) == 1
+    assert len(batches[0][0]) == 5
+    assert batches[0][2]['attempts'] == 2
+    assert service.batch_sizes == [5, 5]
+
+  def test_to_serializable(self):
+    """
+    Test that a DFP object is converted into dictionaries with its types, and its lastModifiedDateTime is read.
+    """
+    factory = suds.sudsobject.Factory
+    date = factory.object('Date', {'year': 2014, 'month': 5, 'day': 1})
+    modified = factory.object('DateTime', {'date': date, 'hour': 9, 'minute': 30, 'second': 0})
+    asset = factory.object('CreativeAsset', {'assetUrl': 'http://example.com/a.png'})
+    creative = factory.object('ImageCreative', {'id': 1, 'primaryImageAsset': asset, 'lastModifiedDateTime': modified})
+
+    data = adscan.dfp.to_serializable(creative)
+    assert data['xsi_type'] == 'ImageCreative'
+    assert data['primaryImageAsset'] == {'xsi_type': 'CreativeAsset', 'assetUrl': u'http://example.com/a.png'}
+    assert adscan.dfp.last_modified(creative) == '2014-05-01T09:30:00'
+    assert adscan.dfp.last_modified(data) == '2014-05-01T09:30:00'
+    assert adscan.dfp.last_modified({'id': 1}) is None
+
+  def test_import_without_client(self):
+    """
+    Test that importing the scanner neither imports the DFP library nor creates the client.
+    """
+    src_dir = os.path.join(os.path.dirname(os.path.abspath(adscan.dfp.__file__)), os.pardir)
+    code = 'import sys, adscan.scanner, adscan.dfp; print "googleads" in sys.modules, adscan.dfp._client is None'
+    output = subprocess.check_output([sys.executable, '-c', code], env=dict(os.environ, PYTHONPATH=src_dir))
+    assert output.strip() == 'False True'
+
+
+def create_fault(message):
+  """
+  Create a fault raised by DFP.
+
+  :param message: the fault string.
+  :return: an instance of suds.WebFault.
+  """
+  fault = suds.sudsobject.Factory.object('Fault', {'faultcode': 'soap:Server', 'faultstring': message})
+  return suds.WebFault(fault, None)
+
+
+class FakeCreativeService(object):
+  """
+  Creative service that returns the pages of a list of entries.
+  """
+
+  def __init__(self, entries, failures=0, error=None, invalid_ids=None, slow_offsets=None):
+    """
+    Initialize the instance.
+
+    :param entries: a list of entries.
+    :param failures: the number of calls that fail at first.
+    :param error: the error raised by the failing calls.
+    :param invalid_ids: the ids of the entries that are rejected on update.
+    :param slow_offsets: the offsets of the pages that take 0.1 seconds.
+    """
+    self.entries = entries
+    self.failures = failures
+    self.error = error or socket.error('connection reset')
+    self.invalid_ids = invalid_ids or []
+    self.slow_offsets = slow_offsets or []
+    self.offsets = []
+    self.batch_sizes = []
+    self.lock = threading.Lock()
+
+  def getCreativesByStatement(self, statement):
+    """
+    Return the page of the statement.
+    """
+    query, limit, offset = adscan.dfp.parse_page(statement)
+    with self.lock:
+      self.offsets.append(offset)
+      if self.failures > 0:
+        self.failures -= 1
+        raise self.error
+    if offset in self.slow_offsets:
+      time.sleep(0.1)
+    results = self.entries[offset:(offset + limit)]
+    return {'results': results} if results else {}
+
+  def updateCreatives(self, entries):
+    """
+    Return the entries, or raise an error if any of them is invalid.
+    """
+    with self.lock:
+      self.batch_sizes.append(len(entries))
+      if self.failures > 0:
+        self.failures -= 1
+        raise self.error
+    for i, entry in enumerate(entries):
+      if entry['id'] in self.invalid_ids:
+        raise create_fault('[InvalidUrlError.ILLEGAL_CHARACTERS @ creatives[%d].htmlSnippet]' % i)
+    return entries
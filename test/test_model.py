@@ -0,0 +1,93 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+import datetime
+import unittest
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import adscan.db
+import adscan.fs
+from adscan.model import Blob, Creative, load_blobs, save_blobs, save_blobs_listener
+
+
+class ModelTestCase(unittest.TestCase):
+  """
+  Test the model module.
+  """
+
+  WORK_DIR = '__model_test__'
+
+  def setUp(self):
+    """
+    Create the working directory and the database.
+    """
+    adscan.fs.makedirs(self.WORK_DIR)
+    self.database = 'sqlite:///%s/creative.db' % self.WORK_DIR
+    self.session = save_blobs(adscan.db.new_session(self.database, [Blob, Creative]))
+
+  def tearDown(self):
+    """
+    Remove the working directory.
+    """
+    self.session.close()
+    adscan.fs.rmdirs(self.WORK_DIR)
+
+  def test_snippets_are_stored_once(self):
+    """
+    Test that the same snippets are stored once in the blob table and read back through the creatives.
+    """
+    snippet = u'<img src="http://example.com/\u00e9.png">'
+    self.session.add(Creative(creative_id=1, snippet=snippet, expanded_snippet=snippet))
+    self.session.add(Creative(creative_id=2, snippet=snippet))
+    self.session.commit()
+    self.session.add(Creative(creative_id=3, snippet=snippet, modified_snippet='modified'))
+    self.session.commit()
+
+    assert self.session.query(Blob).count() == 2
+    row = self.session.query(Creative._snippet, Creative.snippet_ref).filter(Creative.creative_id == 1).one()
+    assert row == (None, Blob.hash_text(snippet))
+
+    session = adscan.db.new_session(self.database, [Blob, Creative])
+    creatives = session.query(Creative).order_by(Creative.creative_id).all()
+    load_blobs(session, creatives)
+    assert [c.snippet for c in creatives] == [snippet] * 3
+    assert [c.expanded_snippet for c in creatives] == [snippet, None, None]
+    assert creatives[2].modified_snippet == 'modified'
+    assert session.query(Creative).filter(Creative.modified_snippet != None).count() == 1
+
+  def test_blobs_saved_by_own_sessions(self):
+    """
+    Test that only the sessions that store the texts save the blobs when they are flushed.
+    """
+    session = adscan.db.new_session(self.database, [Blob, Creative])
+    assert not event.contains(Session, 'before_flush', save_blobs_listener)
+    assert not event.contains(session, 'before_flush', save_blobs_listener)
+    assert event.contains(self.session, 'before_flush', save_blobs_listener)
+    session.close()
+
+  def test_legacy_snippets(self):
+    """
+    Test that the snippets stored by older versions are read, and moved to the blob table when they are set.
+    """
+    self.session.execute(Creative.__table__.insert(), [
+      {'created_at': datetime.date.today(), 'creative_id': 1, 'snippet': 'legacy'}
+    ])
+    creative = self.session.query(Creative).filter(Creative.snippet != None).one()
+    assert creative.snippet == 'legacy'
+
+    creative.snippet = creative.snippet
+    self.session.commit()
+    row = self.session.query(Creative._snippet, Creative.snippet_ref).one()
+    assert row == (None, Blob.hash_text('legacy'))
+    assert self.session.query(Blob).one().text() == 'legacy'
@@ -0,0 +1,44 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+import unittest
+
+from adscan.priority import priority_score, MAX_AGE_DAYS
+
+
+class PriorityTestCase(unittest.TestCase):
+  """
+  Test the priority module.
+  """
+
+  def test_impressions(self):
+    """
+    Test that the creatives with more impressions have higher priority.
+    """
+    assert priority_score(1000000, False, False, 1) > priority_score(1000, False, False, 1) > priority_score(0, False, False, 1)
+    assert priority_score(None, False, False, 1) == priority_score(0, False, False, 1)
+
+  def test_signs_of_change(self):
+    """
+    Test that the non-compliant, changed and long unscanned creatives have higher priority.
+    """
+    base = priority_score(100, False, False, 0)
+    assert priority_score(100, True, False, 0) > base
+    assert priority_score(100, False, True, 0) > base
+    assert priority_score(100, False, False, 10) > base
+
+  def test_age_is_capped(self):
+    """
+    Test that the age adds no more than the creatives never scanned.
+    """
+    assert priority_score(0, False, False, MAX_AGE_DAYS * 2) == priority_score(0, False, False, None)
+    assert priority_score(0, False, False, MAX_AGE_DAYS) == priority_score(0, False, False, None)
@@ -0,0 +1,184 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+import gzip
+import socket
+import tempfile
+import unittest
+
+import adscan.fs
+import adscan.dfp
+import adscan.replay
+import adscan.transform
+
+
+class ReplayTestCase(unittest.TestCase):
+  """
+  Test the replay module.
+  """
+
+  WORK_DIR = '__replay_test__'
+
+  def tearDown(self):
+    """
+    Restore the live backend and remove the working directory.
+    """
+    adscan.dfp.set_backend('live')
+    adscan.fs.rmdirs(self.WORK_DIR)
+
+  def test_replay_statements(self):
+    """
+    Test that the ids, the time bound, and LIMIT and OFFSET of the statements are applied to the creatives.
+    """
+    adscan.replay.generate_fixtures(self.WORK_DIR, 30)
+    service = adscan.replay.ReplayClient(self.WORK_DIR).GetService('CreativeService')
+
+    ids = [1, 2, 3, 5, 8, 13, 21, 99]
+    statement = {'query': 'WHERE id IN (%s) LIMIT 3 OFFSET 3' % ','.join(str(i) for i in ids), 'values': None}
+    assert [c['id'] for c in service.getCreativesByStatement(statement)['results']] == [5, 8, 13]
+
+    creatives = service.getCreativesByStatement({'query': 'WHERE id IN (1,2,3,4,5,6) LIMIT 10 OFFSET 0'})['results']
+    since = sorted(adscan.dfp.last_modified(c) for c in creatives)[2]
+    statements = adscan.dfp.create_creative_service_statement(range(1, 7), since=since)
+    results = service.getCreativesByStatement(statements[0])['results']
+    assert sorted(c['id'] for c in results) == sorted(c['id'] for c in creatives if adscan.dfp.last_modified(c) > since)
+    assert len(results) == 3
+
+  def test_replay_pipeline(self):
+    """
+    Test that the report, the download and the upload of the creatives run on the replay backend.
+    """
+    adscan.replay.generate_fixtures(self.WORK_DIR, 20)
+    adscan.dfp.set_backend('replay', self.WORK_DIR)
+
+    records = list(adscan.dfp.run_report_service_job(adscan.dfp.create_report_service_job()))
+    assert [creative_id for creative_id, impressions in records] == range(1, 21)
+
+    statements = adscan.dfp.create_creative_service_statement(range(1, 21), only_new=False, page_size=8)
+    dfp_creatives = adscan.dfp.run_creative_service_statements(statements, client_count=2)
+    assert sorted(c['id'] for c in dfp_creatives) == range(1, 21)
+    creatives = [adscan.transform.from_dfp(dfp) for dfp in dfp_creatives]
+    assert all(creative.snippet for creative in creatives)
+
+    dfp_creatives[0]['name'] = 'uploaded'
+    updated = adscan.dfp.upload_creatives(dfp_creatives[:5], batch_size=2, client_count=2)
+    assert sorted(c['id'] for c in updated) == sorted(c['id'] for c in dfp_creatives[:5])
+    service = adscan.dfp.creative_service()
+    statement = {'query': 'WHERE id IN (%d) LIMIT 1 OFFSET 0' % dfp_creatives[0]['id']}
+    assert service.getCreativesByStatement(statement)['results'][0]['name'] == 'uploaded'
+
+  def test_download_modified_creatives(self):
+    """
+    Test that the creatives in the network modified after a time are downloaded in rounds of pages until a round is
+    not full.
+    """
+    adscan.replay.generate_fixtures(self.WORK_DIR, 30)
+    adscan.dfp.set_backend('replay', self.WORK_DIR)
+    fixtures = adscan.replay.load_creatives(self.WORK_DIR)
+    since = sorted(adscan.dfp.last_modified(c) for c in fixtures.values())[9]
+
+    creatives = adscan.dfp.download_modified_creatives(since, client_count=2, page_size=4)
+    assert sorted(c['id'] for c in creatives) == sorted(
+      c['id'] for c in fixtures.values() if adscan.dfp.last_modified(c) > since)
+    assert len(creatives) == 20
+    assert adscan.dfp.network_code() == adscan.replay.REPLAY_NETWORK_CODE
+
+    statements = adscan.dfp.create_modified_creatives_statements(since, offset=8, count=2, page_size=4)
+    assert [adscan.dfp.parse_page(s)[1:] for s in statements] == [(4, 8), (4, 12)]
+    assert adscan.dfp.shift_time('2014-05-01T00:30:00', -3600) == '2014-04-30T23:30:00'
+
+  def test_replay_faults(self):
+    """
+    Test that the injected faults are transient and the statements succeed after retries.
+    """
+    adscan.replay.generate_fixtures(self.WORK_DIR, 50)
+    client = adscan.replay.ReplayClient(self.WORK_DIR, fault_rate=0.3, seed=1)
+    fetcher = adscan.dfp.PageFetcher(
+      lambda: client.GetService('CreativeService'), 'getCreativesByStatement', client_count=3, max_retries=20,
+      backoff=0)
+    statements = adscan.dfp.create_creative_service_statement(range(1, 51), only_new=False, page_size=5)
+
+    pages = list(fetcher.fetch(statements))
+    assert sorted(c['id'] for results, metrics in pages for c in results) == range(1, 51)
+    assert client.backend.fault_count > 0
+    assert sum(metrics['attempts'] for results, metrics in pages) == client.backend.call_count
+
+    always = adscan.replay.ReplayClient(self.WORK_DIR, fault_rate=1.0).GetService('CreativeService')
+    self.assertRaises(socket.error, always.getCreativesByStatement, statements[0])
+
+  def test_record_and_replay(self):
+    """
+    Test that the interactions with DFP are recorded and served by the replay client.
+    """
+    client = adscan.replay.RecordingClient(FakeClient(), self.WORK_DIR)
+    service = client.GetService('CreativeService')
+    service.getCreativesByStatement({'query': 'WHERE id IN (1,2) LIMIT 10 OFFSET 0'})
+    service.updateCreatives([{'xsi_type': 'CustomCreative', 'id': 2, 'htmlSnippet': 'updated'}])
+    report = tempfile.NamedTemporaryFile(suffix='.csv.gz')
+    client.GetDataDownloader().DownloadReportToFile('job', 'CSV_DUMP', report)
+    report.close()
+
+    replay = adscan.replay.ReplayClient(self.WORK_DIR)
+    results = replay.GetService('CreativeService').getCreativesByStatement({'query': 'WHERE id IN (1,2,3)'})['results']
+    assert [(c['id'], c['htmlSnippet']) for c in results] == [(1, 'snippet 1'), (2, 'snippet 2')]
+    assert adscan.replay.load_creatives(self.WORK_DIR)[2]['xsi_type'] == 'CustomCreative'
+    assert len(open('%s/%s' % (self.WORK_DIR, adscan.replay.UPDATES_FILE)).readlines()) == 1
+
+    fixture = gzip.open('%s/%s' % (self.WORK_DIR, adscan.replay.REPORT_FILE))
+    assert list(adscan.dfp.read_report_records(fixture)) == [(1, 10), (2, 20)]
+    fixture.close()
+
+  def test_unknown_backend(self):
+    """
+    Test that an unknown backend and a replay backend without fixtures are rejected.
+    """
+    self.assertRaises(Exception, adscan.dfp.set_backend, 'mock')
+    self.assertRaises(Exception, adscan.dfp.set_backend, 'replay')
+
+
+class FakeClient(object):
+  """
+  DFP client that returns creatives of ids and a report without DFP.
+  """
+
+  def GetService(self, service_name, version=None):
+    return FakeService()
+
+  def GetDataDownloader(self, version=None):
+    return FakeDataDownloader()
+
+
+class FakeService(object):
+  """
+  Creative service that returns a creative for each id in the statement.
+  """
+
+  def getCreativesByStatement(self, statement):
+    ids = adscan.replay.ID_PATTERN.search(statement['query']).group(1).split(',')
+    return {'results': [{'xsi_type': 'CustomCreative', 'id': int(i), 'htmlSnippet': 'snippet %s' % i} for i in ids]}
+
+  def updateCreatives(self, creatives):
+    return creatives
+
+
+class FakeDataDownloader(object):
+  """
+  Data downloader that writes a report of two creatives.
+  """
+
+  def WaitForReport(self, report_job):
+    return 'job'
+
+  def DownloadReportToFile(self, report_job_id, export_format, outfile):
+    report = gzip.GzipFile(fileobj=outfile, mode='wb')
+    report.write('Dimension.CREATIVE_ID,Column.AD_SERVER_IMPRESSIONS\n1,10\n2,20\n')
+    report.close()
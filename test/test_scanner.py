@@ -12,11 +12,22 @@
 
 import os
 import os.path
+import datetime
 import unittest
 from ConfigParser import SafeConfigParser
 
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
 import adscan.fs
+import adscan.dfp
+import adscan.replay
+import adscan.archive
+import adscan.priority
+from adscan.model import Blob, Creative, CreativeCache, CreativeImpression, DfpCreative, SyncWatermark, Url, ScanLog, ScanLogDetail, HostVerdict
 from adscan.scanner import Scanner
+from adscan.deadline import Deadline
+from adscan.compliance import ComplianceAggregator
 
 
 CONFIG_FILE = 'config.ini'
@@ -119,3 +130,533 @@ class ScannerTestCase(unittest.TestCase):
 
     adscan.fs.rmdirs(scanner.log_dir)
     os.remove(tarname)
+
+  def test_group_duplicate_creatives(self):
+    """
+    Test that only one creative is scanned for the creatives that have the same snippet, and the scan log is copied to
+    the others.
+    """
+    creatives = [
+      Creative(creative_id=1, snippet='<img src="http://example.com/a.png?ord=%n">'),
+      Creative(creative_id=2, snippet='<img src="http://example.com/a.png?ord=%%CACHEBUSTER%%">'),
+      Creative(creative_id=3, snippet='<img src="http://example.com/b.png">')
+    ]
+    unique_creatives = self.scanner._group_duplicate_creatives(creatives, 'http')
+    assert [c.creative_id for c in unique_creatives] == [1, 3]
+
+    self.scanner.scanlog('1', 0, 'http', url='http://example.com/a.png')
+    self.scanner.db_session.commit()
+    scanlogs = self.scanner.db_session.query(ScanLogDetail).filter(ScanLogDetail.url == 'http://example.com/a.png').all()
+    assert sorted([scanlog.creative_id for scanlog in scanlogs]) == [1, 2]
+
+  def test_select_incremental_creatives(self):
+    """
+    Test that only the creatives that may have changed are scanned, and the others carry forward the last scan results.
+    """
+    today = datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    long_ago = today - datetime.timedelta(days=self.scanner.max_scan_age + 1)
+    self.scanner.rescan_days = 1000000
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': yesterday, 'creative_id': 1, 'snippet_hash': 'a', 'scanned_at': yesterday, 'compliance': True,
+       'request_match': False},
+      {'created_at': yesterday, 'creative_id': 2, 'snippet_hash': 'b', 'scanned_at': yesterday, 'compliance': True,
+       'request_match': True},
+      {'created_at': yesterday, 'creative_id': 4, 'snippet_hash': 'd', 'scanned_at': long_ago, 'compliance': True,
+       'request_match': True}
+    ])
+    # Deferred over http, so it has no request match.
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': yesterday, 'creative_id': 5, 'snippet_hash': 'e', 'scanned_at': yesterday, 'compliance': True,
+       'deferred': True}
+    ])
+
+    creatives = [
+      Creative(creative_id=1, snippet_hash='a'),
+      Creative(creative_id=2, snippet_hash='changed'),
+      Creative(creative_id=3, snippet_hash='c'),
+      Creative(creative_id=4, snippet_hash='d'),
+      Creative(creative_id=5, snippet_hash='e')
+    ]
+    to_scan = self.scanner._select_incremental_creatives(creatives)
+    assert [c.creative_id for c in to_scan] == [2, 3, 4, 5]
+    assert creatives[0].compliance
+    self.assertFalse(creatives[0].request_match)
+    assert creatives[0].scanned_at == yesterday
+
+    self.scanner.rescan_days = 0
+    creatives = [Creative(creative_id=1, snippet_hash='a')]
+    assert self.scanner._select_incremental_creatives(creatives) == creatives
+
+  def test_select_creatives_of_changed_hosts(self):
+    """
+    Test that the creatives that made requests to a host whose compliance changed after their last scan are scanned
+    again, and the scan logs of the other days are not used.
+    """
+    today = datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    two_days_ago = today - datetime.timedelta(days=2)
+    self.scanner.rescan_days = 1000000
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': yesterday, 'creative_id': i, 'snippet_hash': 'a', 'scanned_at': yesterday, 'compliance': True,
+       'request_match': True} for i in [1, 2, 3]
+    ])
+    self.scanner.db_session.execute(ScanLog.__table__.insert(), [
+      {'created_at': yesterday, 'creative_id': 1, 'issue_id': 0, 'protocol': 'https', 'url': 'https://changed.com/a'},
+      {'created_at': yesterday, 'creative_id': 2, 'issue_id': 0, 'protocol': 'https', 'url': 'https://same.com/a'},
+      {'created_at': two_days_ago, 'creative_id': 3, 'issue_id': 0, 'protocol': 'https', 'url': 'https://changed.com/a'}
+    ])
+    self.scanner.db_session.add_all([
+      HostVerdict(host='changed.com', compliance=False, changed_at=today),
+      HostVerdict(host='same.com', compliance=True, changed_at=two_days_ago)
+    ])
+    self.scanner.db_session.commit()
+
+    creatives = [Creative(creative_id=i, snippet_hash='a') for i in [1, 2, 3]]
+    assert [c.creative_id for c in self.scanner._select_incremental_creatives(creatives)] == [1]
+
+  def test_check_compliance_from_scanlog(self):
+    """
+    Test that the compliance is aggregated from the scan logs in the database if the creatives were not browsed by the
+    scanner.
+    """
+    today = datetime.date.today()
+    self.scanner.incremental = False
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': today, 'creative_id': i} for i in [1, 2, 3]
+    ])
+    self.scanner.db_session.execute(ScanLog.__table__.insert(), [
+      {'created_at': today, 'creative_id': 1, 'issue_id': 0, 'protocol': 'https', 'url': 'https://example.com/a.png'},
+      {'created_at': today, 'creative_id': 1, 'issue_id': None, 'protocol': 'http', 'url': 'http://example.com/a.png'},
+      {'created_at': today, 'creative_id': 2, 'issue_id': 3, 'protocol': 'https', 'url': 'http://example.com/b.png'},
+      {'created_at': today, 'creative_id': 3, 'issue_id': 9, 'protocol': 'https', 'url': None},
+      {'created_at': today, 'creative_id': 3, 'issue_id': None, 'protocol': 'http', 'url': 'http://example.com/c.png'}
+    ])
+    self.scanner.check_compliance()
+
+    creatives = self.scanner.db_session.query(
+      Creative.creative_id, Creative.compliance, Creative.request_match
+    ).order_by(Creative.creative_id).all()
+    assert creatives == [(1, True, True), (2, False, None), (3, True, False)]
+
+  def test_update_and_backfill_caches(self):
+    """
+    Test that the cache keeps the latest snippet of each creative, and the missing creatives are filled from the
+    creative table.
+    """
+    today = datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': yesterday, 'creative_id': 1, 'snippet': 'old'},
+      {'created_at': today, 'creative_id': 1, 'snippet': None},
+      {'created_at': yesterday, 'creative_id': 2, 'snippet': 'old'},
+      {'created_at': today, 'creative_id': 2, 'snippet': 'new'}
+    ])
+    self.scanner._update_caches([Creative(creative_id=3, snippet='three')])
+    self.scanner.db_session.commit()
+    self.scanner._update_caches([Creative(creative_id=3, snippet='updated')])
+    self.scanner.db_session.commit()
+
+    self.scanner.backfill_creative_cache()
+    caches = self.scanner._load_caches([1, 2, 3, 4])
+    assert sorted((cache.creative_id, cache.snippet) for cache in caches) == [(1, 'old'), (2, 'new'), (3, 'updated')]
+
+  def test_compact_snippets(self):
+    """
+    Test that the snippets stored by older versions are moved to the blob table.
+    """
+    today = datetime.date.today()
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': today, 'creative_id': i, 'snippet': 'same', 'expanded_snippet': 'e%d' % i} for i in xrange(1, 6)
+    ])
+    self.scanner.compact_snippets(batch_size=2)
+
+    assert self.scanner.db_session.query(Creative).filter(Creative._snippet != None).count() == 0
+    assert self.scanner.db_session.query(Blob).count() == 6
+    creative = self.scanner.db_session.query(Creative).filter(Creative.creative_id == 3).one()
+    assert (creative.snippet, creative.expanded_snippet) == ('same', 'e3')
+
+  def test_check_compliance_from_host_counts(self):
+    """
+    Test that the compliance is aggregated from the scan logs aggregated by hosts.
+    """
+    today = datetime.date.today()
+    self.scanner.incremental = False
+    self.scanner.scanlog_mode = 'host'
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': today, 'creative_id': i} for i in [1, 2]
+    ])
+    self.scanner.scanlog(1, 0, 'https', url='https://example.com/a.png')
+    self.scanner.scanlog(1, 0, 'https', url='https://example.com/b.png')
+    self.scanner.scanlog(1, None, 'http', url='http://example.com/a.png')
+    self.scanner.scanlog(2, 3, 'https', url='http://example.com/c.png')
+    self.scanner.db_session.commit()
+    self.scanner.compliance = ComplianceAggregator()
+    self.scanner.check_compliance()
+
+    creatives = self.scanner.db_session.query(
+      Creative.creative_id, Creative.compliance, Creative.request_match
+    ).order_by(Creative.creative_id).all()
+    assert creatives == [(1, True, False), (2, False, None)]
+
+  def test_archive_old_rows(self):
+    """
+    Test that the old rows are moved to the archive files with their snippets and URLs, and the snippets and URLs no
+    longer referred to are deleted.
+    """
+    today = datetime.date.today()
+    old = today - datetime.timedelta(days=self.scanner.retention_days + 1)
+    self.scanner.archive_dir = os.path.join(self.scanner.log_dir, 'archive')
+    self.scanner.db_session.add(Creative(creative_id=1, snippet='new'))
+    self.scanner.db_session.add(Blob.from_text('old'))
+    self.scanner.db_session.add(Url(url='http://example.com/a.png'))
+    self.scanner.db_session.commit()
+    url_id = self.scanner.db_session.query(Url.id).scalar()
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': old, 'creative_id': i, 'snippet_ref': Blob.hash_text('old'), 'compliance': True} for i in [1, 2, 3]
+    ])
+    self.scanner.db_session.execute(ScanLog.__table__.insert(), [
+      {'created_at': old, 'creative_id': 1, 'issue_id': 3, 'protocol': 'https', 'url_id': url_id}
+    ])
+    self.scanner.db_session.commit()
+    self.scanner.urls.intern(self.scanner.db_session, ['http://example.com/a.png'])
+
+    self.scanner.archive_old_rows(batch_size=2)
+
+    creatives = list(adscan.archive.read_archive(
+      self.scanner.archive_dir, 'creative', old, columns=['creative_id', 'snippet', 'compliance']))
+    assert creatives == [{'creative_id': i, 'snippet': 'old', 'compliance': True} for i in [1, 2, 3]]
+    scanlogs = list(adscan.archive.read_archive(self.scanner.archive_dir, 'scanlog', old, today))
+    assert [(s['created_at'], s['url']) for s in scanlogs] == [(old.isoformat(), 'http://example.com/a.png')]
+
+    assert self.scanner.db_session.query(Creative).count() == 1
+    assert self.scanner.db_session.query(ScanLog).count() == 0
+    assert [blob.text() for blob in self.scanner.db_session.query(Blob).all()] == ['new']
+    assert self.scanner.db_session.query(Url).count() == 0
+    assert self.scanner.urls.ids == {}
+
+    # The rows left by a run that failed to delete them are archived again without duplicates.
+    self.scanner.db_session.execute(ScanLog.__table__.insert(), [
+      {'created_at': old, 'creative_id': 1, 'issue_id': 3, 'protocol': 'https', 'url': 'http://example.com/a.png'}
+    ])
+    self.scanner.db_session.commit()
+    self.scanner.archive_old_rows()
+    assert len(list(adscan.archive.read_archive(self.scanner.archive_dir, 'scanlog', old))) == 1
+
+  def test_save_report_records(self):
+    """
+    Test that the report records are saved in chunks, and the impressions of the day replace the ones saved before
+    only when the whole report is saved.
+    """
+    today = datetime.date.today()
+    served_at = today - datetime.timedelta(days=self.scanner.days_ago)
+    self.scanner.db_session.add(Creative(creative_id=1))
+    self.scanner.db_session.commit()
+
+    records = iter([(1, 100), (2, 20), (3, 3)])
+    assert self.scanner._save_report_records(records, chunk_size=2) == (2, 1)
+    assert self.scanner._save_report_records(iter([(1, 150), (2, 30)]), chunk_size=2) == (0, 2)
+
+    assert self.scanner.db_session.query(Creative).filter(Creative.created_at == today).count() == 3
+    impressions = self.scanner.db_session.query(
+      CreativeImpression.served_at, CreativeImpression.creative_id, CreativeImpression.impressions
+    ).order_by(CreativeImpression.creative_id).all()
+    assert impressions == [(served_at, 1, 150), (served_at, 2, 30)]
+
+    def failing_records():
+      yield (1, 200)
+      yield (2, 40)
+      yield (3, 5)
+      raise IOError('The report stream was closed.')
+
+    self.assertRaises(IOError, self.scanner._save_report_records, failing_records(), chunk_size=2)
+    impressions = self.scanner.db_session.query(
+      CreativeImpression.served_at, CreativeImpression.creative_id, CreativeImpression.impressions
+    ).order_by(CreativeImpression.creative_id).all()
+    assert impressions == [(served_at, 1, 150), (served_at, 2, 30)]
+
+  def test_update_priorities(self):
+    """
+    Test that the creatives with more impressions, changed snippets or a non-compliant last scan get higher priority.
+    """
+    today = datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    served_at = today - datetime.timedelta(days=self.scanner.days_ago)
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': yesterday, 'creative_id': 1, 'snippet_hash': 'a', 'compliance': True, 'scanned_at': yesterday},
+      {'created_at': yesterday, 'creative_id': 2, 'snippet_hash': 'b', 'compliance': False, 'scanned_at': yesterday},
+      {'created_at': yesterday, 'creative_id': 3, 'snippet_hash': 'c', 'compliance': True, 'scanned_at': yesterday}
+    ])
+    self.scanner.db_session.execute(CreativeImpression.__table__.insert(), [
+      {'served_at': served_at, 'creative_id': 3, 'created_at': today, 'impressions': 100000}
+    ])
+    creatives = [
+      Creative(creative_id=1, snippet_hash='a'),
+      Creative(creative_id=2, snippet_hash='b'),
+      Creative(creative_id=3, snippet_hash='c'),
+      Creative(creative_id=4, snippet_hash='d')
+    ]
+    for creative in creatives:
+      self.scanner.db_session.add(creative)
+    self.scanner.db_session.commit()
+
+    self.scanner._update_priorities(creatives)
+    self.scanner.db_session.commit()
+
+    ordered = self.scanner.db_session.query(
+      Creative.creative_id
+    ).filter(
+      Creative.created_at == today
+    ).order_by(
+      Creative.priority.desc()
+    ).all()
+    assert [creative_id for (creative_id,) in ordered] == [3, 4, 2, 1]
+
+    # The history loaded before the snippets are known is used again after that.
+    history = self.scanner._load_priority_history([1, 2, 3, 4])
+    priority = creatives[0].priority
+    creatives[0].snippet_hash = 'changed'
+    self.scanner._update_priorities(creatives, history)
+    assert creatives[0].priority == priority + adscan.priority.CHANGED_WEIGHT
+
+  def test_browse_creatives_with_writer(self):
+    """
+    Test that the scan logs of the previous run are replaced by the background writer over http without waiting for the
+    lock of the database.
+    """
+    today = datetime.date.today()
+    self.scanner.incremental = False
+    self.scanner.http_modified_only = False
+    self.scanner.certificate_file = self.scanner.privatekey_file = os.path.join('conf', CONFIG_FILE)
+    # The urls on a private network are reported without requests, so no browser is needed.
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': today, 'creative_id': 1, 'creative_type': 'ImageCreative', 'snippet': 'http://127.0.0.1/a.png'}
+    ])
+    self.scanner.db_session.execute(ScanLog.__table__.insert(), [
+      {'created_at': today, 'creative_id': 1, 'issue_id': None, 'protocol': 'http', 'url': 'http://example.com/old.png'}
+    ])
+    self.scanner.db_session.commit()
+
+    self.scanner.browse_creatives('http')
+
+    session = sessionmaker(bind=self.scanner.db_session.get_bind())()
+    scanlogs = session.query(ScanLogDetail).filter(ScanLogDetail.protocol == 'http').all()
+    assert [(s.creative_id, s.issue_id, s.url) for s in scanlogs] == [(1, 8, 'http://127.0.0.1/a.png')]
+    session.close()
+
+  def test_browse_creatives_defers_analyzed_creatives(self):
+    """
+    Test that the creatives scanned without browsers are deferred when the deadline leaves no time for them.
+    """
+    today = datetime.date.today()
+    self.scanner.incremental = False
+    self.scanner.certificate_file = self.scanner.privatekey_file = os.path.join('conf', CONFIG_FILE)
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': today, 'creative_id': 1, 'creative_type': 'ImageCreative', 'snippet': 'http://127.0.0.1/a.png'}
+    ])
+    self.scanner.db_session.commit()
+    self.scanner.deadline = Deadline(datetime.datetime.now() - datetime.timedelta(minutes=1))
+
+    self.scanner.browse_creatives('https')
+
+    creative = self.scanner.db_session.query(Creative).one()
+    assert (creative.deferred, creative.scanned_at) == (True, None)
+    assert self.scanner.db_session.query(ScanLogDetail).all() == []
+
+  def test_browse_creatives_without_reloading(self):
+    """
+    Test that the creatives browsed over https are marked as scanned today without loading them again one by one.
+    """
+    today = datetime.date.today()
+    self.scanner.incremental = False
+    self.scanner.certificate_file = self.scanner.privatekey_file = os.path.join('conf', CONFIG_FILE)
+    self.scanner.db_session.execute(Creative.__table__.insert(), [
+      {'created_at': today, 'creative_id': i, 'creative_type': 'ImageCreative', 'deferred': True,
+       'snippet': 'http://127.0.0.1/%d.png' % i} for i in [1, 2, 3]
+    ])
+    self.scanner.db_session.commit()
+
+    statements = []
+    engine = self.scanner.db_session.get_bind()
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, 'before_cursor_execute', listener)
+    try:
+      self.scanner.browse_creatives('https')
+    finally:
+      event.remove(engine, 'before_cursor_execute', listener)
+
+    reload_criteria = 'WHERE creative.created_at = ? AND creative.creative_id = ?'
+    reloads = [s for s in statements if s.startswith('SELECT') and reload_criteria in s]
+    assert reloads == []
+    creatives = self.scanner.db_session.query(
+      Creative.creative_id, Creative.scanned_at, Creative.deferred
+    ).order_by(Creative.creative_id).all()
+    assert creatives == [(i, today, False) for i in [1, 2, 3]]
+
+  def test_defer_creatives(self):
+    """
+    Test that the creatives left by the browsers and their duplicates are recorded as deferred and not scanned today.
+    """
+    today = datetime.date.today()
+    for creative_id in [1, 2, 3]:
+      self.scanner.db_session.add(Creative(creative_id=creative_id, scanned_at=today, deferred=False))
+    self.scanner.db_session.commit()
+    self.scanner.duplicate_ids = {'1': [2]}
+
+    self.scanner._defer_creatives([Creative(creative_id=1)], 'https')
+    self.scanner._defer_creatives([Creative(creative_id=3)], 'http')
+
+    creatives = self.scanner.db_session.query(
+      Creative.creative_id, Creative.deferred, Creative.scanned_at
+    ).order_by(Creative.creative_id).all()
+    assert creatives == [(1, True, None), (2, True, None), (3, True, today)]
+
+  def test_reuse_stored_dfp_creatives(self):
+    """
+    Test that the DFP objects stored in the download step are used for the upload, and only the creatives modified in
+    DFP since then are replaced.
+    """
+    def dfp_creative(creative_id, minute, url):
+      return {
+        'xsi_type': 'ImageCreative',
+        'id': creative_id,
+        'primaryImageAsset': {'xsi_type': 'CreativeAsset', 'assetUrl': url},
+        'lastModifiedDateTime': {'date': {'year': 2014, 'month': 5, 'day': 1}, 'hour': 9, 'minute': minute, 'second': 0}
+      }
+
+    self.scanner._save_dfp_creatives([
+      dfp_creative(1, 0, 'http://example.com/1.png'),
+      dfp_creative(2, 0, 'http://example.com/2.png'),
+      {'xsi_type': 'TemplateCreative', 'id': 3}
+    ])
+    self.scanner.db_session.commit()
+    assert sorted(s.creative_id for s in self.scanner.db_session.query(DfpCreative).all()) == [1, 2]
+
+    statements = []
+
+    def run_statements(stmts):
+      statements.extend(stmts)
+      if 'lastModifiedDateTime' in stmts[0]['query']:
+        return [dfp_creative(2, 5, 'http://example.com/new.png')]
+      return [{'xsi_type': 'TemplateCreative', 'id': 3}]
+
+    self.scanner._run_creative_service_statements = run_statements
+    dfp_creatives = self.scanner._load_upload_dfp_creatives([1, 2, 3])
+
+    urls = dict((dfp['id'], dfp.get('primaryImageAsset', {}).get('assetUrl')) for dfp in dfp_creatives)
+    assert urls == {1: 'http://example.com/1.png', 2: 'http://example.com/new.png', 3: None}
+    assert statements[0]['values'][0]['value']['value'] == '2014-05-01T09:00:00'
+    assert 'id IN (3)' in statements[1]['query']
+
+  def test_upload_creatives(self):
+    """
+    Test that the creatives confirmed by DFP are marked as uploaded in the database.
+    """
+    fixture_dir = os.path.join(self.scanner.log_dir, 'fixtures')
+    adscan.replay.generate_fixtures(fixture_dir, 2)
+    adscan.dfp.set_backend('replay', fixture_dir)
+    try:
+      self.scanner._save_dfp_creatives([adscan.replay.load_creatives(fixture_dir)[2]])
+      self.scanner.db_session.add(Creative(
+        created_at=datetime.date.today(), creative_id=2, creative_type='ImageCreative', modified=True, compliance=True,
+        request_match=True, snippet='http://example.com/2.png', modified_snippet='https://example.com/2.png'))
+      self.scanner.db_session.commit()
+      self.scanner._run_creative_service_statements = lambda statements: []
+
+      self.scanner.upload_creatives()
+    finally:
+      adscan.dfp.set_backend('live')
+
+    session = sessionmaker(bind=self.scanner.db_session.get_bind())()
+    assert session.query(Creative.creative_id, Creative.uploaded).all() == [(2, True)]
+    session.close()
+
+  def test_incremental_sync(self):
+    """
+    Test that the download after the first one asks for the creatives modified since the window of the first one or
+    the watermark, expires the caches of the modified creatives not served today, and advances the watermark on commit.
+    """
+    fixture_dir = os.path.join(self.scanner.log_dir, 'fixtures')
+    adscan.replay.generate_fixtures(fixture_dir, 10)
+    adscan.dfp.set_backend('replay', fixture_dir)
+    try:
+      self.scanner.db_session.execute(Creative.__table__.insert(), [
+        {'created_at': datetime.date.today(), 'creative_id': i} for i in xrange(1, 9)])
+      self.scanner.download_creatives()
+
+      # The first watermark is the start of the window of the first download.
+      watermark = self.scanner.db_session.query(SyncWatermark).get(adscan.replay.REPLAY_NETWORK_CODE)
+      fixtures = adscan.replay.load_creatives(fixture_dir)
+      first_since = datetime.date.today() - datetime.timedelta(days=self.scanner.days_ago)
+      assert watermark.synced_until == first_since.strftime('%Y-%m-%dT%H:%M:%S')
+      caches = dict((c.creative_id, c) for c in self.scanner.db_session.query(CreativeCache).all())
+      assert sorted(caches.keys()) == range(1, 9)
+      assert caches[3].last_modified == adscan.dfp.last_modified(fixtures[3])
+
+      # Creative 2 gets a new snippet and creative 8, which is not served today, is modified.
+      fixtures[2]['primaryImageAsset']['assetUrl'] = 'https://example.com/new.png'
+      adscan.dfp.creative_service().updateCreatives([fixtures[2], fixtures[8]])
+      self.scanner.db_session.query(Creative).filter(Creative.creative_id == 8).delete()
+      self.scanner.db_session.commit()
+
+      since, statements = [], []
+      download_modified_creatives = self.scanner._download_modified_creatives
+
+      def download(value):
+        since.append(value)
+        return download_modified_creatives(value)
+
+      self.scanner._download_modified_creatives = download
+      self.scanner._run_creative_service_statements = lambda stmts: statements.extend(stmts) or []
+      synced_until = watermark.synced_until
+      self.scanner.download_creatives()
+
+      assert since == [adscan.dfp.shift_time(synced_until, -self.scanner.sync_overlap * 60)]
+      assert statements == []
+      creative = self.scanner.db_session.query(Creative).filter(Creative.creative_id == 2).one()
+      assert creative.snippet == 'https://example.com/new.png'
+      caches = dict((c.creative_id, c) for c in self.scanner.db_session.query(CreativeCache).all())
+      assert sorted(caches.keys()) == range(1, 8)
+      modified = adscan.dfp.last_modified(
+        adscan.dfp.creative_service().getCreativesByStatement({'query': 'WHERE id IN (2)'})['results'][0])
+      assert caches[2].last_modified == modified
+      assert self.scanner.db_session.query(SyncWatermark).one().synced_until == max(modified, synced_until)
+    finally:
+      adscan.dfp.set_backend('live')
+
+  def test_sync_watermark_ignores_refetched_creatives(self):
+    """
+    Test that the watermark advances only to the newest creative modified since the watermark, and not to a newer
+    creative downloaded again because it had no cache. The watermark stays when no creative was modified.
+    """
+    fixture_dir = os.path.join(self.scanner.log_dir, 'fixtures')
+    adscan.replay.generate_fixtures(fixture_dir, 2)
+    fixtures = adscan.replay.load_creatives(fixture_dir)
+
+    def dfp_creative(creative_id, day):
+      dfp = dict(fixtures[creative_id])
+      dfp['lastModifiedDateTime'] = {
+        'date': {'year': 2014, 'month': 5, 'day': day}, 'hour': 9, 'minute': 0, 'second': 0}
+      return dfp
+
+    adscan.dfp.set_backend('replay', fixture_dir)
+    try:
+      self.scanner.db_session.execute(Creative.__table__.insert(), [
+        {'created_at': datetime.date.today(), 'creative_id': i} for i in xrange(1, 3)])
+      self.scanner.db_session.add(SyncWatermark(
+        network_code=adscan.dfp.network_code(), synced_until='2014-05-01T09:00:00'))
+      self.scanner.db_session.commit()
+
+      # Creative 1 is modified since the watermark, and creative 2, which has no cache, was modified later.
+      self.scanner._download_modified_creatives = lambda since: [dfp_creative(1, 3)]
+      self.scanner._run_creative_service_statements = lambda stmts: [dfp_creative(2, 9)]
+      self.scanner.download_creatives()
+      assert self.scanner.db_session.query(SyncWatermark).one().synced_until == '2014-05-03T09:00:00'
+
+      self.scanner.db_session.query(CreativeCache).filter(CreativeCache.creative_id == 2).delete()
+      self.scanner.db_session.commit()
+      self.scanner._download_modified_creatives = lambda since: []
+      self.scanner.download_creatives()
+      assert self.scanner.db_session.query(SyncWatermark).one().synced_until == '2014-05-03T09:00:00'
+    finally:
+      adscan.dfp.set_backend('live')
@@ -98,6 +98,15 @@ class TransformTestCase(unittest.TestCase):
     assert creative.modified_snippet == '<img src="//example.com">'
     assert creative.modified_expanded_snippet == '<img src="//example.com"><img src="http://example.net">'
 
+  def test_to_dfp_for_stored_creative(self):
+    """
+    Test that the type of a creative stored as a dictionary is read without the debug mode.
+    """
+    dfp_creative = {'xsi_type': 'ImageCreative', 'id': 1, 'primaryImageAsset': {'assetUrl': 'http://example.com/a.png'}}
+    creative = Creative(modified_snippet='https://example.com/a.png')
+    modified_dfp_creative = adscan.transform.to_dfp(creative, dfp_creative)
+    assert modified_dfp_creative['primaryImageAsset']['assetUrl'] == 'https://example.com/a.png'
+
   def test_to_dfp_for_third_party_creative(self):
     """
     Test that a modified creative should inserted into snippet for ThirdPartyCreative.
@@ -513,3 +522,70 @@ class TransformTestCase(unittest.TestCase):
     expect = '<img src="%https://www.example.com">'
     actual = adscan.transform.replace_percent_h(snippet, html=preview_html)
     assert expect == actual, 'Expected\n%s\n\nBut was\n%s' % (expect, actual)
+
+  def test_find_static_urls(self):
+    """
+    Test to find the urls in a static snippet.
+    """
+    snippet = '<a href="http://www.example.com"><img src="https://www.example.com/a.png"></a>' \
+              '<table background="//www.example.com/b.png"><tr><td><img src="c.png"></td></tr></table>'
+    expect = ['https://www.example.com/a.png', 'https://www.example.com/b.png']
+    actual = adscan.transform.find_static_urls(snippet, 'https')
+    assert expect == actual, 'Expected\n%s\n\nBut was\n%s' % (expect, actual)
+
+  def test_find_static_urls_over_http(self):
+    """
+    Test that protocol-relative urls are resolved with the protocol of the hosting page.
+    """
+    actual = adscan.transform.find_static_urls('<img src="//www.example.com/a.png">', 'http')
+    assert ['http://www.example.com/a.png'] == actual
+
+  def test_find_static_urls_with_http(self):
+    """
+    Test that http urls are found in a static snippet if they are allowed.
+    """
+    actual = adscan.transform.find_static_urls('<img src="http://www.example.com/a.png">', 'http', allow_http=True)
+    assert ['http://www.example.com/a.png'] == actual
+
+  def test_find_static_urls_without_urls(self):
+    """
+    Test that no url is found in a static snippet without external resources.
+    """
+    assert [] == adscan.transform.find_static_urls('<b>text</b>', 'https')
+
+  def test_find_static_urls_in_dynamic_snippet(self):
+    """
+    Test that dynamic snippets are not regarded as static.
+    """
+    snippets = [
+      '<script src="https://www.example.com/ad.js"></script>',
+      '<iframe src="https://www.example.com/ad.html"></iframe>',
+      '<embed src="https://www.example.com/ad.swf">',
+      '<img src="https://www.example.com/a.png" onload="track()">',
+      '<div style="background:url(https://www.example.com/a.png)"></div>',
+      '<img src="http://www.example.com/a.png">',
+      '<img src="data:image/png;base64,AAAA">',
+      'https://www.example.com/a.png',
+    ]
+    for snippet in snippets:
+      assert adscan.transform.find_static_urls(snippet, 'https') is None, snippet
+
+  def test_normalize_snippet(self):
+    """
+    Test to remove the DFP macros from the snippet.
+    """
+    snippet = '<a href="%c%u"><img src="https://www.example.com/ad?ord=%%CACHEBUSTER%%&n=%n&c=%c3"></a>'
+    expect = '<a href=""><img src="https://www.example.com/ad?ord=&n=&c=%c3"></a>'
+    actual = adscan.transform.normalize_snippet(snippet)
+    assert expect == actual, 'Expected\n%s\n\nBut was\n%s' % (expect, actual)
+
+  def test_snippet_hash(self):
+    """
+    Test that the snippets only differ in the DFP macros have the same hash.
+    """
+    snippet1 = '<a href="%%CLICK_URL_UNESC%%http://www.example.com"><img src="%h/ad?ord=%%CACHEBUSTER%%"></a>'
+    snippet2 = '<a href="http://www.example.com"><img src="%h/ad?ord="></a>'
+    snippet3 = '<a href="http://www.example.com"><img src="%h/other?ord="></a>'
+    assert adscan.transform.snippet_hash(snippet1) == adscan.transform.snippet_hash(snippet2)
+    assert adscan.transform.snippet_hash(snippet1) != adscan.transform.snippet_hash(snippet3)
+    assert adscan.transform.snippet_hash(None) is None
@@ -0,0 +1,139 @@
+# Copyright 2014 LinkedIn Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+
+import datetime
+import unittest
+
+from sqlalchemy import func
+
+import adscan.db
+import adscan.fs
+from adscan.model import Url, ScanLog, ScanLogDetail, ScanLogHost
+from adscan.writer import ScanLogRecord, ScanLogWriter, UrlDictionary
+
+
+class WriterTestCase(unittest.TestCase):
+  """
+  Test the writer module.
+  """
+
+  WORK_DIR = '__writer_test__'
+
+  def setUp(self):
+    """
+    Create a database for the test.
+    """
+    adscan.fs.makedirs(self.WORK_DIR)
+    self.db_session = adscan.db.new_session(
+      'sqlite:///%s/creative.db' % self.WORK_DIR, [Url, ScanLog, ScanLogDetail, ScanLogHost])
+
+  def tearDown(self):
+    """
+    Remove the database.
+    """
+    self.db_session.close()
+    adscan.fs.rmdirs(self.WORK_DIR)
+
+  def test_write_in_batches(self):
+    """
+    Test that all the records are written in batches.
+    """
+    writer = ScanLogWriter(self.db_session.get_bind(), ScanLog.__table__, batch_size=2, flush_interval=60)
+    writer.start()
+    for i in xrange(0, 5):
+      writer.put(ScanLogRecord(datetime.date.today(), i, 0, 'https', url='https://example.com/%d' % i))
+    writer.close()
+
+    assert self.db_session.query(ScanLog).count() == 5
+    stats = writer.stats()
+    assert stats['records'] == 5
+    assert stats['flushes'] == 3
+    assert stats['queue_depth'] == 0
+
+  def test_write_after_interval(self):
+    """
+    Test that the records are written when the flush interval passed.
+    """
+    writer = ScanLogWriter(self.db_session.get_bind(), ScanLog.__table__, batch_size=100, flush_interval=0.01)
+    writer.start()
+    writer.put(ScanLogRecord(datetime.date.today(), 1, 9, 'https'))
+    writer.join(0.5)
+    assert writer.record_count == 1
+    writer.close()
+    assert self.db_session.query(ScanLog).count() == 1
+
+  def test_write_url_ids(self):
+    """
+    Test that each URL is stored once and the scan logs refer to it.
+    """
+    urls = UrlDictionary(Url.__table__, chunk_size=2)
+    writer = ScanLogWriter(self.db_session.get_bind(), ScanLog.__table__, batch_size=3, flush_interval=60, urls=urls)
+    writer.start()
+    for i in xrange(0, 4):
+      writer.put(ScanLogRecord(datetime.date.today(), i, 0, 'https', url='https://example.com/%d' % (i % 2)))
+    writer.put(ScanLogRecord(datetime.date.today(), 5, 9, 'https'))
+    writer.close()
+
+    assert self.db_session.query(Url).count() == 2
+    assert self.db_session.query(ScanLog).filter(ScanLog.url_id != None).count() == 4
+    details = self.db_session.query(ScanLogDetail.creative_id, ScanLogDetail.url).order_by(ScanLogDetail.creative_id).all()
+    assert details == [(0, 'https://example.com/0'), (1, 'https://example.com/1'), (2, 'https://example.com/0'),
+                       (3, 'https://example.com/1'), (5, None)]
+
+  def test_write_host_counts(self):
+    """
+    Test that the records are aggregated by hosts.
+    """
+    writer = ScanLogWriter(self.db_session.get_bind(), ScanLogHost.__table__, batch_size=2, flush_interval=60, aggregate=True)
+    writer.start()
+    today = datetime.date.today()
+    writer.put(ScanLogRecord(today, 1, 0, 'https', url='https://a.example.com/1'))
+    writer.put(ScanLogRecord(today, 1, 0, 'https', url='https://a.example.com/2'))
+    writer.put(ScanLogRecord(today, 1, 3, 'https', url='http://b.example.com/1'))
+    writer.put(ScanLogRecord(today, 2, 9, 'https'))
+    writer.close()
+
+    rows = self.db_session.query(
+      ScanLogHost.creative_id, ScanLogHost.host, ScanLogHost.issue_id, ScanLogHost.count
+    ).order_by(ScanLogHost.creative_id, ScanLogHost.host).all()
+    assert rows == [(1, 'a.example.com', 0, 2), (1, 'b.example.com', 3, 1), (2, None, 9, 0)]
+
+  def test_write_host_counts_periodically(self):
+    """
+    Test that the aggregated records are inserted before the writer is closed, and the counts split into multiple rows
+    add up.
+    """
+    writer = ScanLogWriter(self.db_session.get_bind(), ScanLogHost.__table__, batch_size=100, flush_interval=0.01,
+                           aggregate=True, host_flush_interval=0)
+    writer.start()
+    today = datetime.date.today()
+    writer.put(ScanLogRecord(today, 1, 0, 'https', url='https://a.example.com/1'))
+    writer.join(0.5)
+    assert self.db_session.query(ScanLogHost).count() == 1
+    writer.put(ScanLogRecord(today, 1, 0, 'https', url='https://a.example.com/2'))
+    writer.close()
+    assert self.db_session.query(func.sum(ScanLogHost.count)).scalar() == 2
+
+  def test_raise_error_on_put(self):
+    """
+    Test that the error that stopped the writer is raised to the threads putting records, and the queue is bounded.
+    """
+    # The database has no scanlog table.
+    engine = adscan.db.new_engine('sqlite:///%s/empty.db' % self.WORK_DIR)
+    writer = ScanLogWriter(engine, ScanLog.__table__, batch_size=1, flush_interval=60, max_queue_size=2)
+    assert writer.queue.maxsize == 2
+    writer.start()
+    writer.put(ScanLogRecord(datetime.date.today(), 1, 0, 'https', url='https://example.com/1'))
+    writer.join(5)
+    assert writer.error is not None
+    self.assertRaises(Exception, writer.put, ScanLogRecord(datetime.date.today(), 2, 0, 'https'))
+    self.assertRaises(Exception, writer.close)